@@ -1,10 +1,16 @@
-import importlib
-
 import gradio as gr
 import torch
 
+import metrics
 from config import *
-from core.detect import detect, clear
+from core.detect import detect, detect_stream, clear
+from service.local import resolve_device
+from service.registry import registry
+
+# 没有GPU时本地模式在CPU上推理，只有指定了cuda时才不可用
+local_device = resolve_device()
+local_available = local_device == 'cpu' or torch.cuda.is_available()
+default_choice = "本地模式" if USE_LOCAL_MODEL and local_available else "API模式"
 
 # 创建Gradio界面
 with gr.Blocks(title="LVLM目标检测系统", theme=gr.themes.Soft(), css=CSS) as app:
@@ -52,29 +58,27 @@ with gr.Blocks(title="LVLM目标检测系统", theme=gr.themes.Soft(), css=CSS)
             gr.HTML("")
 
     # 模型选择
-    with gr.Row(visible=torch.cuda.is_available()):
+    with gr.Row(visible=local_available):
         with gr.Column(scale=1):
             gr.HTML("")
         with gr.Column(scale=3):
             with gr.Group(elem_classes=["model-toggle"]):
                 model_choice = gr.Radio(["API模式", "本地模式"],
                                         label="选择LVLM",
-                                        value="API模式" if not USE_LOCAL_MODEL else "本地模式",
-                                        info="API模式需要网络连接，本地模式推荐使用一张RTX 3090 24GB")
+                                        value=default_choice,
+                                        info="API模式需要网络连接，本地模式推荐使用一张RTX 3090 24GB"
+                                             if local_device == 'cuda' else
+                                             "API模式需要网络连接，本地模式当前在CPU上推理，速度较慢")
         with gr.Column(scale=1):
             gr.HTML("")
 
 
     def update_model_choice(choice):
-        import sys
-        # 动态修改配置
-        config_module = sys.modules['config']
-        setattr(config_module, 'USE_LOCAL_MODEL', choice == "本地模式")
-
-        # 重新加载核心模块以应用新配置
-        if 'core.detect' in sys.modules:
-            importlib.reload(sys.modules['core.detect'])
-
+        # 后端常驻内存，每次请求按选项选择后端，这里只确保已加载
+        try:
+            registry.get(BACKEND_CHOICES[choice])
+        except RuntimeError:
+            return "模型加载失败，请检查模型路径或环境配置。"
         return f"已切换到{choice}。"
 
 
@@ -83,27 +87,41 @@ with gr.Blocks(title="LVLM目标检测系统", theme=gr.themes.Soft(), css=CSS)
                         outputs=[text_output])
 
     # 事件绑定
-    detect_btn.click(fn=detect,
-                     inputs=[image_input, text_input],
-                     outputs=[text_output, image_output])
+    detect_fn = detect_stream if STREAM_OUTPUT else detect
+    # 允许多个请求同时进入，由微批调度器合并推理；流式请求不组批，detect_stream按STREAM_CONCURRENCY限制并拒绝超出的请求
+    detect_btn.click(fn=detect_fn,
+                     inputs=[image_input, text_input, model_choice],
+                     outputs=[text_output, image_output],
+                     concurrency_limit=BATCH_QUEUE_SIZE)
 
     clear_btn.click(fn=clear,
                     inputs=[],
                     outputs=[image_input, text_input, text_output, image_output])
 
     # 回车键
-    text_input.submit(fn=detect,
-                      inputs=[image_input, text_input],
-                      outputs=[text_output, image_output])
+    text_input.submit(fn=detect_fn,
+                      inputs=[image_input, text_input, model_choice],
+                      outputs=[text_output, image_output],
+                      concurrency_limit=BATCH_QUEUE_SIZE)
 
 # 启动应用
 if __name__ == "__main__":
-    if USE_LOCAL_MODEL and not torch.cuda.is_available():
+    if USE_LOCAL_MODEL and not local_available:
         print("未检测到可用的GPU。将自动切换到API模式。")
-        import sys
-
-        config_module = sys.modules['config']
-        setattr(config_module, 'USE_LOCAL_MODEL', False)
+    elif USE_LOCAL_MODEL and local_device == 'cpu':
+        print("未检测到可用的GPU，本地模式使用CPU推理。")
+
+    # 启动时加载并预热后端；默认只加载选中的后端，只用API时不在CPU上量化本地模型
+    for backend in PRELOAD_BACKENDS if PRELOAD_BACKENDS is not None else [BACKEND_CHOICES[default_choice]]:
+        if backend == 'local' and not local_available:
+            continue
+        try:
+            registry.load(backend)
+        except RuntimeError as e:
+            print(str(e))
+
+    # Prometheus指标
+    metrics.start_server()
 
     app.launch(share=True,
                debug=True,
@@ -0,0 +1,74 @@
+import argparse
+import random
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from core.annotate import Annotator, COLORS
+
+
+def legacy_annotate(image, detections, input_width, input_height):
+    # 原实现：每次加载字体，逐个缩放坐标，原地绘制
+    width, height = image.size
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.truetype("simhei.ttf", 25)
+    except:
+        try:
+            font = ImageFont.truetype("/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", 25)
+        except:
+            font = ImageFont.load_default()
+    for i, detection in enumerate(detections):
+        bbox = detection['bbox_2d']
+        color = COLORS[i % len(COLORS)]
+        x1 = int(bbox[0] / input_width * width)
+        y1 = int(bbox[1] / input_height * height)
+        x2 = int(bbox[2] / input_width * width)
+        y2 = int(bbox[3] / input_height * height)
+        bbox_text = draw.textbbox((x1, y1 - 50), detection['label'], font=font)
+        draw.rectangle([x1, y1, x2, y2], outline=color, width=5)
+        draw.rectangle([x1, y1 - 50, x1 + bbox_text[2] - bbox_text[0], y1], fill=color)
+        draw.text((x1, y1 - 50), detection['label'], fill='white', font=font)
+    return image
+
+
+def make_detections(count, input_width, input_height):
+    rng = random.Random(count)
+    detections = []
+    for i in range(count):
+        x, y = rng.randrange(input_width - 40), rng.randrange(input_height - 40)
+        detections.append({"bbox_2d": [x, y, min(input_width, x + rng.randrange(20, 300)),
+                                       min(input_height, y + rng.randrange(20, 300))],
+                           "label": f"物体{i}"})
+    return detections
+
+
+def bench(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="标注绘制的微基准测试（4K图像）")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--preview', type=int, default=1280, help="预览画布的最长边")
+    args = parser.parse_args()
+
+    image = Image.new('RGB', (3840, 2160), 'white')
+    input_width, input_height = 1288, 728
+    annotator = Annotator()
+    print(f"{'boxes':>6} {'legacy ms':>10} {'copy ms':>10} {'preview ms':>11}")
+    for count in (1, 50, 500):
+        detections = make_detections(count, input_width, input_height)
+        legacy = bench(lambda: legacy_annotate(image.copy(), detections, input_width, input_height), args.rounds)
+        full = bench(lambda: annotator.render(image, detections, input_width, input_height, max_side=None),
+                     args.rounds)
+        preview = bench(lambda: annotator.render(image, detections, input_width, input_height,
+                                                 max_side=args.preview), args.rounds)
+        print(f"{count:>6} {legacy:>10.1f} {full:>10.1f} {preview:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
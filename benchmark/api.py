@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+from PIL import Image
+
+import service.api as api
+from config import MIN_PIXELS, MAX_PIXELS, SYSTEM_PROMPT, MODEL_NAME
+from utils import encode_image, create_messages
+
+COMPLETION = {
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": MODEL_NAME,
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant",
+                             "content": '```json\n{"answer": "已完成标注。", "detections": []}\n```'}}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # 返回固定对话结果的本地服务，支持长连接
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency)
+        body = json.dumps(COMPLETION).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def legacy_api_model(image, prompt, min_pixels, max_pixels):
+    # 原实现：每次调用都新建客户端
+    image = encode_image(image)
+    client = OpenAI(api_key=api.API_KEY, base_url=api.API_BASE_URL)
+    messages = create_messages(image, prompt, SYSTEM_PROMPT, min_pixels, max_pixels)
+    completion = client.chat.completions.create(model=MODEL_NAME, messages=messages)
+    return completion.choices[0].message.content
+
+
+def run_threads(fn, image, requests, workers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(lambda _: fn(image, "图里面有什么？", MIN_PIXELS, MAX_PIXELS), range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+def run_async(image, requests):
+    async def run():
+        await asyncio.gather(*[api.api_model_async(image, "图里面有什么？", MIN_PIXELS, MAX_PIXELS)
+                               for _ in range(requests)])
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API模式客户端吞吐量测试（本地桩服务）")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02, help="桩服务每次响应的延迟秒数")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api.API_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    api.API_KEY = "stub"
+    image = Image.open('test/01.jpeg').convert('RGB')
+    image.thumbnail((256, 256))
+
+    print(f"{'mode':<24} {'requests/s':>10}")
+    print(f"{'legacy (client per call)':<24} {run_threads(legacy_api_model, image, args.requests, args.workers):>10.1f}")
+    print(f"{'pooled':<24} {run_threads(api.api_model, image, args.requests, args.workers):>10.1f}")
+    print(f"{'async':<24} {run_async(image, args.requests):>10.1f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import argparse
+
+from config import PROCESSOR_PATH
+from prompt import format_prompt, PROMPT
+from .common import tiny_local_model, load_images, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LocalModel批量推理吞吐量测试")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--max-tokens', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=2)
+    args = parser.parse_args()
+
+    local_model = tiny_local_model(args.processor)
+    images = load_images()
+    queries = ["图里面有什么？", "标注帆船和树", "人物在哪里？", "饮料是什么牌子？"]
+
+    # 预热
+    local_model.inference_batch(images[:1], [format_prompt(PROMPT, query=queries[0])], max_tokens=2)
+
+    print(f"{'batch':>6} {'images/s':>10} {'s/batch':>10}")
+    for batch_size in args.batch_sizes:
+        batch_images = [images[i % len(images)] for i in range(batch_size)]
+        prompts = [format_prompt(PROMPT, query=queries[i % len(queries)]) for i in range(batch_size)]
+        elapsed = 0.0
+        for _ in range(args.rounds):
+            _, seconds = timeit(local_model.inference_batch, batch_images, prompts, max_tokens=args.max_tokens)
+            elapsed += seconds
+        print(f"{batch_size:>6} {batch_size * args.rounds / elapsed:>10.2f} {elapsed / args.rounds:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
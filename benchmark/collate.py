@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+from transformers import AutoProcessor
+
+from config import PROCESSOR_PATH
+
+# finetune下的脚本以所在目录为工作目录运行，模块之间直接导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'finetune'))
+from collator import QwenVLCollator, PretokenizedDataset, PretokenizedCollator  # noqa: E402
+from pretokenize import load_examples, pretokenize  # noqa: E402
+
+
+def make_manifest(path, samples, seed=2025):
+    # 合成的JPEG和标注，格式同process.py的输出
+    rng = np.random.default_rng(seed)
+    sizes = [(640, 480), (1024, 768), (500, 375), (800, 1200)]
+    image_dir = os.path.join(path, 'train')
+    os.makedirs(image_dir, exist_ok=True)
+    with open(os.path.join(path, 'train.jsonl'), 'w', encoding='utf-8') as f:
+        for i in range(samples):
+            width, height = sizes[i % len(sizes)]
+            pixels = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+            image_path = os.path.join(image_dir, f"{i + 1:06d}.jpg")
+            Image.fromarray(pixels).resize((width, height)).save(image_path, quality=90)
+            x, y = int(rng.integers(0, width // 2)), int(rng.integers(0, height // 2))
+            bbox = [x, y, x + int(rng.integers(1, width // 2)), y + int(rng.integers(1, height // 2))]
+            f.write(json.dumps({"image": [image_path], "query": f"what is written on sign {i}?",
+                                "response": json.dumps({"bbox_2d": bbox})}) + '\n')
+
+
+def same_batch(a, b):
+    return all(torch.equal(a[key].long(), b[key].long()) if key == 'attention_mask' else torch.equal(a[key], b[key])
+               for key in a)
+
+
+def collate_ms(collator, batches, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            collator(batch)
+    return (time.perf_counter() - start) / (repeat * len(batches)) * 1000
+
+
+def loader_throughput(dataset, collator, batch_size, num_workers):
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=collator, num_workers=num_workers,
+                        generator=torch.Generator().manual_seed(2025))
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    return len(dataset) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="训练数据的collate耗时和DataLoader吞吐量：在线处理与预处理分片")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--samples', type=int, default=64)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--num-workers', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--max-seq-length', type=int, default=256)
+    parser.add_argument('--max-image-side', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        make_manifest(root, args.samples)
+        examples = load_examples(os.path.join(root, 'train.jsonl'))
+        processor = AutoProcessor.from_pretrained(args.processor)
+        online = QwenVLCollator(processor, max_seq_length=args.max_seq_length,
+                                max_img_side_length=args.max_image_side)
+
+        save_path = os.path.join(root, 'pretokenized')
+        start = time.perf_counter()
+        pretokenize(root, save_path, args.processor, ['train'], args.max_seq_length, args.max_image_side,
+                    shard_size=max(1, args.samples // 4), num_proc=1)
+        seconds = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(folder, name))
+                   for folder, _, names in os.walk(save_path) for name in names)
+        print(f"pretokenize: {seconds:.2f} s for {args.samples} samples, {size / 1024 / 1024:.1f} MB on disk")
+
+        dataset = PretokenizedDataset(os.path.join(save_path, 'train'))
+        offline = PretokenizedCollator()
+        for batch_size in args.batch_sizes:
+            indices = [list(range(i, min(i + batch_size, args.samples))) for i in range(0, args.samples, batch_size)]
+            for batch in indices:
+                assert same_batch(online([examples[i] for i in batch]), offline([dataset[i] for i in batch])), \
+                    "预处理分片的batch与在线处理不一致"
+
+        print(f"\n{'batch':>6} {'online ms':>10} {'mmap ms':>9} {'speedup':>8}")
+        for batch_size in args.batch_sizes:
+            indices = [list(range(i, min(i + batch_size, args.samples))) for i in range(0, args.samples, batch_size)]
+            online_ms = collate_ms(online, [[examples[i] for i in batch] for batch in indices], args.repeat)
+            offline_ms = collate_ms(offline, [[dataset[i] for i in batch] for batch in indices], args.repeat)
+            print(f"{batch_size:>6} {online_ms:>10.2f} {offline_ms:>9.3f} {online_ms / offline_ms:>7.0f}x")
+
+        print(f"\n{'workers':>8} {'online samples/s':>17} {'mmap samples/s':>15}")
+        batch_size = args.batch_sizes[-1]
+        for num_workers in args.num_workers:
+            online_rate = loader_throughput(examples, online, batch_size, num_workers)
+            offline_rate = loader_throughput(dataset, offline, batch_size, num_workers)
+            print(f"{num_workers:>8} {online_rate:>17.1f} {offline_rate:>15.1f}")
+        print(f"batches identical to QwenVLCollator; batch size {batch_size} for DataLoader, {os.cpu_count()} CPU(s)")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
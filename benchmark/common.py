@@ -0,0 +1,58 @@
+import os
+import resource
+import time
+
+import torch
+from PIL import Image
+from transformers import AutoProcessor, Qwen2_5_VLConfig, Qwen2_5_VLForConditionalGeneration
+
+from config import PROCESSOR_PATH
+from service.local import LocalModel
+
+
+def tiny_config(**kwargs):
+    # 随机初始化的小型Qwen2.5-VL配置，只用于CPU上的基准测试
+    config = dict(vocab_size=151936, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                  num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=32768,
+                  rope_scaling={"type": "mrope", "mrope_section": [4, 2, 2]},
+                  vision_config={"depth": 2, "hidden_size": 64, "intermediate_size": 128, "num_heads": 4,
+                                 "out_hidden_size": 64, "fullatt_block_indexes": [1]},
+                  image_token_id=151655, video_token_id=151656, vision_start_token_id=151652)
+    config.update(kwargs)
+    return Qwen2_5_VLConfig(**config)
+
+
+def tiny_local_model(processor_path=PROCESSOR_PATH, min_pixels=64 * 28 * 28, max_pixels=256 * 28 * 28,
+                     seed=2025, **kwargs):
+    torch.manual_seed(seed)
+    local_model = LocalModel(processor_path=processor_path)
+    local_model.processor = AutoProcessor.from_pretrained(processor_path, min_pixels=min_pixels, max_pixels=max_pixels)
+    local_model.processor.tokenizer.padding_side = 'left'
+    local_model.model = Qwen2_5_VLForConditionalGeneration(tiny_config(**kwargs)).eval()
+    return local_model
+
+
+def load_images(folder='test'):
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            images.append(Image.open(os.path.join(folder, name)).convert('RGB'))
+    return images
+
+
+def timeit(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def rss_mb():
+    # 当前进程的常驻内存，非Linux系统退化为峰值内存
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
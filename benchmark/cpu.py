@@ -0,0 +1,125 @@
+import argparse
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import AutoProcessor, Qwen2_5_VLForConditionalGeneration
+
+from config import PROCESSOR_PATH
+from prompt import format_prompt, PROMPT
+from service.local import LocalModel, cpu_threads
+from .common import tiny_config, rss_mb
+
+MODES = ['bf16', 'fp32', 'int8']
+
+
+def save_model(path, hidden_size, intermediate_size, layers):
+    # 随机初始化的中等规模模型，线性层在参数量中的占比接近3B模型
+    torch.manual_seed(2025)
+    config = tiny_config(hidden_size=hidden_size, intermediate_size=intermediate_size, num_hidden_layers=layers,
+                         num_attention_heads=hidden_size // 128, num_key_value_heads=2,
+                         rope_scaling={"type": "mrope", "mrope_section": [16, 24, 24]},
+                         vision_config={"depth": 4, "hidden_size": 256, "intermediate_size": 1024, "num_heads": 4,
+                                        "out_hidden_size": hidden_size, "fullatt_block_indexes": [3]})
+    Qwen2_5_VLForConditionalGeneration(config).to(torch.bfloat16).save_pretrained(path)
+
+
+def load(mode, model_path, processor_path, num_threads):
+    local_model = LocalModel(model_path, processor_path, device='cpu', quantize=mode == 'int8',
+                             num_threads=num_threads)
+    # 只比较模型本身，关闭前缀缓存和视觉特征缓存
+    local_model.use_prefix_cache = False
+    local_model.vision_cache = None
+    if mode == 'bf16':
+        # 基线：与GPU上相同的bfloat16权重，只把flash attention换成SDPA
+        torch.set_num_threads(num_threads or cpu_threads())
+        local_model.processor = AutoProcessor.from_pretrained(processor_path)
+        local_model.processor.tokenizer.padding_side = 'left'
+        local_model.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
+            model_path, torch_dtype=torch.bfloat16, attn_implementation="sdpa").eval()
+    else:
+        local_model.load()
+    return local_model
+
+
+def measure(mode, model_path, processor_path, num_threads, max_tokens, rounds):
+    # 在独立的子进程中运行，内存只包含这一种模式
+    before = rss_mb()
+    start = time.perf_counter()
+    local_model = load(mode, model_path, processor_path, num_threads)
+    load_seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - before
+
+    image = Image.fromarray(np.random.default_rng(2025).integers(0, 256, (336, 448, 3), dtype=np.uint8))
+    inputs = local_model.prepare_inputs([image], [format_prompt(PROMPT, query="标注图中的文字")])
+
+    def generate(tokens):
+        start = time.perf_counter()
+        output_ids = local_model.generate_locked(**inputs, max_new_tokens=tokens, min_new_tokens=tokens,
+                                                 do_sample=False)
+        return time.perf_counter() - start, output_ids
+
+    generate(2)
+    # safetensors按需映射权重，推理一次之后的常驻内存才包含全部权重
+    resident = rss_mb() - before
+    prefill = min(generate(1)[0] for _ in range(rounds))
+    total, output_ids = min((generate(max_tokens) for _ in range(rounds)), key=lambda result: result[0])
+
+    # 固定文本上每个位置的logits，用于和float32比较
+    text_ids = local_model.processor.tokenizer("Please locate the red car and the tree. " * 4,
+                                               return_tensors="pt").input_ids
+    with torch.no_grad():
+        logits = local_model.model(input_ids=text_ids).logits[0].float().numpy()
+    return {"mode": mode, "load_s": load_seconds, "resident_mb": resident, "peak_mb": peak,
+            "prompt_tokens": inputs['input_ids'].shape[1], "prefill_ms": prefill * 1000,
+            "tokens_per_second": (max_tokens - 1) / (total - prefill), "threads": torch.get_num_threads(),
+            "output_ids": output_ids[0, inputs['input_ids'].shape[1]:].tolist(), "logits": logits}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模型CPU推理：bfloat16基线、float32和int8动态量化的内存与生成速度")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--hidden-size', type=int, default=1024)
+    parser.add_argument('--intermediate-size', type=int, default=4096)
+    parser.add_argument('--layers', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=None, help="默认使用当前进程可用的全部核心")
+    parser.add_argument('--max-tokens', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=2)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        save_model(root, args.hidden_size, args.intermediate_size, args.layers)
+        results = {}
+        for mode in MODES:
+            with ProcessPoolExecutor(1) as pool:
+                results[mode] = pool.submit(measure, mode, root, args.processor, args.threads,
+                                            args.max_tokens, args.rounds).result()
+
+        reference = results['fp32']
+        print(f"{'mode':>5} {'resident MB':>12} {'load peak MB':>13} {'load s':>7} {'prefill ms':>11} {'tok/s':>7} "
+              f"{'logits err':>11} {'top1':>6} {'same ids':>9}")
+        for mode, result in results.items():
+            # 相对float32的logits误差和逐位置top-1一致率
+            error = np.linalg.norm(result['logits'] - reference['logits']) / np.linalg.norm(reference['logits'])
+            top1 = (result['logits'].argmax(-1) == reference['logits'].argmax(-1)).mean()
+            same = np.mean(np.array(result['output_ids']) == np.array(reference['output_ids']))
+            print(f"{mode:>5} {result['resident_mb']:>12.0f} {result['peak_mb']:>13.0f} {result['load_s']:>7.1f} "
+                  f"{result['prefill_ms']:>11.0f} {result['tokens_per_second']:>7.1f} {error:>11.4f} "
+                  f"{top1:>6.2f} {same:>9.2f}")
+        baseline = results['bf16']
+        print(f"int8 vs bf16: {results['int8']['tokens_per_second'] / baseline['tokens_per_second']:.2f}x tok/s, "
+              f"{results['int8']['resident_mb'] / baseline['resident_mb']:.2f}x memory; "
+              f"{reference['prompt_tokens']} prompt tokens, {args.max_tokens} generated, "
+              f"{reference['threads']} thread(s)")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from config import MIN_PIXELS, MAX_PIXELS
+from imaging import load_image, target_size
+
+
+def legacy_load(path, min_pixels=None, max_pixels=None, max_side=None):
+    # 原实现：全分辨率解码后再缩放
+    image = Image.open(path).convert('RGB')
+    return image, image.size
+
+
+def prepare(load, path, target):
+    # 解码并缩放到后续处理实际使用的尺寸
+    image, (width, height) = load(path, **target)
+    size = target_size(width, height, **target)
+    if size is not None and image.size != size:
+        image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return image
+
+
+def measure(load, path, target, rounds):
+    # 在独立的子进程中运行，峰值内存不受其他模式影响
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(rounds):
+        image = prepare(load, path, target)
+    elapsed = (time.perf_counter() - start) / rounds * 1000
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024
+    return elapsed, peak, np.asarray(image)
+
+
+def run(load, path, target, rounds):
+    with ProcessPoolExecutor(1) as pool:
+        return pool.submit(measure, load, path, target, rounds).result()
+
+
+def make_photo(path, width=6000, height=4000, seed=2025):
+    # 合成的大尺寸JPEG，平滑的渐变加噪声，接近相机照片
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    pixels += rng.normal(0, 8, pixels.shape).astype(np.float32)
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=90)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图像解码耗时和峰值内存：全分辨率解码与JPEG缩小解码")
+    parser.add_argument('--folder', default='test')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--max-side', type=int, default=256, help="微调时的图像最长边")
+    args = parser.parse_args()
+
+    targets = {"serving": {"min_pixels": MIN_PIXELS, "max_pixels": MAX_PIXELS},
+               "train": {"max_side": args.max_side}}
+    root = tempfile.mkdtemp()
+    try:
+        paths = ['demo.jpg'] + [os.path.join(args.folder, name) for name in sorted(os.listdir(args.folder))
+                                if name.lower().endswith(('.jpg', '.jpeg'))]
+        paths.append(os.path.join(root, 'synthetic.jpg'))
+        make_photo(paths[-1])
+
+        print(f"{'image':>14} {'size':>10} {'target':>8} {'full ms':>8} {'draft ms':>9} {'speedup':>8} "
+              f"{'full MB':>8} {'draft MB':>9} {'diff':>6}")
+        totals = {name: [0.0, 0.0] for name in targets}
+        for path in paths:
+            width, height = Image.open(path).size
+            for name, target in targets.items():
+                full_ms, full_mb, full = run(legacy_load, path, target, args.rounds)
+                draft_ms, draft_mb, draft = run(load_image, path, target, args.rounds)
+                assert full.shape == draft.shape, f"{path}: 缩放后的尺寸不一致"
+                # 缩小解码和全分辨率解码再缩放的平均像素差
+                diff = np.abs(full.astype(np.int16) - draft.astype(np.int16)).mean()
+                totals[name][0] += full_ms
+                totals[name][1] += draft_ms
+                print(f"{os.path.basename(path):>14} {f'{width}x{height}':>10} {name:>8} {full_ms:>8.1f} "
+                      f"{draft_ms:>9.1f} {full_ms / draft_ms:>7.1f}x {full_mb:>8.1f} {draft_mb:>9.1f} {diff:>6.2f}")
+        for name, (full_ms, draft_ms) in totals.items():
+            print(f"{name}: full {full_ms:.0f} ms, draft {draft_ms:.0f} ms ({full_ms / draft_ms:.1f}x) "
+                  f"for {len(paths)} images")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
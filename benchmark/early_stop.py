@@ -0,0 +1,43 @@
+import argparse
+import time
+
+from config import MAX_TOKENS, PROCESSOR_PATH
+from prompt import format_prompt, PROMPT
+from service.local import LocalModel
+from .common import tiny_local_model, load_images
+
+
+def run(local_model, images, prompt, early_stop, max_tokens):
+    tokens, elapsed = [], 0.0
+    for image in images:
+        start = time.perf_counter()
+        text, _, _ = local_model.inference(image, prompt, max_tokens=max_tokens, early_stop=early_stop)
+        elapsed += time.perf_counter() - start
+        tokens.append(len(local_model.processor.tokenizer(text).input_ids))
+    return tokens, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON闭合后提前停止生成节省的token数")
+    parser.add_argument('--tiny', action='store_true', help="使用随机初始化的小模型（只验证流程，不会生成JSON）")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--query', default="图里面有什么？")
+    parser.add_argument('--max-tokens', type=int, default=MAX_TOKENS)
+    args = parser.parse_args()
+
+    local_model = tiny_local_model(args.processor) if args.tiny else LocalModel(processor_path=args.processor)
+    images = load_images()
+    prompt = format_prompt(PROMPT, query=args.query)
+
+    baseline, baseline_time = run(local_model, images, prompt, False, args.max_tokens)
+    stopped, stopped_time = run(local_model, images, prompt, True, args.max_tokens)
+    print(f"{'image':>6} {'full':>8} {'early':>8} {'saved':>8}")
+    for i, (full, early) in enumerate(zip(baseline, stopped)):
+        print(f"{i + 1:>6} {full:>8} {early:>8} {full - early:>8}")
+    saved = sum(baseline) - sum(stopped)
+    print(f"saved {saved / len(images):.1f} tokens/request, "
+          f"{(baseline_time - stopped_time) / len(images) * 1000:.1f} ms/request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import base64
+import io
+import os
+import time
+
+from PIL import Image
+
+from config import MIN_PIXELS, MAX_PIXELS
+from utils import encode_image
+
+
+def legacy_encode_image(image):
+    # 原实现：全分辨率JPEG编码
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def measure(fn, path, rounds):
+    elapsed, size = 0.0, 0
+    for _ in range(rounds):
+        # 每次重新打开，保留文件名和格式信息
+        image = Image.open(path)
+        image.load()
+        start = time.perf_counter()
+        size = len(fn(image))
+        elapsed += time.perf_counter() - start
+    return size, elapsed / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API上传图像的编码大小和耗时")
+    parser.add_argument('--folder', default='test')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--quality', type=int, default=85)
+    args = parser.parse_args()
+
+    modes = {
+        "legacy": legacy_encode_image,
+        "jpeg": lambda image: encode_image(image, MIN_PIXELS, MAX_PIXELS, 'JPEG', args.quality),
+        "webp": lambda image: encode_image(image, MIN_PIXELS, MAX_PIXELS, 'WEBP', args.quality),
+    }
+    paths = [os.path.join(args.folder, name) for name in sorted(os.listdir(args.folder))] + ['demo.jpg']
+    print(f"{'image':<12} {'size':>11}" + "".join(f" {mode + ' KB':>10} {mode + ' ms':>10}" for mode in modes))
+    totals = {mode: [0, 0.0] for mode in modes}
+    for path in paths:
+        width, height = Image.open(path).size
+        row = f"{os.path.basename(path):<12} {f'{width}x{height}':>11}"
+        for mode, fn in modes.items():
+            size, ms = measure(fn, path, args.rounds)
+            totals[mode][0] += size
+            totals[mode][1] += ms
+            row += f" {size / 1024:>10.1f} {ms:>10.1f}"
+        print(row)
+    print(f"{'total':<12} {'':>11}" + "".join(f" {size / 1024:>10.1f} {ms:>10.1f}" for size, ms in totals.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from config import PROCESSOR_PATH
+from core.detect import parse_response
+from prompt import format_prompt, PROMPT, COMPACT_PROMPT
+from service.grammar import DetectionGrammar, prompt_grammar
+from .common import tiny_local_model
+
+LABELS = ["帆船", "树", "人物", "饮料瓶", "红色的汽车", "狗"]
+FORMATS = {"json": PROMPT, "compact": COMPACT_PROMPT}
+
+
+def serialize(answer, detections, name):
+    # json为PROMPT示例中的格式：代码块、两格缩进、坐标写成字符串；compact为紧凑格式
+    if name == 'compact':
+        items = [detection['bbox_2d'] + [detection['label']] for detection in detections]
+        return json.dumps({"answer": answer, "detections": items}, ensure_ascii=False, separators=(',', ':'))
+    items = [{"bbox_2d": [str(v) for v in detection['bbox_2d']], "label": detection['label']}
+             for detection in detections]
+    return "```json\n" + json.dumps({"answer": answer, "detections": items}, ensure_ascii=False, indent=2) + "\n```"
+
+
+def format_cost(tokenizer, rng, boxes=10, rounds=20):
+    # 每个框的token数：n个框与没有框的输出之差除以n
+    costs = {name: [] for name in FORMATS}
+    for _ in range(rounds):
+        detections = []
+        for _ in range(boxes):
+            x1, y1 = rng.integers(0, 1000, 2).tolist()
+            detections.append({"bbox_2d": [x1, y1, x1 + int(rng.integers(10, 400)), y1 + int(rng.integers(10, 400))],
+                               "label": LABELS[int(rng.integers(len(LABELS)))]})
+        for name in FORMATS:
+            empty = len(tokenizer(serialize("图中有帆船和树。", [], name)).input_ids)
+            full = len(tokenizer(serialize("图中有帆船和树。", detections, name)).input_ids)
+            costs[name].append(((full - empty) / boxes, empty))
+    return {name: np.mean(values, axis=0) for name, values in costs.items()}
+
+
+def fuzz(grammar, rng, samples):
+    # 在状态机上随机游走生成完整的输出，全部都应该能被解析
+    alphabet = list(range(0x20, 0x7f)) + [0x0a, 0xe4, 0xb8, 0xad]
+    structure = set(b'{}[]",:0123456789`')
+    parsed = 0
+    for _ in range(samples):
+        state, data = grammar.start, bytearray()
+        while True:
+            choices = [byte for byte in alphabet if grammar.step(state, byte)]
+            if grammar.accepts(state) and (not choices or rng.random() < 0.5):
+                break
+            preferred = [byte for byte in choices if byte in structure]
+            # 偏向结构字符，字符串和空白尽快结束
+            byte = rng.choice(preferred if preferred and rng.random() < 0.8 else choices)
+            data.append(byte)
+            state = grammar.step(state, byte)
+        parse_response(data.decode('utf-8', errors='replace'))
+        parsed += 1
+    return parsed
+
+
+def generate(local_model, images, prompts, constrained, max_tokens):
+    # 返回解析失败数、语法上完整的输出数、生成的token数和decode阶段每个token的耗时
+    local_model.constrained = constrained
+    failures, complete, tokens, decode_ms = 0, 0, [], []
+    for image, prompt in zip(images, prompts):
+        with metrics.trace('grammar') as trace:
+            text, _, _ = local_model.inference_batch([image], [prompt], max_tokens=max_tokens)[0]
+        span = next(span for span in trace.spans if span['name'] == 'decode')
+        tokens.append(span['generated_tokens'])
+        decode_ms.append(span['ms'] / max(span['generated_tokens'] - 1, 1))
+        try:
+            parse_response(text)
+        except json.JSONDecodeError:
+            failures += 1
+        grammar = DetectionGrammar(compact=prompt_grammar(prompt) == 'compact')
+        state = grammar.start
+        for byte in text.encode():
+            state = grammar.step(state, byte) if state else None
+        complete += bool(state and grammar.accepts(state))
+    return failures, complete, np.mean(tokens), np.mean(decode_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="约束解码：每个框的token数、解析失败率和约束的开销")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--requests', type=int, default=8)
+    parser.add_argument('--max-tokens', type=int, default=128)
+    parser.add_argument('--fuzz', type=int, default=2000)
+    args = parser.parse_args()
+
+    metrics.enabled = True
+    local_model = tiny_local_model(args.processor)
+    tokenizer = local_model.processor.tokenizer
+    rng = np.random.default_rng(2025)
+
+    print(f"{'format':>8} {'tokens/box':>11} {'overhead':>9}")
+    for name, (per_box, overhead) in format_cost(tokenizer, rng).items():
+        print(f"{name:>8} {per_box:>11.1f} {overhead:>9.0f}")
+
+    for name in FORMATS:
+        grammar = DetectionGrammar(compact=name == 'compact')
+        print(f"{name}: {fuzz(grammar, random.Random(2025), args.fuzz)}/{args.fuzz} random grammar walks parsed")
+
+    # 随机初始化的模型几乎不会自己写出JSON，用来对比约束前后的解析失败率和约束的开销
+    images = [Image.fromarray(rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)) for _ in range(args.requests)]
+    queries = ["图里面有什么？", "标注帆船和树", "人物在哪里？", "饮料是什么牌子？"]
+    start = time.perf_counter()
+    local_model.grammar_index('json'), local_model.grammar_index('compact')
+    print(f"grammar index built in {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"{'format':>8} {'constrained':>12} {'parse fail':>11} {'complete':>9} {'tokens':>7} {'decode ms/token':>16}")
+    for name, template in FORMATS.items():
+        prompts = [format_prompt(template, query=queries[i % len(queries)]) for i in range(args.requests)]
+        # 预热，第一次请求计算各个状态的掩码
+        generate(local_model, images[:1], prompts[:1], True, args.max_tokens)
+        for constrained in (False, True):
+            failures, complete, tokens, decode_ms = generate(local_model, images, prompts, constrained,
+                                                             args.max_tokens)
+            print(f"{name:>8} {str(constrained):>12} {failures / args.requests:>11.2f} {complete:>9} "
+                  f"{tokens:>7.0f} {decode_ms:>16.2f}")
+    states = {name: len(index.masks) for name, index in local_model.grammars.items()}
+    print(f"cached masks per format: {states}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import math
+import os
+import shutil
+import tempfile
+import time
+
+import torch
+from transformers import AutoProcessor, Qwen2_5_VLForConditionalGeneration
+
+from config import PROCESSOR_PATH
+from finetune.collator import QwenVLCollator, PackingCollator
+from .collate import make_manifest, load_examples
+from .common import tiny_config
+
+
+def loss_and_time(model, batch, repeat):
+    # 前向加反向，返回损失和每个batch的平均耗时
+    loss = model(**batch).loss
+    start = time.perf_counter()
+    for _ in range(repeat):
+        model.zero_grad()
+        model(**batch).loss.backward()
+    return loss.item(), (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="微调时把多个样本打包到一行：填充比例、损失一致性和训练步耗时")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--samples', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--max-seq-length', type=int, default=256)
+    parser.add_argument('--max-image-side', type=int, default=256)
+    parser.add_argument('--attn', choices=['sdpa', 'eager'], default='sdpa')
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        make_manifest(root, args.samples)
+        examples = load_examples(os.path.join(root, 'train.jsonl'))
+        processor = AutoProcessor.from_pretrained(args.processor)
+        padded = QwenVLCollator(processor, max_seq_length=args.max_seq_length,
+                                max_img_side_length=args.max_image_side)
+        packed = PackingCollator(processor, max_seq_length=args.max_seq_length,
+                                 max_img_side_length=args.max_image_side)
+
+        torch.manual_seed(2025)
+        config = tiny_config()
+        config._attn_implementation = args.attn
+        model = Qwen2_5_VLForConditionalGeneration(config).float().train()
+
+        print(f"{'batch':>5} {'rows':>5} {'padded loss':>12} {'packed loss':>12} {'padded ms':>10} {'packed ms':>10}")
+        max_diff, padded_total, packed_total = 0.0, 0.0, 0.0
+        for i in range(0, args.samples, args.batch_size):
+            batch = examples[i:i + args.batch_size]
+            padded_batch = padded(batch)
+            packed_batch = packed(batch)
+            padded_loss, padded_ms = loss_and_time(model, padded_batch, args.repeat)
+            packed_loss, packed_ms = loss_and_time(model, packed_batch, args.repeat)
+            # 回答被截断时没有计算损失的token，损失为NaN，比较没有意义
+            assert math.isfinite(padded_loss) and math.isfinite(packed_loss), \
+                f"损失为{padded_loss}/{packed_loss}，请增大--max-seq-length使回答不被截断"
+            max_diff = max(max_diff, abs(padded_loss - packed_loss))
+            padded_total += padded_ms
+            packed_total += packed_ms
+            print(f"{i // args.batch_size:>5} {len(packed_batch['input_ids']):>5} {padded_loss:>12.6f} "
+                  f"{packed_loss:>12.6f} {padded_ms:>10.1f} {packed_ms:>10.1f}")
+        assert max_diff < 1e-4, f"打包后的损失与不打包不一致：{max_diff}"
+
+        ratio = packed.padding_ratio()
+        print(f"\npadding ratio: unpacked {ratio['unpacked']:.1%}, packed {ratio['packed']:.1%}")
+        print(f"train step: padded {padded_total:.0f} ms, packed {packed_total:.0f} ms "
+              f"({padded_total / packed_total:.2f}x); max loss diff {max_diff:.2e}, attn={args.attn}")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import importlib
+import json
+import platform
+import resource
+import time
+from functools import partial
+
+import numpy as np
+from PIL import Image
+from qwen_vl_utils import smart_resize
+
+from config import MIN_PIXELS, MAX_PIXELS
+from core.annotate import annotator
+from prompt import format_prompt, PROMPT
+from service.registry import registry
+from service.stub import StubModel
+from utils import encode_image_url, parse_json, percentile
+
+# 端到端测试不使用结果缓存，也不写出标注图像
+detect_module = importlib.import_module('core.detect')
+detect_module.result_cache = None
+detect_module.output_sink = None
+
+QUERY = "图里面有什么？"
+
+
+def peak_rss_mb():
+    # Linux上ru_maxrss的单位是KB，macOS上是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if platform.system() == 'Darwin' else peak / 1024
+
+
+def measure(fn, iterations, warmup=2):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    return {"p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "throughput": iterations / elapsed,
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def stages(image, detections):
+    # detect中的各个阶段，输入为上一阶段的真实输出
+    model = StubModel(detections=detections)
+    prompt = format_prompt(PROMPT, query=QUERY)
+    response, input_height, input_width = model.inference(image, prompt)
+    result = json.loads(parse_json(response))
+
+    def end_to_end():
+        answer, annotated = detect_module.detect(image, QUERY, backend='stub')
+        assert annotated is not None, answer
+
+    return {
+        "smart_resize": lambda: smart_resize(image.height, image.width, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS),
+        "format_prompt": lambda: format_prompt(PROMPT, query=QUERY),
+        "encode_image": lambda: encode_image_url(image, MIN_PIXELS, MAX_PIXELS),
+        "inference": lambda: model.inference(image, prompt),
+        "parse": lambda: detect_module.parse_response(response),
+        "annotate": lambda: annotator.render(image, result["detections"], input_width, input_height),
+        "end_to_end": end_to_end,
+    }
+
+
+def compare(results, baseline, threshold, min_ms):
+    # 与基线对比，延迟变高或吞吐量变低超过阈值时标记，绝对变化小于min_ms的视为噪声
+    print(f"\n{'case':<28} {'p50 %':>8} {'p95 %':>8} {'thpt %':>8}")
+    regressions = 0
+    for case, current in results.items():
+        if case not in baseline:
+            continue
+        previous = baseline[case]
+        changes = [(current[key] / previous[key] - 1) * 100 if previous[key] else 0.0
+                   for key in ("p50_ms", "p95_ms", "throughput")]
+        regressed = (current["p50_ms"] - previous["p50_ms"] > min_ms
+                     and (changes[0] > threshold or changes[1] > threshold or -changes[2] > threshold))
+        regressions += regressed
+        print(f"{case:<28} {changes[0]:>+8.1f} {changes[1]:>+8.1f} {changes[2]:>+8.1f}"
+              f"{'  <- regression' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检测流程各阶段及端到端的延迟（桩后端，CPU离线运行）")
+    parser.add_argument('--size', type=int, nargs=2, default=[1920, 1080], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--detections', type=int, nargs='+', default=[0, 5, 50])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--output', help="结果保存为JSON")
+    parser.add_argument('--baseline', help="与保存的JSON结果对比")
+    parser.add_argument('--threshold', type=float, default=10.0, help="判定为回退的变化百分比")
+    parser.add_argument('--min-ms', type=float, default=0.1, help="判定为回退的最小p50变化（毫秒）")
+    args = parser.parse_args()
+
+    # 固定种子的噪声图像，编码开销接近真实照片
+    rng = np.random.default_rng(2025)
+    width, height = args.size
+    image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+    results = {}
+    print(f"{'case':<28} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ops/s':>9} {'peak MB':>8}")
+    for detections in args.detections:
+        registry.unload('stub')
+        registry.register('stub', partial(StubModel, detections=detections))
+        registry.load('stub')
+        for stage, fn in stages(image, detections).items():
+            case = f"{stage}@{detections}"
+            results[case] = measure(fn, args.iterations)
+            r = results[case]
+            print(f"{case:<28} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                  f"{r['throughput']:>9.1f} {r['peak_rss_mb']:>8.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": {"size": args.size, "iterations": args.iterations, "python": platform.python_version(),
+                                "machine": platform.machine()},
+                       "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        print(f"{regressions} regression(s) above {args.threshold:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
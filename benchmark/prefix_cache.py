@@ -0,0 +1,51 @@
+import argparse
+
+from config import PROCESSOR_PATH
+from prompt import format_prompt, PROMPT
+from service.local import VISION_START
+from .common import tiny_local_model, load_images, timeit
+
+
+def prefill(local_model, images, prompts, rounds):
+    # 只生成1个token，耗时基本等于预填充
+    elapsed = 0.0
+    for _ in range(rounds):
+        for image, prompt in zip(images, prompts):
+            _, seconds = timeit(local_model.inference_batch, [image], [prompt], max_tokens=1, early_stop=False)
+            elapsed += seconds
+    return elapsed / (rounds * len(images))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="系统提示和检测模板前缀KV缓存的预填充耗时")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    local_model = tiny_local_model(args.processor)
+    images = load_images()
+    queries = ["图里面有什么？", "标注帆船和树", "人物在哪里？", "饮料是什么牌子？"]
+    prompts = [format_prompt(PROMPT, query=queries[i % len(queries)]) for i in range(len(images))]
+
+    # 预热
+    local_model.use_prefix_cache = False
+    local_model.inference_batch(images[:1], prompts[:1], max_tokens=1)
+    baseline = prefill(local_model, images, prompts, args.rounds)
+
+    local_model.use_prefix_cache = True
+    _, build = timeit(local_model.inference_batch, images[:1], prompts[:1], max_tokens=1, early_stop=False)
+    cached = prefill(local_model, images, prompts, args.rounds)
+
+    text = local_model.build_text(images[0], prompts[0])
+    prefix_tokens = len(local_model.processor.tokenizer(text[:text.index(VISION_START)]).input_ids)
+    total_tokens = local_model.prepare_inputs(images[:1], prompts[:1])['input_ids'].shape[1]
+    print(f"prefix {prefix_tokens} / {total_tokens} tokens")
+    print(f"{'mode':>14} {'ms/request':>12}")
+    print(f"{'no cache':>14} {baseline * 1000:>12.1f}")
+    print(f"{'first (build)':>14} {build * 1000:>12.1f}")
+    print(f"{'cached':>14} {cached * 1000:>12.1f}")
+    print(f"speedup {baseline / cached:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from datasets import Dataset, Features, Image as ImageFeature, Sequence, Value, load_dataset
+from PIL import Image
+from tqdm import tqdm
+
+from finetune.process import convert_to_qwen25vl_format, convert_to_sft_format
+from imaging import ORIENTATION
+
+
+def legacy_convert(data_path, save_path, type, train_end, test_end):
+    # 原实现：每个划分遍历一遍数据集，解码并重新编码每张图像，逐个转换坐标
+    dataset = load_dataset(data_path, split='train')
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+    jsonl_file = os.path.join(save_path, f"{type}.jsonl")
+    with open(jsonl_file, 'w', encoding='utf-8') as jsonl_out:
+        for idx, sample in tqdm(enumerate(dataset), total=len(dataset)):
+            if type == 'train':
+                if idx >= train_end:
+                    break
+            elif type == 'test':
+                if idx < train_end or idx >= test_end:
+                    continue
+            image = sample['image']
+            filename = f"{idx + 1:06d}.jpg"
+            jpg_path = os.path.join(save_path, type)
+            if not os.path.exists(jpg_path):
+                os.makedirs(jpg_path)
+            output_path = os.path.join(jpg_path, filename)
+            image.save(output_path)
+
+            x1, y1, w, h = sample['bbox']
+            image_width, image_height = image.size
+            qwen25_bboxes = convert_to_qwen25vl_format([x1, y1, x1 + w, y1 + h], image_height, image_width)
+            data = {"image": [output_path],
+                    "query": sample['question'],
+                    "response": json.dumps({"bbox_2d": qwen25_bboxes}, indent=None)}
+            jsonl_out.write(json.dumps(data, ensure_ascii=False) + '\n')
+
+
+def make_dataset(path, samples, seed=2025):
+    # 合成数据集：不同尺寸的JPEG照片，另有一成PNG和一成带EXIF方向标签（需要旋转90度）的JPEG
+    rng = np.random.default_rng(seed)
+    sizes = [(640, 480), (1024, 768), (500, 375), (800, 1200)]
+    images, questions, bboxes = [], [], []
+    for i in range(samples):
+        width, height = sizes[i % len(sizes)]
+        pixels = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels).resize((width, height))
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        if i % 10 == 4:
+            exif[ORIENTATION] = 6
+        image.save(buffer, format='PNG' if i % 10 == 9 else 'JPEG', quality=90, exif=exif)
+        images.append({"bytes": buffer.getvalue(), "path": None})
+        questions.append(f"what is written on sign {i}?")
+        x, y = rng.uniform(0, width / 2), rng.uniform(0, height / 2)
+        bboxes.append([x, y, rng.uniform(1, width / 2), rng.uniform(1, height / 2)])
+    features = Features({"image": ImageFeature(), "question": Value('string'), "bbox": Sequence(Value('float64'))})
+    dataset = Dataset.from_dict({"image": images, "question": questions, "bbox": bboxes}, features=features)
+    os.makedirs(path, exist_ok=True)
+    dataset.to_parquet(os.path.join(path, 'train.parquet'))
+
+
+def read_lines(save_path, split):
+    with open(os.path.join(save_path, f"{split}.jsonl"), encoding='utf-8') as f:
+        return f.read().replace(save_path, '<root>')
+
+
+def image_sizes(save_path, split):
+    # 写出的图像按EXIF方向显示时的尺寸，旋转过的图像不应再带方向标签
+    sizes = []
+    for name in sorted(os.listdir(os.path.join(save_path, split))):
+        with Image.open(os.path.join(save_path, split, name)) as image:
+            sizes.append((image.size, image.getexif().get(ORIENTATION, 1)))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据集转换速度：原实现与分片并行版本")
+    parser.add_argument('--samples', type=int, default=400)
+    parser.add_argument('--num-proc', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--shard-size', type=int, default=50)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        data_path = os.path.join(root, 'dataset')
+        make_dataset(data_path, args.samples)
+        train_end = args.samples * 9 // 10
+        splits = {'train': (0, train_end), 'test': (train_end, args.samples)}
+
+        legacy_path = os.path.join(root, 'legacy')
+        start = time.perf_counter()
+        legacy_convert(data_path, legacy_path, 'train', train_end, args.samples)
+        legacy_convert(data_path, legacy_path, 'test', train_end, args.samples)
+        results = [('legacy', time.perf_counter() - start)]
+
+        for num_proc in args.num_proc:
+            save_path = os.path.join(root, f"sharded-{num_proc}")
+            start = time.perf_counter()
+            convert_to_sft_format(data_path, save_path, splits, num_proc, args.shard_size)
+            results.append((f"num_proc={num_proc}", time.perf_counter() - start))
+            for split in splits:
+                assert read_lines(save_path, split) == read_lines(legacy_path, split), f"{split}结果与原实现不一致"
+                assert image_sizes(save_path, split) == image_sizes(legacy_path, split), f"{split}图像与原实现不一致"
+
+        # 所有分片已存在时只合并
+        start = time.perf_counter()
+        convert_to_sft_format(data_path, save_path, splits, num_proc, args.shard_size)
+        results.append(('resume', time.perf_counter() - start))
+
+        print(f"{'mode':>14} {'seconds':>9} {'samples/s':>10}")
+        for mode, seconds in results:
+            print(f"{mode:>14} {seconds:>9.2f} {args.samples / seconds:>10.1f}")
+        print(f"JSONL identical to legacy output; {os.cpu_count()} CPU(s)")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import gc
+
+from PIL import Image
+
+from config import PROCESSOR_PATH
+from prompt import format_prompt, PROMPT
+from service.registry import ModelRegistry
+from .common import tiny_local_model, rss_mb, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型注册表的冷启动延迟和反复切换后的内存")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--toggles', type=int, default=10)
+    args = parser.parse_args()
+
+    image = Image.open('test/02.jpeg').convert('RGB')
+    prompt = format_prompt(PROMPT, query="图里面有什么？")
+    registry = ModelRegistry()
+    registry.register('a', lambda: tiny_local_model(args.processor, seed=1))
+    registry.register('b', lambda: tiny_local_model(args.processor, seed=2))
+
+    # 冷启动：原实现在第一次请求时才加载模型
+    baseline = rss_mb()
+    _, legacy_first = timeit(lambda: tiny_local_model(args.processor).inference(image, prompt, max_tokens=8))
+    gc.collect()
+    _, load_time = timeit(registry.load, 'a')
+    _, warm_first = timeit(registry.get('a').inference, image, prompt, max_tokens=8)
+    print(f"first request, lazy load:       {legacy_first * 1000:8.1f} ms")
+    print(f"startup load + warm-up:         {load_time * 1000:8.1f} ms")
+    print(f"first request after warm-up:    {warm_first * 1000:8.1f} ms")
+
+    # 原实现：每次切换重新创建模型实例
+    legacy_models = []
+    for _ in range(args.toggles):
+        model = tiny_local_model(args.processor)
+        model.inference(image, prompt, max_tokens=2)
+        legacy_models.append(model)
+    legacy_rss = rss_mb()
+    del legacy_models, model
+    gc.collect()
+
+    # 注册表：两个后端常驻，按键切换
+    start_rss = rss_mb()
+    for i in range(args.toggles):
+        registry.get('ab'[i % 2]).inference(image, prompt, max_tokens=2)
+    resident_rss = rss_mb()
+    # 显式卸载
+    registry.unload('a')
+    registry.unload('b')
+    gc.collect()
+    print(f"rss before:                     {baseline:8.1f} MB")
+    print(f"rss after {args.toggles} reload toggles:     {legacy_rss:8.1f} MB")
+    print(f"rss after {args.toggles} registry toggles:   {resident_rss:8.1f} MB (from {start_rss:.1f})")
+    print(f"rss after unload:               {rss_mb():8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
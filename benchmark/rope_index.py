@@ -0,0 +1,55 @@
+import argparse
+import time
+
+import torch
+
+# 原实现和随机一致性检查在单元测试中
+from tests.test_rope_index import IMAGE_TOKEN_ID, PAD_TOKEN_ID, VISION_END_TOKEN_ID, VISION_START_TOKEN_ID, \
+    check, legacy_get_rope_index, rope_index
+
+
+def sample_batch(batch_size, seq_length):
+    # 与微调数据相近：一张18x14网格的图像，前后各有一段文本，右侧填充
+    grid = [1, 18, 14]
+    row = [1] * 20 + [VISION_START_TOKEN_ID] + [IMAGE_TOKEN_ID] * (18 * 14 // 4) + [VISION_END_TOKEN_ID] + [1] * 60
+    input_ids = torch.full((batch_size, seq_length), PAD_TOKEN_ID, dtype=torch.long)
+    input_ids[:, :len(row)] = torch.tensor(row)
+    return input_ids, torch.tensor([grid] * batch_size), input_ids.ne(PAD_TOKEN_ID)
+
+
+def timeit(fn, repeat, rounds=5):
+    # 取多轮中最快的一轮，减少其他进程的干扰
+    fn()
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="get_rope_index_2：逐段循环的原实现与批量向量化实现")
+    parser.add_argument('--trials', type=int, default=2000, help="随机一致性检查的次数")
+    parser.add_argument('--seed', type=int, default=2025)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--seq-length', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    check(args.trials, args.seed)
+    print(f"{args.trials} randomized batches bit-identical to the original implementation")
+
+    print(f"\n{'batch':>6} {'loop ms':>9} {'vector ms':>10} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        input_ids, image_grid_thw, attention_mask = sample_batch(batch_size, args.seq_length)
+        legacy_ms = timeit(lambda: legacy_get_rope_index(2, input_ids, image_grid_thw,
+                                                          attention_mask=attention_mask), args.repeat)
+        vector_ms = timeit(lambda: rope_index(2, input_ids, image_grid_thw, attention_mask=attention_mask),
+                           args.repeat)
+        print(f"{batch_size:>6} {legacy_ms:>9.3f} {vector_ms:>10.3f} {legacy_ms / vector_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from core.scheduler import BatchScheduler, SchedulerOverloaded
+from service.stub import StubModel
+from utils import percentile
+
+
+def run(scheduler, image, clients, requests):
+    # 闭环压测：每个客户端串行发送请求
+    latencies, rejected = [], 0
+
+    def client(_):
+        nonlocal rejected
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                scheduler.inference(image, "图里面有什么？")
+                latencies.append(time.perf_counter() - start)
+            except SchedulerOverloaded:
+                rejected += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client, range(clients)))
+    return len(latencies) / (time.perf_counter() - start), latencies, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="微批调度器的吞吐量/延迟权衡（桩模型）")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=10, help="每个客户端的请求数")
+    parser.add_argument('--latency', type=float, default=0.05, help="每批的固定耗时（秒）")
+    parser.add_argument('--item-latency', type=float, default=0.005, help="每项的额外耗时（秒）")
+    args = parser.parse_args()
+
+    image = Image.new('RGB', (1280, 960), 'white')
+    model = StubModel(latency=args.latency, item_latency=args.item_latency)
+    print(f"{'batch':>5} {'wait ms':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'mean batch':>10} {'rejected':>8}")
+    for max_batch_size, max_wait_ms in [(1, 0), (4, 5), (8, 5), (8, 20), (16, 20), (16, 50)]:
+        scheduler = BatchScheduler(model, max_batch_size, max_wait_ms, max_queue=args.clients)
+        throughput, latencies, rejected = run(scheduler, image, args.clients, args.requests)
+        stats = scheduler.stats()
+        print(f"{max_batch_size:>5} {max_wait_ms:>8} {throughput:>8.1f} {percentile(latencies, 50) * 1000:>8.1f} "
+              f"{percentile(latencies, 95) * 1000:>8.1f} {stats['mean_batch_size']:>10.2f} {rejected:>8}")
+
+    # 过载：队列上限小于并发客户端数时拒绝请求
+    scheduler = BatchScheduler(model, 8, 20, max_queue=4)
+    _, _, rejected = run(scheduler, image, args.clients, args.requests)
+    print(f"overload (queue limit 4, {args.clients} clients): {rejected} rejected, stats={scheduler.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import Qwen2Config, Qwen2ForCausalLM, Qwen2_5_VLForConditionalGeneration
+
+import metrics
+from config import PROCESSOR_PATH, DRAFT_TOKENS
+from .common import tiny_config, tiny_local_model
+
+# 主模型：中等宽度、较深的随机初始化配置
+MAIN = dict(hidden_size=256, intermediate_size=1024, num_hidden_layers=12, num_attention_heads=4,
+            rope_scaling={"type": "mrope", "mrope_section": [16, 8, 8]},
+            vision_config={"depth": 2, "hidden_size": 64, "intermediate_size": 128, "num_heads": 4,
+                           "out_hidden_size": 256, "fullatt_block_indexes": [1]})
+
+
+def weaken_deep_layers(model, shallow_layers, scale):
+    # 随机权重下浅层草稿与主模型几乎不一致；缩小深层写回残差的权重，模拟训练后深层只做小幅修正的情形
+    with torch.no_grad():
+        for layer in model.model.language_model.layers[shallow_layers:]:
+            layer.self_attn.o_proj.weight.mul_(scale)
+            layer.mlp.down_proj.weight.mul_(scale)
+
+
+def save_drafts(root, main_model, shallow_layers):
+    # self：与主模型相同的权重，接受率的上限；shallow：只保留主模型的前几层；text：独立的纯文本小模型
+    paths = {}
+    paths['self'] = os.path.join(root, 'self')
+    main_model.save_pretrained(paths['self'])
+
+    shallow = Qwen2_5_VLForConditionalGeneration(tiny_config(**{**MAIN, "num_hidden_layers": shallow_layers}))
+    shallow.load_state_dict(main_model.state_dict(), strict=False)
+    paths['shallow'] = os.path.join(root, 'shallow')
+    shallow.save_pretrained(paths['shallow'])
+
+    torch.manual_seed(2026)
+    text = Qwen2ForCausalLM(Qwen2Config(vocab_size=151936, hidden_size=64, intermediate_size=128,
+                                        num_hidden_layers=1, num_attention_heads=4, num_key_value_heads=2))
+    paths['text'] = os.path.join(root, 'text')
+    text.save_pretrained(paths['text'])
+    return paths
+
+
+def run(local_model, images, prompts, max_tokens):
+    # 逐个请求生成，返回输出、总耗时和decode阶段的投机解码统计
+    outputs, spans = [], []
+    start = time.perf_counter()
+    for image, prompt in zip(images, prompts):
+        with metrics.trace('speculative') as trace:
+            outputs.append(local_model.inference_batch([image], [prompt], max_tokens=max_tokens,
+                                                       early_stop=False)[0][0])
+        spans += [span for span in trace.spans if span['name'] == 'decode']
+    elapsed = time.perf_counter() - start
+    return outputs, elapsed, spans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投机解码：与逐token解码的输出一致性、接受率和加速比（随机初始化的小模型）")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--requests', type=int, default=4)
+    parser.add_argument('--max-tokens', type=int, default=128)
+    parser.add_argument('--draft-tokens', type=int, nargs='+', default=[4, DRAFT_TOKENS])
+    parser.add_argument('--shallow-layers', type=int, default=2)
+    parser.add_argument('--deep-scale', type=float, default=0.05, help="主模型深层残差分支的缩放，1表示不缩放")
+    args = parser.parse_args()
+
+    metrics.enabled = True
+    local_model = tiny_local_model(args.processor, min_pixels=16 * 28 * 28, max_pixels=64 * 28 * 28, **MAIN)
+    # 草稿模型同样以float32运行；投机解码不经过前缀缓存和视觉特征缓存，基线也关闭它们
+    local_model.quantize = False
+    local_model.use_prefix_cache = False
+    local_model.vision_cache = None
+    weaken_deep_layers(local_model.model, args.shallow_layers, args.deep_scale)
+    rng = np.random.default_rng(2025)
+    images = [Image.fromarray(rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)) for _ in range(args.requests)]
+    queries = ["图里面有什么？", "标注帆船和树", "人物在哪里？", "饮料是什么牌子？"]
+    # 短提示词，耗时以decode为主
+    prompts = [queries[i % len(queries)] for i in range(args.requests)]
+
+    root = tempfile.mkdtemp()
+    try:
+        paths = save_drafts(root, local_model.model, args.shallow_layers)
+        # 预热
+        local_model.inference_batch(images[:1], prompts[:1], max_tokens=2, early_stop=False)
+        baseline, baseline_time, _ = run(local_model, images, prompts, args.max_tokens)
+
+        print(f"{'draft':>8} {'tokens':>7} {'identical':>10} {'accept':>7} {'tok/step':>9} {'ms/request':>11} "
+              f"{'speedup':>8}")
+        print(f"{'none':>8} {'-':>7} {'-':>10} {'-':>7} {1.0:>9.2f} {baseline_time / args.requests * 1000:>11.1f} "
+              f"{1.0:>7.2f}x")
+        for name, path in paths.items():
+            for draft_tokens in args.draft_tokens:
+                local_model.draft_model_path, local_model.draft_tokens = path, draft_tokens
+                local_model.draft_model = local_model.load_draft()
+                # 随机权重的概率分布接近均匀，达不到默认的置信度阈值，每轮只会提出一个token
+                local_model.draft_model.generation_config.assistant_confidence_threshold = 0
+                local_model.inference_batch(images[:1], prompts[:1], max_tokens=2, early_stop=False)
+                outputs, elapsed, spans = run(local_model, images, prompts, args.max_tokens)
+                identical = outputs == baseline
+                assert identical, f"草稿模型{name}的输出与逐token解码不一致"
+                accept = np.mean([span['acceptance_rate'] for span in spans])
+                per_step = np.mean([span['tokens_per_step'] for span in spans])
+                print(f"{name:>8} {draft_tokens:>7} {str(identical):>10} {accept:>7.2f} {per_step:>9.2f} "
+                      f"{elapsed / args.requests * 1000:>11.1f} {baseline_time / elapsed:>7.2f}x")
+        local_model.draft_model = None
+        print(f"{args.requests} requests, {args.max_tokens} tokens each, greedy; main model "
+              f"{MAIN['num_hidden_layers']} layers (deep layers scaled by {args.deep_scale}), "
+              f"shallow draft {args.shallow_layers} layers")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import importlib
+import time
+
+from PIL import Image
+
+from config import PROCESSOR_PATH
+from prompt import format_prompt, PROMPT
+from service.registry import registry
+from .common import tiny_local_model
+
+# core包导出了同名的detect函数，这里取模块本身
+detect_module = importlib.import_module('core.detect')
+
+RESPONSE = '''```json
+{
+  "answer": "图中有两艘帆船，岸边有几棵树，远处是连绵的山。",
+  "detections": [
+''' + ",\n".join(f'''    {{
+      "bbox_2d": [{40 * i}, {30 * i}, {40 * i + 120}, {30 * i + 90}],
+      "label": "物体{i}"
+    }}''' for i in range(8)) + '''
+  ]
+}
+```'''
+
+
+class ReplayModel:
+    # 按固定速度逐段回放预设的回答
+    name = "replay"
+
+    def __init__(self, tokens_per_second, chars_per_token=3):
+        self.delay = 1 / tokens_per_second
+        self.chars_per_token = chars_per_token
+
+    def _chunks(self):
+        for i in range(0, len(RESPONSE), self.chars_per_token):
+            time.sleep(self.delay)
+            yield RESPONSE[i:i + self.chars_per_token]
+
+    def load(self):
+        return True
+
+    def warmup(self):
+        pass
+
+    def unload(self):
+        pass
+
+    def inference(self, image, prompt):
+        return "".join(self._chunks()), 644, 952
+
+    def inference_stream(self, image, prompt):
+        return self._chunks(), 644, 952
+
+
+def measure_stream(image, query):
+    start = time.perf_counter()
+    first_token = first_box = None
+    for _, annotated in detect_module.detect_stream(image, query, 'replay'):
+        now = time.perf_counter() - start
+        first_token = first_token or now
+        if annotated is not None and first_box is None:
+            first_box = now
+    return first_token, first_box, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式输出的首字延迟和首框延迟")
+    parser.add_argument('--tokens-per-second', type=float, default=40)
+    parser.add_argument('--local', action='store_true', help="同时测试随机初始化的小模型的首字延迟")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    args = parser.parse_args()
+
+    image = Image.open('test/02.jpeg').convert('RGB')
+    detect_module.result_cache = None
+    detect_module.output_sink = None
+    registry.register('replay', lambda: ReplayModel(args.tokens_per_second))
+
+    start = time.perf_counter()
+    detect_module.detect(image, "标注帆船和树", 'replay')
+    blocking = time.perf_counter() - start
+    first_token, first_box, total = measure_stream(image, "标注帆船和树")
+    print(f"replay @ {args.tokens_per_second:.0f} tok/s")
+    print(f"  blocking detect:      {blocking * 1000:8.1f} ms until anything is shown")
+    print(f"  time to first token:  {first_token * 1000:8.1f} ms")
+    print(f"  time to first box:    {first_box * 1000:8.1f} ms")
+    print(f"  stream total:         {total * 1000:8.1f} ms")
+
+    if args.local:
+        local_model = tiny_local_model(args.processor)
+        prompt = format_prompt(PROMPT, query="标注帆船和树")
+        start = time.perf_counter()
+        local_model.inference(image, prompt, max_tokens=64)
+        blocking = time.perf_counter() - start
+        start = time.perf_counter()
+        chunks, _, _ = local_model.inference_stream(image, prompt, max_tokens=64)
+        first_token = None
+        for _ in chunks:
+            first_token = first_token or time.perf_counter() - start
+        print("tiny LocalModel, 64 tokens")
+        print(f"  blocking inference:   {blocking * 1000:8.1f} ms")
+        print(f"  time to first token:  {first_token * 1000:8.1f} ms")
+        print(f"  stream total:         {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import metrics
+from config import TILE_SIZE, TILE_OVERLAP, TILE_CONCURRENCY, TILE_NMS_IOU
+from core.detect import parse_response
+from core.tiling import TiledRunner, nms, pairwise_iou
+from service.stub import StubModel
+
+
+class ShapeModel(StubModel):
+    # 在模型输入分辨率下找出纯色方块的桩后端：输入中边长小于min_side像素的方块看不见，
+    # 模拟大图缩小后小物体低于模型的分辨能力
+    def __init__(self, colors, min_side=6, **kwargs):
+        super().__init__(**kwargs)
+        self.colors = colors
+        self.min_side = min_side
+
+    def response(self, image):
+        input_height, input_width = self.input_size(image)
+        pixels = np.asarray(image.convert('RGB').resize((input_width, input_height), Image.NEAREST), dtype=np.int64)
+        # 颜色编码成整数后一次查表得到每个像素属于哪个方块
+        codes = np.array([(r << 16) | (g << 8) | b for r, g, b in self.colors.values()])
+        order = np.argsort(codes)
+        pixel_codes = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+        found = np.minimum(np.searchsorted(codes[order], pixel_codes), len(codes) - 1)
+        ys, xs = np.nonzero(codes[order][found] == pixel_codes)
+        ids = order[found[ys, xs]]
+        labels = list(self.colors)
+        detections = []
+        for i in np.unique(ids):
+            box_xs, box_ys = xs[ids == i], ys[ids == i]
+            if min(box_xs.max() - box_xs.min(), box_ys.max() - box_ys.min()) + 1 >= self.min_side:
+                detections.append({"bbox_2d": [int(box_xs.min()), int(box_ys.min()), int(box_xs.max()) + 1,
+                                               int(box_ys.max()) + 1], "label": labels[i]})
+        return json.dumps({"answer": f"找到{len(detections)}个方块。", "detections": detections}, ensure_ascii=False)
+
+
+def scene(width, height, objects, rng):
+    # 灰色背景上随机大小、互不重叠的纯色方块，每个方块一个类别
+    image = Image.new('RGB', (width, height), (128, 128, 128))
+    draw = ImageDraw.Draw(image)
+    colors, boxes = {}, []
+    while len(boxes) < objects:
+        side = int(rng.integers(12, 64))
+        x, y = int(rng.integers(0, width - side)), int(rng.integers(0, height - side))
+        box = [x, y, x + side, y + side]
+        if any(x < b[2] + 4 and b[0] < x + side + 4 and y < b[3] + 4 and b[1] < y + side + 4 for b in boxes):
+            continue
+        color = tuple(int(v) for v in rng.integers(0, 256, 3))
+        # 颜色之间、与背景之间拉开距离
+        if max(abs(c - 128) for c in color) < 48 or any(max(abs(a - b) for a, b in zip(color, other)) < 40
+                                                         for other in colors.values()):
+            continue
+        draw.rectangle([x, y, x + side - 1, y + side - 1], fill=color)
+        colors[f"方块{len(boxes) + 1}"] = color
+        boxes.append(box)
+    return image, colors, boxes
+
+
+def score(response, input_height, input_width, width, height, truth):
+    # 召回率（IoU>0.5）和重复框数；输入尺寸为None时坐标已经是原图像素
+    _, detections = parse_response(response)
+    found, duplicates = set(), 0
+    for detection in detections:
+        x1, y1, x2, y2 = detection['bbox_2d']
+        if input_width:
+            x1, x2 = x1 * width / input_width, x2 * width / input_width
+            y1, y2 = y1 * height / input_height, y2 * height / input_height
+        i = int(detection['label'][2:]) - 1
+        if pairwise_iou(np.array([[x1, y1, x2, y2], truth[i]], dtype=np.float64))[0, 1] > 0.5:
+            duplicates += i in found
+            found.add(i)
+    return len(found) / len(truth), duplicates
+
+
+def naive_nms(boxes, labels, scores, iou_threshold):
+    # 逐对计算IoU的参考实现
+    def iou(a, b):
+        w = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+        h = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - w * h
+        return w * h / union if union > 0 else 0.0
+    keep = []
+    for i in sorted(range(len(boxes)), key=lambda i: -scores[i]):
+        if all(labels[i] != labels[j] or iou(boxes[i], boxes[j]) <= iou_threshold for j in keep):
+            keep.append(i)
+    return keep
+
+
+def nms_timing(rng, counts, labels=8):
+    print(f"{'boxes':>6} {'vectorised ms':>14} {'naive ms':>9} {'kept':>5} {'identical':>10}")
+    for count in counts:
+        xy = rng.uniform(0, 4000, (count, 2))
+        boxes = np.concatenate([xy, xy + rng.uniform(20, 400, (count, 2))], axis=1)
+        box_labels = [f"物体{i}" for i in rng.integers(0, labels, count)]
+        scores = rng.permutation(count).astype(np.float64)
+        start = time.perf_counter()
+        keep = nms(boxes, box_labels, scores, TILE_NMS_IOU)
+        vectorised = time.perf_counter() - start
+        start = time.perf_counter()
+        reference = naive_nms(boxes.tolist(), box_labels, scores.tolist(), TILE_NMS_IOU)
+        naive = time.perf_counter() - start
+        identical = keep.tolist() == reference
+        assert identical, "向量化NMS与参考实现的结果不一致"
+        print(f"{count:>6} {vectorised * 1000:>14.2f} {naive * 1000:>9.1f} {len(keep):>5} {str(identical):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分块推理：不同图像尺寸下的图块数、召回率、延迟和NMS合并耗时（桩后端）")
+    parser.add_argument('--sizes', nargs='+', default=['1280x960', '2560x1920', '4000x3000', '6000x4000', '8000x6000'])
+    parser.add_argument('--objects', type=int, default=40)
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    parser.add_argument('--overlap', type=float, default=TILE_OVERLAP)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, TILE_CONCURRENCY])
+    parser.add_argument('--latency', type=float, default=0.2, help="模拟的每批固定开销（秒）")
+    parser.add_argument('--item-latency', type=float, default=0.1, help="模拟的每张图（图块）开销（秒）")
+    parser.add_argument('--nms-boxes', type=int, nargs='+', default=[100, 500, 2000])
+    args = parser.parse_args()
+
+    metrics.enabled = True
+    rng = np.random.default_rng(2025)
+    print(f"{'size':>10} {'mode':>9} {'tiles':>6} {'recall':>7} {'dup':>4} {'ms':>8} {'merge ms':>9}")
+    for size in args.sizes:
+        width, height = map(int, size.split('x'))
+        image, colors, truth = scene(width, height, args.objects, rng)
+        model = ShapeModel(colors, latency=args.latency, item_latency=args.item_latency)
+        runners = [('single', model)] + [
+            (f'tiled/{concurrency}', TiledRunner(model, parse_response, args.tile_size, args.overlap,
+                                                 concurrency=concurrency))
+            for concurrency in args.concurrency]
+        for mode, runner in runners:
+            with metrics.trace('tiling') as trace:
+                start = time.perf_counter()
+                response, input_height, input_width = runner.inference(image, "")
+                elapsed = time.perf_counter() - start
+            spans = {span['name']: span for span in trace.spans}
+            tiles = spans['tiles']['tiles'] if 'tiles' in spans else 1
+            merge = f"{spans['merge']['ms']:.2f}" if 'merge' in spans else '-'
+            recall, duplicates = score(response, input_height, input_width, width, height, truth)
+            print(f"{size:>10} {mode:>9} {tiles:>6} {recall:>7.2f} {duplicates:>4} {elapsed * 1000:>8.0f} {merge:>9}")
+    print(f"{args.objects} squares of 12-63 px per image; backend cost {args.latency * 1000:.0f} ms per batch + "
+          f"{args.item_latency * 1000:.0f} ms per image, tiles of {args.tile_size} px with {args.overlap:.0%} overlap "
+          f"plus the global view")
+
+    nms_timing(rng, args.nms_boxes)
+
+
+if __name__ == '__main__':
+    main()
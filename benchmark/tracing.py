@@ -0,0 +1,49 @@
+import argparse
+import importlib
+import time
+
+from PIL import Image
+
+import metrics
+from .common import timeit
+
+# 不使用结果缓存，也不写出标注图像
+detect_module = importlib.import_module('core.detect')
+detect_module.result_cache = None
+detect_module.output_sink = None
+
+
+def spans(iterations):
+    # 单个span的开销
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with metrics.span('noop'):
+            pass
+    return (time.perf_counter() - start) / iterations
+
+
+def requests(image, iterations):
+    # 桩后端的完整请求
+    _, elapsed = timeit(lambda: [detect_module.detect(image, "图里面有什么？", backend='stub')
+                                 for _ in range(iterations)])
+    return elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋点开启和关闭时的开销")
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    image = Image.new('RGB', (640, 480), 'white')
+    requests(image, 10)
+    print(f"{'metrics':>8} {'ns/span':>10} {'us/request':>12}")
+    for enabled in (False, True):
+        metrics.enabled = enabled
+        print(f"{'on' if enabled else 'off':>8} {spans(args.iterations) * 1e9:>10.0f} "
+              f"{requests(image, args.requests) * 1e6:>12.1f}")
+    print(f"{len(metrics.render().splitlines())} lines on /metrics")
+
+
+if __name__ == '__main__':
+    main()
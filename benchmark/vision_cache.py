@@ -0,0 +1,48 @@
+import argparse
+
+from config import PROCESSOR_PATH
+from prompt import format_prompt, PROMPT
+from utils import LRUCache
+from .common import tiny_local_model, load_images, timeit
+
+
+def run(local_model, images, prompts, max_tokens):
+    # 每张图像依次提问，返回每个提问序号的平均耗时
+    elapsed = [0.0] * len(prompts)
+    for image in images:
+        for i, prompt in enumerate(prompts):
+            _, seconds = timeit(local_model.inference_batch, [image], [prompt], max_tokens=max_tokens,
+                                early_stop=False)
+            elapsed[i] += seconds
+    return [seconds / len(images) for seconds in elapsed]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同一图像连续提问时视觉特征缓存的效果")
+    parser.add_argument('--processor', default=PROCESSOR_PATH)
+    parser.add_argument('--max-pixels', type=int, default=1024 * 28 * 28)
+    parser.add_argument('--max-tokens', type=int, default=4)
+    args = parser.parse_args()
+
+    local_model = tiny_local_model(args.processor, max_pixels=args.max_pixels)
+    images = load_images()
+    queries = ["图里面有什么？", "标注帆船和树", "人物在哪里？", "饮料是什么牌子？"]
+    prompts = [format_prompt(PROMPT, query=query) for query in queries]
+
+    # 预热，同时建立前缀缓存
+    vision_cache, local_model.vision_cache = local_model.vision_cache, None
+    local_model.inference_batch(images[:1], prompts[:1], max_tokens=1)
+    baseline = run(local_model, images, prompts, args.max_tokens)
+
+    local_model.vision_cache = LRUCache(vision_cache.max_bytes)
+    cached = run(local_model, images, prompts, args.max_tokens)
+
+    print(f"{'query':>6} {'no cache ms':>12} {'cache ms':>10}")
+    for i, (before, after) in enumerate(zip(baseline, cached)):
+        print(f"{i + 1:>6} {before * 1000:>12.1f} {after * 1000:>10.1f}")
+    stats = local_model.vision_cache.stats()
+    print(f"hit rate {stats['hit_rate']:.2f}, {stats['entries']} entries, {stats['bytes'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
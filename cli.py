@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from PIL import Image
+from qwen_vl_utils import smart_resize
+
+import metrics
+from config import USE_LOCAL_MODEL, MAX_BATCH_SIZE
+from core.annotate import parse_boxes, transform_boxes
+from core.detect import get_model, get_runner, parse_response
+from imaging import load_image
+from prompt import format_prompt, DETECT_PROMPT
+from utils import resolve_path
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def iter_inputs(source, query=None):
+    # 逐条产生(图像路径, 查询)，目录按文件名排序，JSONL清单与finetune/data/*.jsonl格式相同
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(source, name), query
+        return
+    with open(source, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            path = item['image'][0] if isinstance(item['image'], list) else item['image']
+            yield resolve_path(path, source), query or item.get('query') or item.get('user')
+
+
+def load_done(output):
+    # 读取已完成的结果，截掉中断时写了一半的最后一行
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].decode('utf-8').splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        # 出错的条目在下次运行时重试
+        if not record.get('error'):
+            done.add((record['image'], record['query']))
+    return done
+
+
+def decode(path, min_pixels=None, max_pixels=None):
+    # 在子进程中解码，给定像素范围时直接缩放到模型输入尺寸
+    start = time.perf_counter()
+    # JPEG在解码时先缩小到不小于模型输入的尺寸，与界面一样按EXIF方向旋转
+    image, (width, height) = load_image(path, min_pixels, max_pixels, transpose=True)
+    if max_pixels is not None:
+        input_height, input_width = smart_resize(height, width, min_pixels=min_pixels or 0, max_pixels=max_pixels)
+        image = image.resize((input_width, input_height), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return image, width, height, (time.perf_counter() - start) * 1000
+
+
+def infer(runner, item, decoded):
+    (path, query), (image, width, height, load_ms) = item, decoded
+    record = {"image": path, "query": query, "width": width, "height": height}
+    with metrics.trace('cli', image=path, pixels=width * height) as trace:
+        metrics.record_span('decode_image', load_ms / 1000)
+        start = time.perf_counter()
+        with metrics.span('inference'):
+            response, input_height, input_width = runner.inference(image, format_prompt(DETECT_PROMPT, query=query))
+        record["timings"] = {"load_ms": round(load_ms, 1),
+                             "infer_ms": round((time.perf_counter() - start) * 1000, 1)}
+        try:
+            with metrics.span('parse'):
+                answer, detections = parse_response(response)
+        except json.JSONDecodeError:
+            metrics.inc('detect_parse_failures_total', backend=runner.name)
+            trace.set(parse_failure=True)
+            record.update(answer=None, detections=[], error="解析结果时出错", response=response)
+            return record
+    # 坐标映射回原图像素
+    boxes, labels = parse_boxes(detections)
+    if input_height is not None:
+        boxes = transform_boxes(boxes, width, height, input_width, input_height)
+    record.update(answer=answer,
+                  detections=[{"bbox_2d": box, "label": label} for box, label in zip(boxes.tolist(), labels)])
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量目标检测：输入图像目录或JSONL清单，结果逐行写入JSONL")
+    parser.add_argument('input', help="图像目录或JSONL清单")
+    parser.add_argument('-o', '--output', default='results.jsonl')
+    parser.add_argument('-q', '--query', help="所有图像使用的查询，JSONL清单中默认使用每行的query")
+    parser.add_argument('-b', '--backend', default='local' if USE_LOCAL_MODEL else 'api')
+    parser.add_argument('-c', '--concurrency', type=int, default=MAX_BATCH_SIZE, help="同时推理的请求数")
+    parser.add_argument('-w', '--workers', type=int, default=min(4, os.cpu_count() or 1), help="解码进程数")
+    args = parser.parse_args()
+    if os.path.isdir(args.input) and not args.query:
+        parser.error("输入为目录时需要指定--query")
+
+    model = get_model(args.backend)
+    if model is None:
+        sys.exit("模型加载失败，请检查模型路径或环境配置。")
+    runner = get_runner(args.backend, model)
+    metrics.start_server()
+    # 按后端的像素范围在子进程中提前缩放到模型输入尺寸，本地模型为处理器的像素范围
+    pixels = (model.min_pixels, model.max_pixels)
+
+    done = load_done(args.output)
+    items = (item for item in iter_inputs(args.input, args.query) if item not in done)
+    count, errors, start = 0, 0, time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as decoders, ThreadPoolExecutor(args.concurrency) as runners, \
+            open(args.output, 'a', encoding='utf-8') as f:
+        pending = {}
+
+        def feed():
+            # 在途条目数保持在并发数的两倍，输入按需读取
+            while len(pending) < 2 * args.concurrency:
+                item = next(items, None)
+                if item is None:
+                    return
+                if not item[1]:
+                    # 清单中这一行没有查询，也没有指定--query，记为出错，不发送请求
+                    future = Future()
+                    future.set_exception(ValueError("缺少查询：清单中没有query或user，也没有指定--query"))
+                    pending[future] = ('infer', item)
+                    continue
+                pending[decoders.submit(decode, item[0], *pixels)] = ('decode', item)
+
+        feed()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, item = pending.pop(future)
+                try:
+                    if stage == 'decode':
+                        pending[runners.submit(infer, runner, item, future.result())] = ('infer', item)
+                        continue
+                    record = future.result()
+                except Exception as e:
+                    record = {"image": item[0], "query": item[1], "error": str(e)}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                count += 1
+                errors += bool(record.get('error'))
+            feed()
+
+    elapsed = time.perf_counter() - start
+    print(f"完成{count}条（跳过{len(done)}条已完成，{errors}条出错），耗时{elapsed:.1f}秒，"
+          f"{count / elapsed if elapsed else 0:.2f}张/秒")
+
+
+if __name__ == '__main__':
+    main()
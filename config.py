@@ -6,17 +6,72 @@ dotenv.load_dotenv()
 # 模型配置
 USE_LOCAL_MODEL = True
 MODEL_PATH = "./model/Qwen2.5-VL-3B-Instruct-X"  # 本地模型路径
+PROCESSOR_PATH = "./model/Qwen2.5-VL-3B-Instruct"  # 处理器路径
 MAX_TOKENS = 2048  # 生成的token数
+MAX_BATCH_SIZE = 8  # 批量推理的最大批大小
+BATCH_WAIT_MS = 20  # 微批调度时第一个请求到达后的最长等待毫秒数
+BATCH_QUEUE_SIZE = 64  # 等待队列上限，超出时拒绝请求
+BATCH_BACKENDS = ["local"]  # 经过微批调度的后端
+STREAM_CONCURRENCY = 4  # 这些后端同时进行的流式请求上限：流式请求不经过微批调度，逐个生成，其余在模型锁上等待，超出时拒绝
+STREAM_OUTPUT = True  # 流式显示生成结果
+STREAM_TIMEOUT = 300  # 流式输出等待下一段文本的最长秒数（含排队等待模型的时间），超时后请求失败并停止生成
+EARLY_STOP = True  # JSON结果闭合后立即停止生成
+PREFIX_CACHE = True  # 复用系统提示和检测模板前缀的KV缓存，只计算一次
+LOCAL_DEVICE = "auto"  # 本地模型的设备：auto有GPU时用GPU，否则用CPU；也可以指定cuda或cpu
+CPU_QUANTIZE = True  # CPU推理时把线性层动态量化为int8，嵌入层按行量化为8位
+CPU_THREADS = None  # CPU推理的线程数，None表示当前进程可用的全部核心
+DRAFT_MODEL_PATH = None  # 投机解码的草稿模型（更小的LVLM或共用分词器的纯文本模型），None表示关闭
+DRAFT_TOKENS = 8  # 草稿模型每轮提出的token数
+CONSTRAINED_DECODING = True  # 本地模型按检测结果的JSON语法约束解码，输出总能解析
+COMPACT_OUTPUT = False  # 检测结果使用紧凑格式，每个框写成[x1, y1, x2, y2, "label"]，生成的token更少
+
+# 后端配置
+BACKEND_CHOICES = {"API模式": "api", "本地模式": "local"}  # 界面选项与后端的对应关系
+PRELOAD_BACKENDS = None  # 启动时加载并预热的后端，None表示只加载界面默认选中的后端，其他后端在第一次选择时加载
 
 # API配置
 API_KEY = os.getenv('DASHSCOPE_API_KEY')
 API_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 MODEL_NAME = "qwen2.5-vl-72b-instruct"
+API_CONCURRENCY = 8  # 同时在途的最大请求数
+API_MAX_RETRIES = 3  # 429/5xx时的最大重试次数
+API_BACKOFF = 0.5  # 重试退避的初始等待秒数
+API_TIMEOUT = 60  # 单次请求超时秒数
 
 # 图像配置
 MIN_PIXELS = 512 * 28 * 28  # 最小像素数
 MAX_PIXELS = 2048 * 28 * 28  # 最大像素数
-SAVE_OUTPUT = 'output.jpg' # 保存标注结果
+SAVE_OUTPUT = True  # 保存标注结果，对延迟敏感的部署可以关闭
+OUTPUT_DIR = 'output'  # 标注结果的保存目录
+OUTPUT_FORMAT = 'JPEG'  # 保存格式，可选JPEG、WEBP、PNG
+OUTPUT_QUALITY = 90  # 保存质量
+OUTPUT_MAX_BYTES = 1024 * 1024 * 1024  # 保存目录的磁盘占用上限
+OUTPUT_QUEUE_SIZE = 32  # 后台写出队列长度，队列满时丢弃
+PREVIEW_MAX_SIDE = None  # 标注图像的最长边，None表示保持原图尺寸
+STREAM_PREVIEW_MAX_SIDE = 1280  # 流式输出中间结果的最长边
+FONT_PATHS = ["simhei.ttf", "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc"]  # 标注字体，依次尝试
+ENCODE_FORMAT = 'JPEG'  # 上传API的图像格式，可选JPEG或WEBP
+ENCODE_QUALITY = 85  # 上传API的图像质量
+
+# 分块推理配置
+TILING = False  # 大图切成重叠的图块分别检测后合并，小物体和小字更清晰，延迟随图块数增加
+TILE_SIZE = 1280  # 图块边长（原图像素），每个图块仍按MIN_PIXELS到MAX_PIXELS输入模型，视觉token数固定
+TILE_OVERLAP = 0.2  # 相邻图块重叠的比例，跨越边界的小物体至少在一个图块中完整出现
+TILE_MAX_TILES = 12  # 图块数上限，超出时放大图块
+TILE_GLOBAL = True  # 同时检测缩小的整图，保留跨越多个图块的大物体
+TILE_CONCURRENCY = 4  # 一起推理的图块数：本地模型为批大小，API后端为并发请求数
+TILE_NMS_IOU = 0.5  # 合并图块结果时，同类框的IoU超过该值视为重复
+
+# 缓存配置
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # 内存缓存的字节上限，0表示关闭缓存
+CACHE_DIR = None  # 磁盘缓存目录，None表示只使用内存缓存
+VISION_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 本地模型视觉特征缓存的字节上限，0表示关闭
+
+# 监控配置
+METRICS_ENABLED = True  # 记录每个请求各阶段的耗时和token数，关闭后埋点几乎没有开销
+METRICS_HOST = "127.0.0.1"  # 指标服务监听地址
+METRICS_PORT = 9100  # Prometheus文本格式指标的端口，None表示不启动
+TRACE_LOG = None  # 每个请求的阶段明细写入该JSONL文件，None表示不记录
 
 # UI配置
 CSS = """
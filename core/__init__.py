@@ -1 +1 @@
-from .detect import detect, clear
\ No newline at end of file
+from .detect import detect, detect_stream, detect_batch, clear
\ No newline at end of file
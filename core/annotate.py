@@ -1,60 +1,114 @@
-from PIL import ImageDraw, ImageFont
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
 
+from config import FONT_PATHS, PREVIEW_MAX_SIDE
 
-def annotate(image, detections, output_path=None, input_width=None, input_height=None):
-    # 获取当前图像尺寸
-    width, height = image.size
-    draw = ImageDraw.Draw(image)
-
-    # 加载字体
-    try:
-        font = ImageFont.truetype("simhei.ttf", 25)
-    except:
+# 颜色列表，用于不同对象的标注
+COLORS = ['red', 'green', 'blue', 'yellow', 'purple', 'orange',
+          'pink', 'brown', 'gray', 'turquoise', 'cyan', 'magenta',
+          'lime', 'navy', 'maroon', 'teal', 'olive', 'coral',
+          'lavender', 'violet', 'gold']
+
+
+def parse_boxes(detections):
+    # 提取合法的检测框，返回(N, 4)坐标数组和对应的标签
+    boxes, labels = [], []
+    for detection in detections:
         try:
-            font = ImageFont.truetype("/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", 25)
-        except:
-            font = ImageFont.load_default()
+            bbox = [float(v) for v in detection['bbox_2d']]
+        except (KeyError, TypeError, ValueError):
+            continue
+        if len(bbox) == 4:
+            boxes.append(bbox)
+            labels.append(str(detection.get('label', '')))
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4), labels
 
-    # 颜色列表，用于不同对象的标注
-    colors = ['red', 'green', 'blue', 'yellow', 'purple', 'orange',
-              'pink', 'brown', 'gray', 'turquoise', 'cyan', 'magenta',
-              'lime', 'navy', 'maroon', 'teal', 'olive', 'coral',
-              'lavender', 'violet', 'gold']
 
-    # 为检测结果绘制边界框和标签
-    for i, detection in enumerate(detections):
-        bbox = detection['bbox_2d']
-        label = detection['label']
+def transform_boxes(boxes, width, height, input_width=None, input_height=None):
+    # 将模型输入空间的坐标一次性映射到图像空间，并裁剪到图像范围内
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if input_width is not None and input_height is not None:
+        boxes = boxes * np.array([width / input_width, height / input_height,
+                                  width / input_width, height / input_height])
+    # 保证左上角在右下角之前
+    boxes = np.concatenate([np.minimum(boxes[:, :2], boxes[:, 2:]),
+                            np.maximum(boxes[:, :2], boxes[:, 2:])], axis=1)
+    boxes = np.clip(boxes, 0, [width - 1, height - 1, width - 1, height - 1])
+    return boxes.astype(np.int64)
 
-        # 选择颜色
-        color = colors[i % len(colors)]
 
-        # 坐标转换逻辑
-        if len(bbox) == 4:
-            if input_width is not None and input_height is not None:
-                abs_x1 = int(bbox[0] / input_width * width)
-                abs_y1 = int(bbox[1] / input_height * height)
-                abs_x2 = int(bbox[2] / input_width * width)
-                abs_y2 = int(bbox[3] / input_height * height)
+class Annotator:
+    def __init__(self, font_paths=FONT_PATHS, font_size=25, line_width=5):
+        self.font_paths = font_paths
+        self.font_size = font_size
+        self.line_width = line_width
+        # 按字号缓存字体，只在第一次使用时查找字体文件
+        self.fonts = {}
 
-                if abs_x1 > abs_x2:
-                    abs_x1, abs_x2 = abs_x2, abs_x1
-                if abs_y1 > abs_y2:
-                    abs_y1, abs_y2 = abs_y2, abs_y1
+    def font(self, size):
+        if size not in self.fonts:
+            font = None
+            for path in self.font_paths:
+                try:
+                    font = ImageFont.truetype(path, size)
+                    break
+                except OSError:
+                    continue
+            if font is None:
+                try:
+                    font = ImageFont.load_default(size)
+                except TypeError:
+                    # 旧版Pillow的默认字体不支持字号
+                    font = ImageFont.load_default()
+            self.fonts[size] = font
+        return self.fonts[size]
 
-                x1, y1, x2, y2 = abs_x1, abs_y1, abs_x2, abs_y2
-            else:
-                x1, y1, x2, y2 = bbox
+    def render(self, image, detections, input_width=None, input_height=None, max_side=PREVIEW_MAX_SIDE):
+        # 在副本上绘制，max_side限制预览画布的最长边
+        width, height = image.size
+        scale = 1.0
+        if max_side and max(width, height) > max_side:
+            scale = max_side / max(width, height)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            # 先按整数倍快速缩小，再插值到目标尺寸
+            factor = int(1 / scale)
+            canvas = image.reduce(factor) if factor >= 2 else image
+            canvas = canvas.resize(size, Image.Resampling.BILINEAR)
+        else:
+            canvas = image.copy()
+        if canvas.mode != 'RGB':
+            canvas = canvas.convert('RGB')
 
-            text = f"{label}"
-            bbox_text = draw.textbbox((x1, y1 - 50), text, font=font)
-            text_width = bbox_text[2] - bbox_text[0]
+        boxes, labels = parse_boxes(detections)
+        if input_width is None or input_height is None:
+            # 没有模型输入尺寸时坐标按原图处理
+            input_width, input_height = width, height
+        boxes = transform_boxes(boxes, canvas.width, canvas.height, input_width, input_height)
 
-            draw.rectangle([x1, y1, x2, y2], outline=color, width=5)
-            draw.rectangle([x1, y1 - 50, x1 + text_width, y1], fill=color)
-            draw.text((x1, y1 - 50), text, fill='white', font=font)
+        draw = ImageDraw.Draw(canvas)
+        font = self.font(max(8, round(self.font_size * scale)))
+        line_width = max(1, round(self.line_width * scale))
+        for i, ((x1, y1, x2, y2), label) in enumerate(zip(boxes.tolist(), labels)):
+            color = COLORS[i % len(COLORS)]
+            draw.rectangle([x1, y1, x2, y2], outline=color, width=line_width)
+            if not label:
+                continue
+            # 按文字实际尺寸确定标签框，放不下时画在框内
+            left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+            text_width, text_height = right - left + 2 * line_width, bottom - top + 2 * line_width
+            label_x = min(x1, max(0, canvas.width - text_width))
+            label_y = y1 - text_height if y1 - text_height >= 0 else y1
+            draw.rectangle([label_x, label_y, label_x + text_width, label_y + text_height], fill=color)
+            draw.text((label_x + line_width - left, label_y + line_width - top), label, fill='white', font=font)
+        return canvas
 
 
+annotator = Annotator()
+
+
+def annotate(image, detections, output_path=None, input_width=None, input_height=None):
+    image = annotator.render(image, detections, input_width, input_height)
+
     # 保存图片
     if output_path:
         image.save(output_path)
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import threading
+
+from utils import LRUCache, hash_image
+
+
+def normalize_query(text):
+    # 合并空白并统一大小写
+    return " ".join(text.split()).lower()
+
+
+class ResultCache:
+    # 检测结果缓存：内存LRU + 可选的磁盘持久化
+    # 只保存解析后的回答和检测框，不保存标注图像
+    def __init__(self, max_bytes, cache_dir=None):
+        self.memory = LRUCache(max_bytes)
+        self.cache_dir = cache_dir
+        self.disk_hits = 0
+        self.lock = threading.Lock()
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def make_key(image, text, backend, model, min_pixels, max_pixels, *extra):
+        digest = hashlib.sha256()
+        for part in (hash_image(image), normalize_query(text), backend, model, min_pixels, max_pixels, *extra):
+            digest.update(f"{part}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        result = self.memory.get(key)
+        if result is not None or not self.cache_dir:
+            return result
+        # 内存未命中时查找磁盘
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                data = f.read()
+            result = json.loads(data)
+        except (OSError, json.JSONDecodeError):
+            return None
+        with self.lock:
+            self.disk_hits += 1
+        self.memory.put(key, result, len(data.encode('utf-8')))
+        return result
+
+    def put(self, key, result):
+        data = json.dumps(result, ensure_ascii=False)
+        self.memory.put(key, result, len(data.encode('utf-8')))
+        if self.cache_dir:
+            # 先写临时文件再替换，避免写入中断留下损坏的缓存
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+
+    def stats(self):
+        stats = self.memory.stats()
+        # 磁盘命中也计为命中，不计为未命中
+        stats["misses"] -= self.disk_hits
+        stats["hits"] += self.disk_hits
+        stats["disk_hits"] = self.disk_hits
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        return stats
@@ -1,58 +1,342 @@
 import json
+import threading
+import time
 
-from qwen_vl_utils import smart_resize
-
+import metrics
 from config import *
-from prompt import format_prompt, PROMPT
-from service.api import api_model
-from service.local import LocalModel
-from .annotate import annotate
-from utils import parse_json
+from imaging import load_image
+from prompt import format_prompt, DETECT_PROMPT
+from service.local import GenerationError
+from service.registry import registry
+from .annotate import annotate, annotator
+from .cache import ResultCache
+from .scheduler import BatchScheduler, SchedulerOverloaded
+from .storage import OutputSink
+from .tiling import TiledRunner
+from utils import parse_json, recover_json, normalize_detection, StreamParser
+
+# 标注结果的后台写出
+output_sink = OutputSink() if SAVE_OUTPUT else None
+
+# 结果缓存
+result_cache = None
+if CACHE_MAX_BYTES or CACHE_DIR:
+    result_cache = ResultCache(CACHE_MAX_BYTES, CACHE_DIR)
+
+
+def resolve_backend(backend=None):
+    # 支持界面上的选项名和后端键
+    if backend is None:
+        return 'local' if USE_LOCAL_MODEL else 'api'
+    return BACKEND_CHOICES.get(backend, backend)
+
+
+def get_model(backend):
+    # 未注册的后端（如命令行传入的错误名称）和加载失败一样返回None
+    try:
+        return registry.get(backend)
+    except (RuntimeError, KeyError) as e:
+        print(e.args[0] if e.args else e)
+        return None
+
+
+# 每个后端一个微批调度器
+schedulers = {}
+schedulers_lock = threading.Lock()
+# 流式请求逐个生成，不经过微批调度器，按后端限制同时进行的数量
+stream_slots = {}
+
+
+def get_runner(backend, model):
+    # 需要组批的后端经过调度器，其余直接调用
+    if backend not in BATCH_BACKENDS:
+        return model
+    with schedulers_lock:
+        old = schedulers.get(backend)
+        if old is not None and old.model is model:
+            return old
+        schedulers[backend] = scheduler = BatchScheduler(model)
+    # 注册表换了模型，旧调度器处理完已排队的请求后退出
+    if old is not None:
+        old.close()
+    return scheduler
 
-# 本地模型
-local_model = None
-if USE_LOCAL_MODEL:
-    local_model = LocalModel()
 
+def acquire_stream_slot(backend):
+    # 返回需要释放的信号量，不限制的后端返回None；没有空位时抛出SchedulerOverloaded
+    if backend not in BATCH_BACKENDS:
+        return None
+    slots = stream_slots.setdefault(backend, threading.BoundedSemaphore(STREAM_CONCURRENCY))
+    if not slots.acquire(blocking=False):
+        metrics.inc('detect_rejected_total', backend=backend)
+        raise SchedulerOverloaded("服务繁忙，请稍后重试。")
+    return slots
 
-def detect(image, text):
+
+def get_tiler(model, width, height):
+    # 开启分块推理且图像大于一个图块时返回分块推理的包装，否则返回None
+    if not TILING:
+        return None
+    tiler = TiledRunner(model, parse_response)
+    return tiler if len(tiler.tiles(width, height)) > 1 else None
+
+
+def cache_key(image, text, backend, model, tiler=None):
+    # 分块推理的结果与分块参数有关
+    tiling = (tiler.tile_size, tiler.overlap, tiler.max_tiles, tiler.include_global, tiler.iou_threshold) if tiler else ()
+    return ResultCache.make_key(image, text, backend, model.name, MIN_PIXELS, MAX_PIXELS, *tiling)
+
+
+def save_output(image):
+    if output_sink and image is not None:
+        output_sink.submit(image)
+    return image
+
+
+def grid_thw(input_height, input_width):
+    # 模型输入尺寸对应的视觉网格，每个patch为14像素
+    return [1, input_height // 14, input_width // 14] if input_height is not None else None
+
+
+def load_input(image, model, span):
+    # 图像文件路径（如cli、API调用）按后端的像素范围解码，JPEG在解码时直接缩小；分块推理需要原图分辨率；
+    # PIL图像（Gradio界面上传的图像已经解码）原样使用
+    if not isinstance(image, str):
+        return image, image.size
+    min_pixels, max_pixels = (None, None) if TILING else (model.min_pixels, model.max_pixels)
+    with span('decode_image') as decode_span:
+        image, size = load_image(image, min_pixels, max_pixels, transpose=True)
+        decode_span.set(width=size[0], height=size[1], decoded_width=image.width, decoded_height=image.height)
+    return image, size
+
+
+def parse_response(response):
+    # 解析JSON，无法恢复时抛出json.JSONDecodeError
+    try:
+        response = json.loads(parse_json(response))
+    except json.JSONDecodeError:
+        # 尝试恢复被截断的输出
+        response = recover_json(response)
+        if response is None:
+            raise
+    # 提取结果
+    answer = response.get("answer", "")
+    detections = [normalize_detection(detection) for detection in response.get("detections", [])]
+    return answer, detections
+
+
+def detect(image, text, backend=None):
     if not text.strip():
         return "请输入检测查询内容以开始分析。", None
     if image is None:
         return "请先上传图像进行检测。", None
+    backend = resolve_backend(backend)
+    model = get_model(backend)
+    if model is None:
+        return "模型加载失败，请检查模型路径或环境配置。", None
 
-    # 获取图像尺寸并进行调整
-    width, height = image.size
-    input_height, input_width = smart_resize(height, width, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS)
+    with metrics.trace('detect', backend=backend) as trace:
+        try:
+            image, (width, height) = load_input(image, model, metrics.span)
+        except OSError:
+            return "无法读取图像文件，请重新上传。", None
+        tiler = get_tiler(model, *image.size)
+        trace.set(pixels=width * height, tiled=tiler is not None)
+        # 查询缓存
+        key = cache_key(image, text, backend, model, tiler) if result_cache else None
+        cached = result_cache.get(key) if result_cache else None
+        if cached is not None:
+            trace.set(cache_hit=True)
+            image = annotate(image,
+                             cached["detections"],
+                             input_width=cached["input_width"],
+                             input_height=cached["input_height"])
+            return cached["answer"], save_output(image)
 
-    # 格式化提示
-    prompt = format_prompt(PROMPT, query=text)
-
-    # 选择使用本地模型或API
-    if USE_LOCAL_MODEL and local_model:
-        # 使用本地模型
-        response, input_height, input_width = local_model.inference(image, prompt)
-    else:
-        # 使用API
-        response = api_model(image, prompt, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS)
-
-    # 解析JSON
-    response = parse_json(response)
+        # 格式化提示
+        with metrics.span('prompt'):
+            prompt = format_prompt(DETECT_PROMPT, query=text)
+
+        # 推理，返回模型输入图像的尺寸用于坐标映射；分块推理的坐标已经是原图像素，尺寸为None
+        try:
+            with metrics.span('inference'):
+                runner = tiler or get_runner(backend, model)
+                response, input_height, input_width = runner.inference(image, prompt)
+        except SchedulerOverloaded as e:
+            trace.set(rejected=True)
+            return str(e), None
+        trace.set(input_height=input_height, input_width=input_width,
+                  image_grid_thw=grid_thw(input_height, input_width))
+
+        try:
+            with metrics.span('parse'):
+                answer, detections = parse_response(response)
+            if result_cache:
+                result_cache.put(key, {"answer": answer, "detections": detections,
+                                       "input_height": input_height, "input_width": input_width})
+            trace.set(detections=len(detections))
+            # 标注结果
+            with metrics.span('annotate'):
+                detections = annotate(image,
+                                      detections,
+                                      input_width=input_width,
+                                      input_height=input_height)
+
+            return answer, save_output(detections)
+        except json.JSONDecodeError:
+            metrics.inc('detect_parse_failures_total', backend=backend)
+            trace.set(parse_failure=True)
+            return "解析结果时出错，请重试。", None
+
+
+def detect_stream(image, text, backend=None):
+    # 生成器版本：逐步更新回答，每解析出一个完整的检测框就立即绘制
+    if not text.strip():
+        yield "请输入检测查询内容以开始分析。", None
+        return
+    if image is None:
+        yield "请先上传图像进行检测。", None
+        return
+    backend = resolve_backend(backend)
+    model = get_model(backend)
+    if model is None:
+        yield "模型加载失败，请检查模型路径或环境配置。", None
+        return
+
+    # 生成器可能在不同线程中恢复，追踪不绑定到上下文，结束时手动提交
+    trace = metrics.trace('detect_stream', backend=backend)
+    slots = None
     try:
-        response = json.loads(response)
-        # 提取结果
-        answer = response.get("answer", "")
-        detections = response.get("detections", [])
-        # 标注结果
-        detections = annotate(image,
-                              detections,
-                              output_path=SAVE_OUTPUT,
-                              input_width=input_width,
-                              input_height=input_height)
-
-        return answer, detections
-    except json.JSONDecodeError:
-        return "解析结果时出错，请重试。", None
+        try:
+            image, (width, height) = load_input(image, model, trace.span)
+        except OSError:
+            yield "无法读取图像文件，请重新上传。", None
+            return
+        tiler = get_tiler(model, *image.size)
+        trace.set(pixels=width * height, tiled=tiler is not None)
+        # 查询缓存
+        key = cache_key(image, text, backend, model, tiler) if result_cache else None
+        cached = result_cache.get(key) if result_cache else None
+        if cached is not None:
+            trace.set(cache_hit=True)
+            yield cached["answer"], save_output(annotate(image,
+                                                         cached["detections"],
+                                                         input_width=cached["input_width"],
+                                                         input_height=cached["input_height"]))
+            return
+
+        # 格式化提示
+        with trace.span('prompt'):
+            prompt = format_prompt(DETECT_PROMPT, query=text)
+
+        try:
+            slots = acquire_stream_slot(backend)
+        except SchedulerOverloaded as e:
+            trace.set(rejected=True)
+            yield str(e), None
+            return
+        start = time.perf_counter()
+        # 预处理在这里完成，后台生成线程继承这时的上下文
+        with metrics.attach((trace,)):
+            chunks, input_height, input_width = (tiler or model).inference_stream(image, prompt)
+        trace.set(input_height=input_height, input_width=input_width,
+                  image_grid_thw=grid_thw(input_height, input_width))
+
+        parser = StreamParser()
+        answer, annotated = "", None
+        try:
+            for chunk in chunks:
+                if not parser.text:
+                    trace.set(first_token_ms=round((time.perf_counter() - start) * 1000, 3))
+                new_detections = parser.feed(chunk)
+                if input_height is not None and new_detections:
+                    # 中间结果绘制在缩小的预览画布上
+                    annotated = annotator.render(image,
+                                                 parser.detections,
+                                                 input_width=input_width,
+                                                 input_height=input_height,
+                                                 max_side=STREAM_PREVIEW_MAX_SIDE)
+                if new_detections or parser.answer != answer:
+                    answer = parser.answer
+                    yield answer or "正在分析……", annotated
+        except GenerationError as e:
+            # 后台生成出错或超时，请求失败而不是一直等待
+            metrics.inc('detect_generation_failures_total', backend=backend)
+            trace.set(generation_error=str(e))
+            yield "生成结果时出错，请重试。", None
+            return
+        trace.set(generate_ms=round((time.perf_counter() - start) * 1000, 3))
+
+        try:
+            with trace.span('parse'):
+                answer, detections = parse_response(parser.text)
+            if result_cache:
+                result_cache.put(key, {"answer": answer, "detections": detections,
+                                       "input_height": input_height, "input_width": input_width})
+            trace.set(detections=len(detections))
+            # 标注结果
+            with trace.span('annotate'):
+                annotated = annotate(image,
+                                     detections,
+                                     input_width=input_width,
+                                     input_height=input_height)
+            yield answer, save_output(annotated)
+        except json.JSONDecodeError:
+            metrics.inc('detect_parse_failures_total', backend=backend)
+            trace.set(parse_failure=True)
+            yield "解析结果时出错，请重试。", None
+    finally:
+        if slots is not None:
+            slots.release()
+        trace.finish()
+
+
+def detect_batch(images, texts, backend=None, batch_size=MAX_BATCH_SIZE):
+    # 返回每一项的(回答, 检测结果, 输入高度, 输入宽度)
+    backend = resolve_backend(backend)
+    model = get_model(backend)
+    if model is None:
+        return [("模型加载失败，请检查模型路径或环境配置。", None, None, None)] * len(images)
+    results = [None] * len(images)
+    keys = {}
+    pending = []
+    for i, (image, text) in enumerate(zip(images, texts)):
+        if not text.strip():
+            results[i] = ("请输入检测查询内容以开始分析。", None, None, None)
+        elif image is None:
+            results[i] = ("请先上传图像进行检测。", None, None, None)
+        else:
+            # 查询缓存
+            cached = None
+            if result_cache:
+                keys[i] = cache_key(image, text, backend, model)
+                cached = result_cache.get(keys[i])
+            if cached is not None:
+                results[i] = (cached["answer"], cached["detections"], cached["input_height"], cached["input_width"])
+            else:
+                pending.append(i)
+
+    # 格式化提示
+    prompts = {i: format_prompt(DETECT_PROMPT, query=texts[i]) for i in pending}
+
+    # 按批推理
+    responses = {}
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        outputs = model.inference_batch([images[i] for i in chunk], [prompts[i] for i in chunk])
+        responses.update(zip(chunk, outputs))
+
+    for i, (response, input_height, input_width) in responses.items():
+        try:
+            answer, detections = parse_response(response)
+            results[i] = (answer, detections, input_height, input_width)
+            if result_cache:
+                result_cache.put(keys[i], {"answer": answer, "detections": detections,
+                                           "input_height": input_height, "input_width": input_width})
+        except json.JSONDecodeError:
+            metrics.inc('detect_parse_failures_total', backend=backend)
+            results[i] = ("解析结果时出错，请重试。", None, input_height, input_width)
+    return results
 
 
 def clear():
@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import metrics
+from config import MAX_BATCH_SIZE, BATCH_WAIT_MS, BATCH_QUEUE_SIZE
+from utils import percentile
+
+
+class SchedulerOverloaded(RuntimeError):
+    pass
+
+
+class BatchScheduler:
+    # 动态微批调度：收集并发请求，按最大批大小和最长等待时间组批后一次推理
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS, max_queue=BATCH_QUEUE_SIZE):
+        self.model = model
+        self.name = model.name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.closed = False
+        self.lock = threading.Lock()
+        # 指标
+        self.batches = 0
+        self.requests = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=1000)
+
+    def submit(self, image, prompt):
+        future = Future()
+        # 记下提交请求的追踪，批量推理时归属到对应的行
+        item = (image, prompt, future, time.perf_counter(), metrics.current_trace())
+        # 在锁内入队，关闭后不会再有请求排在结束标记之后
+        with self.lock:
+            if self.closed:
+                raise SchedulerOverloaded("模型正在切换，请稍后重试。")
+            self._start()
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.rejected += 1
+                raise SchedulerOverloaded("服务繁忙，请稍后重试。") from None
+        return future
+
+    def inference(self, image, prompt):
+        # 与模型接口一致，阻塞等待结果
+        return self.submit(image, prompt).result()
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def close(self):
+        # 模型被替换时调用：已排队的请求处理完后工作线程退出
+        with self.lock:
+            self.closed = True
+            thread = self.thread
+        if thread is not None:
+            # 结束标记，队列满时等待工作线程取走请求
+            self.queue.put(None)
+
+    def _collect(self):
+        # 第一个请求到达后最多再等待max_wait；返回(批, 是否读到结束标记)
+        item = self.queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stop = self._collect()
+            if batch:
+                self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        start = time.perf_counter()
+        self.wait_times.extend(start - enqueued for _, _, _, enqueued, _ in batch)
+        self.batches += 1
+        self.requests += len(batch)
+        traces = [trace for *_, trace in batch]
+        for _, _, _, enqueued, trace in batch:
+            metrics.record_span('queue', start - enqueued, (trace,), batch_size=len(batch))
+        try:
+            with metrics.attach(traces):
+                outputs = self.model.inference_batch([item[0] for item in batch], [item[1] for item in batch])
+            for (_, _, future, _, _), output in zip(batch, outputs):
+                future.set_result(output)
+        except Exception as e:
+            for _, _, future, _, _ in batch:
+                future.set_exception(e)
+
+    def stats(self):
+        wait_times = list(self.wait_times)
+        return {"queue_depth": self.queue.qsize(),
+                "batches": self.batches,
+                "requests": self.requests,
+                "rejected": self.rejected,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "wait_p50_ms": percentile(wait_times, 50) * 1000,
+                "wait_p95_ms": percentile(wait_times, 95) * 1000}
@@ -0,0 +1,125 @@
+import hashlib
+import io
+import os
+import queue
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from config import OUTPUT_DIR, OUTPUT_FORMAT, OUTPUT_QUALITY, OUTPUT_MAX_BYTES, OUTPUT_QUEUE_SIZE
+
+# 支持的输出格式：格式名 -> (扩展名, 保存参数)，可以按需添加
+FORMATS = {
+    'JPEG': ('jpg', lambda quality: {'quality': quality}),
+    'WEBP': ('webp', lambda quality: {'quality': quality}),
+    'PNG': ('png', lambda quality: {'optimize': False}),
+}
+
+# 写出的文件名：16位十六进制的内容哈希加上述扩展名，目录中的其他文件不计入预算，也不会被删除
+OUTPUT_NAME = re.compile(r'[0-9a-f]{16}\.(?:' + '|'.join(re.escape(extension) for extension, _ in FORMATS.values()) + ')')
+
+
+def is_output(path):
+    return OUTPUT_NAME.fullmatch(os.path.basename(path)) is not None
+
+
+class OutputSink:
+    # 标注结果的后台写出：有界队列 + 单个写线程，文件名由内容哈希生成
+    def __init__(self, output_dir=OUTPUT_DIR, image_format=OUTPUT_FORMAT, quality=OUTPUT_QUALITY,
+                 max_bytes=OUTPUT_MAX_BYTES, queue_size=OUTPUT_QUEUE_SIZE):
+        if image_format not in FORMATS:
+            raise ValueError(f"不支持的输出格式: {image_format}")
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.files = OrderedDict()
+        self.total_bytes = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, image):
+        # 不阻塞请求：队列已满时丢弃，返回的Future结果为None
+        future = Future()
+        self._start()
+        try:
+            self.queue.put_nowait((image, future))
+        except queue.Full:
+            self.dropped += 1
+            future.set_result(None)
+        return future
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                os.makedirs(self.output_dir, exist_ok=True)
+                self._scan()
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _scan(self):
+        # 按修改时间载入以前写出的文件，用于控制磁盘占用
+        paths = [os.path.join(self.output_dir, name) for name in os.listdir(self.output_dir)]
+        paths = sorted((path for path in paths if is_output(path) and os.path.isfile(path)), key=os.path.getmtime)
+        self.files = OrderedDict((path, os.path.getsize(path)) for path in paths)
+        self.total_bytes = sum(self.files.values())
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            image, future = item
+            try:
+                future.set_result(self._write(image))
+            except Exception as e:
+                print(f"保存标注结果失败：{str(e)}")
+                future.set_result(None)
+            finally:
+                self.queue.task_done()
+
+    def _write(self, image):
+        extension, save_kwargs = FORMATS[self.image_format]
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.image_format, **save_kwargs(self.quality))
+        data = buffer.getvalue()
+        path = os.path.join(self.output_dir, f"{hashlib.sha256(data).hexdigest()[:16]}.{extension}")
+        if path in self.files:
+            # 内容相同的结果已存在
+            self.files.move_to_end(path)
+            return path
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.files[path] = len(data)
+        self.total_bytes += len(data)
+        self.written += 1
+        self._evict()
+        return path
+
+    def _evict(self):
+        # 超出磁盘预算时删除最早的文件，只删除自己写出的文件
+        while self.max_bytes and self.total_bytes > self.max_bytes and len(self.files) > 1:
+            path, size = self.files.popitem(last=False)
+            self.total_bytes -= size
+            if not is_output(path):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
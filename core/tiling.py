@@ -0,0 +1,143 @@
+import json
+import math
+
+import numpy as np
+
+import metrics
+from config import TILE_SIZE, TILE_OVERLAP, TILE_MAX_TILES, TILE_GLOBAL, TILE_CONCURRENCY, TILE_NMS_IOU
+from .annotate import parse_boxes, transform_boxes
+
+
+def tile_starts(length, tile_size, overlap):
+    # 一个方向上各图块的起点，相邻图块至少重叠overlap比例，最后一块贴齐边缘
+    if length <= tile_size:
+        return [0]
+    count = math.ceil((length - tile_size) / (tile_size * (1 - overlap))) + 1
+    step = (length - tile_size) / (count - 1)
+    return [round(i * step) for i in range(count)]
+
+
+def tile_grid(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=TILE_MAX_TILES):
+    # 覆盖整张图的图块(left, top, right, bottom)，图块数超过max_tiles时放大图块
+    while True:
+        xs, ys = tile_starts(width, tile_size, overlap), tile_starts(height, tile_size, overlap)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        tile_size = math.ceil(tile_size * 1.25)
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height)) for y in ys for x in xs]
+
+
+def truncated_boxes(boxes, region, width, height, margin):
+    # 贴着图块内部边界（不是原图边界）的框，物体被图块截断
+    left, top, right, bottom = region
+    cut = np.zeros(len(boxes), dtype=bool)
+    if left > 0:
+        cut |= boxes[:, 0] <= margin
+    if top > 0:
+        cut |= boxes[:, 1] <= margin
+    if right < width:
+        cut |= boxes[:, 2] >= right - left - 1 - margin
+    if bottom < height:
+        cut |= boxes[:, 3] >= bottom - top - 1 - margin
+    return cut
+
+
+def pairwise_iou(boxes):
+    # (N, 4)框两两之间的IoU矩阵
+    x1 = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    y1 = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    x2 = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    y2 = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area[:, None] + area[None, :] - intersection
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(union > 0, intersection / union, 0.0)
+
+
+def nms(boxes, labels, scores, iou_threshold=TILE_NMS_IOU):
+    # 按类别的贪心NMS，返回保留的下标（按分数从高到低）；IoU和类别比较一次算出矩阵，
+    # 逐个框只做整行的布尔运算，不同类别的框互不抑制
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if not len(boxes):
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+    labels = np.asarray([str(label).strip().lower() for label in labels])[order]
+    suppress = (pairwise_iou(boxes[order]) > iou_threshold) & (labels[:, None] == labels[None, :])
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= ~suppress[i, i + 1:]
+    return order[keep]
+
+
+class TiledRunner:
+    # 与模型接口一致的分块推理：大图切成重叠的图块，按批或并发推理，检测框映射回原图坐标后用NMS合并。
+    # 返回合并后的JSON文本，输入尺寸为None表示坐标已经是原图像素
+    def __init__(self, model, parse, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=TILE_MAX_TILES,
+                 include_global=TILE_GLOBAL, concurrency=TILE_CONCURRENCY, iou_threshold=TILE_NMS_IOU):
+        self.model = model
+        self.name = model.name
+        self.parse = parse
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.max_tiles = max_tiles
+        self.include_global = include_global
+        self.concurrency = concurrency
+        self.iou_threshold = iou_threshold
+
+    def tiles(self, width, height):
+        return tile_grid(width, height, self.tile_size, self.overlap, self.max_tiles)
+
+    def inference(self, image, prompt):
+        width, height = image.size
+        regions = self.tiles(width, height)
+        if self.include_global:
+            # 缩小的整图保留跨越多个图块的大物体，回答也来自整图
+            regions = [(0, 0, width, height)] + regions
+        crops = [image if region == (0, 0, width, height) else image.crop(region) for region in regions]
+        results = []
+        with metrics.span('tiles', tiles=len(regions)):
+            # 本地模型按批推理，API后端在一批内并发请求
+            for start in range(0, len(crops), self.concurrency):
+                chunk = crops[start:start + self.concurrency]
+                results += self.model.inference_batch(chunk, [prompt] * len(chunk))
+
+        answers, boxes, labels, failures = [], [], [], 0
+        for (left, top, right, bottom), (response, input_height, input_width) in zip(regions, results):
+            try:
+                answer, detections = self.parse(response)
+            except json.JSONDecodeError:
+                failures += 1
+                continue
+            answers.append(answer)
+            tile_boxes, tile_labels = parse_boxes(detections)
+            # 图块的模型输入坐标 -> 图块像素 -> 原图像素
+            tile_boxes = transform_boxes(tile_boxes, right - left, bottom - top, input_width, input_height)
+            if self.include_global and (left, top, right, bottom) != (0, 0, width, height):
+                # 被截断的物体交给重叠区内完整看到它的相邻图块或整图，截断的框和完整的框IoU低，NMS去不掉；
+                # 边距为模型输入的2个像素
+                margin = 2 * (right - left) / input_width if input_width else 2
+                cut = truncated_boxes(tile_boxes, (left, top, right, bottom), width, height, margin)
+                tile_boxes, tile_labels = tile_boxes[~cut], [label for label, c in zip(tile_labels, cut) if not c]
+            boxes.append(tile_boxes + np.array([left, top, left, top]))
+            labels += tile_labels
+        if failures:
+            metrics.inc('tile_parse_failures_total', failures, backend=self.name)
+        if failures == len(regions):
+            # 所有图块都无法解析时原样返回，按普通的解析失败处理
+            return results[0][0], None, None
+
+        with metrics.span('merge', boxes=len(labels)):
+            boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.int64)
+            # LVLM的输出没有置信度，面积大的框更可能完整，优先保留
+            keep = np.sort(nms(boxes, labels, (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]),
+                               self.iou_threshold))
+        detections = [{"bbox_2d": boxes[i].tolist(), "label": labels[i]} for i in keep]
+        answer = next((answer for answer in answers if answer), "")
+        return json.dumps({"answer": answer, "detections": detections}, ensure_ascii=False), None, None
+
+    def inference_stream(self, image, prompt):
+        # 图块全部完成后才有合并结果，一次性返回
+        response, input_height, input_width = self.inference(image, prompt)
+        return iter([response]), input_height, input_width
@@ -0,0 +1,158 @@
+import argparse
+import json
+import re
+import time
+from functools import partial
+
+import numpy as np
+from qwen_vl_utils import smart_resize
+
+from config import PROCESSOR_PATH, MAX_BATCH_SIZE
+from core.annotate import parse_boxes
+from imaging import image_size, load_image
+from prompt import format_prompt, PROMPT, COMPACT_PROMPT, GROUNDING_PROMPT
+from service.local import LocalModel
+from service.registry import registry
+from utils import parse_json, recover_json, normalize_detection, resolve_path, percentile
+
+# finetune/process.py中标注坐标所在的缩放空间
+GT_FACTOR = 28
+GT_MIN_PIXELS = 56 * 56
+GT_MAX_PIXELS = 14 * 14 * 4 * 1280
+
+PROMPTS = {'grounding': GROUNDING_PROMPT, 'detect': PROMPT, 'compact': COMPACT_PROMPT}
+BOX_PATTERN = re.compile(r'\[\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\]')
+
+# 未微调的模型，与微调后的本地模型对比
+registry.register('base', partial(LocalModel, model_path=PROCESSOR_PATH))
+
+
+def load_manifest(manifest, limit=None):
+    samples = []
+    with open(manifest, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            path = item['image'][0] if isinstance(item['image'], list) else item['image']
+            response = item.get('response') or item.get('assistant')
+            samples.append({"image": resolve_path(path, manifest),
+                            "query": item.get('query') or item.get('user'),
+                            "bbox": json.loads(response)['bbox_2d']})
+            if limit and len(samples) >= limit:
+                break
+    return samples
+
+
+def parse_box(response):
+    # 取输出中的第一个框，支持{"bbox_2d": ...}、检测结果列表和检测模板的输出，失败时返回None
+    try:
+        data = json.loads(parse_json(response))
+    except json.JSONDecodeError:
+        data = recover_json(response)
+    if isinstance(data, dict):
+        data = [data] if 'bbox_2d' in data else data.get('detections', [])
+    if isinstance(data, list):
+        boxes, _ = parse_boxes(item for item in map(normalize_detection, data) if isinstance(item, dict))
+        if len(boxes):
+            return boxes[0]
+    match = BOX_PATTERN.search(response)
+    return np.array([float(v) for v in match.groups()]) if match else None
+
+
+def box_iou(pred, gt):
+    # 逐行计算(N, 4)框的IoU，预测为NaN的行IoU为0
+    x1 = np.maximum(pred[:, 0], gt[:, 0])
+    y1 = np.maximum(pred[:, 1], gt[:, 1])
+    x2 = np.minimum(pred[:, 2], gt[:, 2])
+    y2 = np.minimum(pred[:, 3], gt[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_pred = (pred[:, 2] - pred[:, 0]) * (pred[:, 3] - pred[:, 1])
+    area_gt = (gt[:, 2] - gt[:, 0]) * (gt[:, 3] - gt[:, 1])
+    union = area_pred + area_gt - intersection
+    with np.errstate(invalid='ignore', divide='ignore'):
+        iou = np.where(union > 0, intersection / union, 0.0)
+    return np.nan_to_num(iou, nan=0.0)
+
+
+def to_pixels(boxes, sizes, input_sizes):
+    # 逐行将各自输入空间的坐标映射回原图像素，NaN行保持NaN
+    boxes = np.asarray(boxes, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    input_sizes = np.asarray(input_sizes, dtype=np.float64)
+    scale = np.tile(sizes / input_sizes, 2)
+    boxes = boxes * scale
+    boxes = np.concatenate([np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:])], axis=1)
+    return np.clip(boxes, 0, np.tile(sizes - 1, 2))
+
+
+def evaluate(model, samples, prompt, batch_size):
+    predictions, input_sizes, responses, latencies = [], [], [], []
+    start = time.perf_counter()
+    for offset in range(0, len(samples), batch_size):
+        batch = samples[offset:offset + batch_size]
+        # JPEG在解码时先缩小到后端的像素范围，尺寸为原图的
+        images, sizes = zip(*[load_image(sample['image'], model.min_pixels, model.max_pixels) for sample in batch])
+        prompts = [format_prompt(prompt, query=sample['query']) for sample in batch]
+        batch_start = time.perf_counter()
+        outputs = model.inference_batch(images, prompts)
+        latencies.append(time.perf_counter() - batch_start)
+        for (width, height), (response, input_height, input_width) in zip(sizes, outputs):
+            box = parse_box(response) if input_height is not None else None
+            predictions.append(np.full(4, np.nan) if box is None else box)
+            # 输入尺寸未知时按原图坐标处理
+            input_sizes.append((input_width or width, input_height or height))
+            responses.append(response)
+    elapsed = time.perf_counter() - start
+
+    # 所有样本一次性计算
+    sizes = np.array([image_size(sample['image']) for sample in samples], dtype=np.float64)
+    gt_sizes = [smart_resize(int(height), int(width), GT_FACTOR, GT_MIN_PIXELS, GT_MAX_PIXELS)[::-1]
+                for width, height in sizes]
+    gt = to_pixels([sample['bbox'] for sample in samples], sizes, gt_sizes)
+    pred = to_pixels(predictions, sizes, input_sizes)
+    failed = np.isnan(pred).any(axis=1)
+    iou = box_iou(pred, gt)
+    return {"samples": len(samples),
+            "mean_iou": float(iou.mean()),
+            "acc@0.5": float((iou >= 0.5).mean()),
+            "parse_failure_rate": float(failed.mean()),
+            "throughput": len(samples) / elapsed,
+            "batch_p50_ms": percentile(latencies, 50) * 1000,
+            "batch_p95_ms": percentile(latencies, 95) * 1000}, \
+        [{"image": sample['image'], "query": sample['query'], "response": response,
+          "pred": None if bad else box.tolist(), "gt": gt_box.tolist(), "iou": float(value)}
+         for sample, response, box, gt_box, value, bad in zip(samples, responses, pred, gt, iou, failed)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在测试集上评估定位效果（IoU、Acc@0.5、解析失败率）和速度")
+    parser.add_argument('--manifest', default='finetune/data/test.jsonl')
+    parser.add_argument('--backends', nargs='+', default=['local'],
+                        help="local为微调后的模型，base为原始模型，另有api、stub")
+    parser.add_argument('--prompt', choices=list(PROMPTS), default='grounding')
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--limit', type=int, help="只评估前N条")
+    parser.add_argument('--output', help="逐条结果和汇总写入JSON")
+    args = parser.parse_args()
+
+    samples = load_manifest(args.manifest, args.limit)
+    summaries, details = {}, {}
+    for backend in args.backends:
+        model = registry.load(backend)
+        summaries[backend], details[backend] = evaluate(model, samples, PROMPTS[args.prompt], args.batch_size)
+        # 依次评估，释放显存后再加载下一个模型
+        registry.unload(backend)
+
+    print(f"{'backend':<10} {'mIoU':>7} {'Acc@0.5':>8} {'fail':>7} {'img/s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for backend, s in summaries.items():
+        print(f"{backend:<10} {s['mean_iou']:>7.3f} {s['acc@0.5']:>8.3f} {s['parse_failure_rate']:>7.3f} "
+              f"{s['throughput']:>8.2f} {s['batch_p50_ms']:>9.1f} {s['batch_p95_ms']:>9.1f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"manifest": args.manifest, "prompt": args.prompt, "batch_size": args.batch_size,
+                       "summary": summaries, "samples": details}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
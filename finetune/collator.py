@@ -1,18 +1,25 @@
 from typing import Optional, Tuple
 import copy
+import json
+import os
+import sys
 
+import numpy as np
 import transformers
 import torch
 
 from PIL import Image
-import json
+
+# 与推理服务共用仓库根目录下的图像解码
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imaging import load_image  # noqa: E402
 
 IGNORE_INDEX = -100
 
 # 缩放图像的大小，同时因为grounding任务，需要同时缩放坐标
-def resize_with_max_side(image, max_side_length):
-    # 获取原始尺寸
-    width, height = image.size
+def resize_with_max_side(image, max_side_length, size=None):
+    # 获取原始尺寸，图像已经在解码时缩小过的，size为原图尺寸
+    width, height = size or image.size
     # 计算缩放比例
     scale = min(max_side_length / width, max_side_length / height)
     # 计算新的尺寸
@@ -39,118 +46,9 @@ class QwenVLCollator:
         self.max_img_side_length = max_img_side_length
 
     def __call__(self, examples):
-        batch_input_ids = []
-        for example in examples:
-            # 根据数据集格式来，数据集格式如下：
-            """
-            {"image": ["./data/train/000001.jpg"], "query": "what is the name of the company on the card?", "response": "{\n  \"bbox_2d\": [\n    712.0,\n    255.0,\n    64.0,\n    43.0\n  ]\n}"}
-            """
-            question = example["user"]
-            answer = example["assistant"]
-            # 需要读取图像，需要确保是RGB图像
-            image_path = example['image'][0]
-            image = Image.open(image_path)
-            # 输出缩放后的图像以及缩放倍率
-            image, scale = resize_with_max_side(
-                image, max_side_length=self.max_img_side_length
-            )
-            # 缩放answer的坐标值
-            # answer是一个json字符串，解析成字典
-            answer = json.loads(answer)
-            answer = {"bbox_2d": resize_bbox(answer["bbox_2d"],scale)}
-            # 转化新的answer
-            answer = json.dumps(answer, indent=None)
-            # 这了不知道是否需要添加prompt
-            prompt = "Please enclose the corresponding positions using coordinate boxes. Examples of coordinate value formats: [x1,y1,x2,y2]"
-            question = question+prompt
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image"},
-                        {"type": "text", "text": question},
-                    ],
-                }
-            ]
-            prompt = self.processor.tokenizer.apply_chat_template(
-                messages, tokenize=False, add_generation_prompt=True
-            )
-            answer = f"{answer}<|im_end|>\n"
-            input_ids = self.processor(
-                images=[image],
-                text=prompt + answer,
-                return_tensors="pt",
-                max_length=self.max_seq_length,
-                truncation=False,
-                padding=False,
-            )
-            answer_ids = self.processor.tokenizer(
-                answer, add_special_tokens=False, return_tensors="pt"
-            )
-            ignore_ids_len = len(input_ids["input_ids"][0]) - len(
-                answer_ids["input_ids"][0]
-            )
-            input_ids["labels"] = torch.cat(
-                [
-                    torch.tensor([IGNORE_INDEX] * ignore_ids_len).unsqueeze(0),
-                    answer_ids["input_ids"],
-                ],
-                dim=1,
-            )
-            # position_ids
-            position_ids, _ = self.get_rope_index_2(
-                self.processor.image_processor.merge_size,
-                input_ids["input_ids"],
-                input_ids["image_grid_thw"],
-            )
-            input_ids["position_ids"] = position_ids
-
-            # padding
-            if len(input_ids["labels"]) < self.max_seq_length:
-                input_ids["input_ids"] = torch.cat(
-                    [
-                        input_ids["input_ids"],
-                        torch.tensor(
-                            [self.processor.tokenizer.pad_token_id]
-                            * (self.max_seq_length - len(input_ids["input_ids"]))
-                        ).unsqueeze(0),
-                    ],
-                    dim=1,
-                )
-                input_ids["labels"] = torch.cat(
-                    [
-                        input_ids["labels"],
-                        torch.tensor(
-                            [IGNORE_INDEX]
-                            * (self.max_seq_length - len(input_ids["labels"]))
-                        ).unsqueeze(0),
-                    ],
-                    dim=1,
-                )
-                input_ids["attention_mask"] = input_ids["input_ids"].ne(
-                    self.processor.tokenizer.pad_token_id
-                )
-                # padding position_ids
-                pad_length = self.max_seq_length - input_ids["position_ids"].shape[2]
-                input_ids["position_ids"] = torch.nn.functional.pad(
-                    input_ids["position_ids"], (0, pad_length), "constant", 1
-                )
-
-            # truncate
-            if len(input_ids["input_ids"][0]) > self.max_seq_length:
-                input_ids["input_ids"] = input_ids["input_ids"][
-                    :, : self.max_seq_length
-                ]
-                input_ids["labels"] = input_ids["labels"][:, : self.max_seq_length]
-                input_ids["attention_mask"] = input_ids["attention_mask"][
-                    :, : self.max_seq_length
-                ]
-                input_ids["position_ids"] = input_ids["position_ids"][
-                    :, : self.max_seq_length
-                ]
-            # batching
-            batch_input_ids.append(input_ids)
-
+        batch_input_ids = [
+            self.encode_example(example, with_position_ids=False) for example in examples
+        ]
         batch_input_ids = {
             "input_ids": torch.cat(
                 [input_ids["input_ids"] for input_ids in batch_input_ids], dim=0
@@ -167,12 +65,136 @@ class QwenVLCollator:
             "image_grid_thw": torch.cat(
                 [input_ids["image_grid_thw"] for input_ids in batch_input_ids], dim=0
             ),
-            "position_ids": torch.cat(
-                [input_ids["position_ids"] for input_ids in batch_input_ids], dim=1
-            ),
         }
+        # 整个batch一次计算位置编码，填充位置为1，截断前后有效位置的值不变
+        batch_input_ids["position_ids"], _ = self.get_rope_index_2(
+            self.processor.image_processor.merge_size,
+            batch_input_ids["input_ids"],
+            batch_input_ids["image_grid_thw"],
+            attention_mask=batch_input_ids["attention_mask"],
+        )
         return batch_input_ids
 
+    def tokenize_example(self, example, with_position_ids=True):
+        # 未填充、未截断的单个样本
+        # 根据数据集格式来，数据集格式如下：
+        """
+        {"image": ["./data/train/000001.jpg"], "query": "what is the name of the company on the card?", "response": "{\n  \"bbox_2d\": [\n    712.0,\n    255.0,\n    64.0,\n    43.0\n  ]\n}"}
+        """
+        question = example["user"]
+        answer = example["assistant"]
+        # 需要读取图像，需要确保是RGB图像
+        image_path = example['image'][0]
+        # JPEG解码时直接缩小到不小于目标的尺寸，缩放倍率仍按原图尺寸计算
+        image, size = load_image(image_path, max_side=self.max_img_side_length)
+        # 输出缩放后的图像以及缩放倍率
+        image, scale = resize_with_max_side(
+            image, max_side_length=self.max_img_side_length, size=size
+        )
+        # 缩放answer的坐标值
+        # answer是一个json字符串，解析成字典
+        answer = json.loads(answer)
+        answer = {"bbox_2d": resize_bbox(answer["bbox_2d"],scale)}
+        # 转化新的answer
+        answer = json.dumps(answer, indent=None)
+        # 这了不知道是否需要添加prompt
+        prompt = "Please enclose the corresponding positions using coordinate boxes. Examples of coordinate value formats: [x1,y1,x2,y2]"
+        question = question+prompt
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image"},
+                    {"type": "text", "text": question},
+                ],
+            }
+        ]
+        prompt = self.processor.tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+        answer = f"{answer}<|im_end|>\n"
+        input_ids = self.processor(
+            images=[image],
+            text=prompt + answer,
+            return_tensors="pt",
+            max_length=self.max_seq_length,
+            truncation=False,
+            padding=False,
+        )
+        answer_ids = self.processor.tokenizer(
+            answer, add_special_tokens=False, return_tensors="pt"
+        )
+        ignore_ids_len = len(input_ids["input_ids"][0]) - len(
+            answer_ids["input_ids"][0]
+        )
+        input_ids["labels"] = torch.cat(
+            [
+                torch.tensor([IGNORE_INDEX] * ignore_ids_len).unsqueeze(0),
+                answer_ids["input_ids"],
+            ],
+            dim=1,
+        )
+        # position_ids
+        if with_position_ids:
+            position_ids, _ = self.get_rope_index_2(
+                self.processor.image_processor.merge_size,
+                input_ids["input_ids"],
+                input_ids["image_grid_thw"],
+            )
+            input_ids["position_ids"] = position_ids
+        return input_ids
+
+    def encode_example(self, example, with_position_ids=True):
+        # 单个样本：读图、缩放、构造输入和标签、计算位置编码、填充或截断到max_seq_length
+        input_ids = self.tokenize_example(example, with_position_ids)
+
+        # padding
+        if len(input_ids["labels"]) < self.max_seq_length:
+            input_ids["input_ids"] = torch.cat(
+                [
+                    input_ids["input_ids"],
+                    torch.tensor(
+                        [self.processor.tokenizer.pad_token_id]
+                        * (self.max_seq_length - len(input_ids["input_ids"]))
+                    ).unsqueeze(0),
+                ],
+                dim=1,
+            )
+            input_ids["labels"] = torch.cat(
+                [
+                    input_ids["labels"],
+                    torch.tensor(
+                        [IGNORE_INDEX]
+                        * (self.max_seq_length - len(input_ids["labels"]))
+                    ).unsqueeze(0),
+                ],
+                dim=1,
+            )
+            input_ids["attention_mask"] = input_ids["input_ids"].ne(
+                self.processor.tokenizer.pad_token_id
+            )
+            # padding position_ids
+            if with_position_ids:
+                pad_length = self.max_seq_length - input_ids["position_ids"].shape[2]
+                input_ids["position_ids"] = torch.nn.functional.pad(
+                    input_ids["position_ids"], (0, pad_length), "constant", 1
+                )
+
+        # truncate
+        if len(input_ids["input_ids"][0]) > self.max_seq_length:
+            input_ids["input_ids"] = input_ids["input_ids"][
+                :, : self.max_seq_length
+            ]
+            input_ids["labels"] = input_ids["labels"][:, : self.max_seq_length]
+            input_ids["attention_mask"] = input_ids["attention_mask"][
+                :, : self.max_seq_length
+            ]
+            if with_position_ids:
+                input_ids["position_ids"] = input_ids["position_ids"][
+                    :, : self.max_seq_length
+                ]
+        return input_ids
+
     def get_rope_index_2(
         self,
         spatial_merge_size: Optional[int] = 2,
@@ -229,121 +251,83 @@ class QwenVLCollator:
         image_token_id = 151655
         video_token_id = 151656
         vision_start_token_id = 151652
-        mrope_position_deltas = []
         if input_ids is not None and (
             image_grid_thw is not None or video_grid_thw is not None
         ):
-            total_input_ids = input_ids
-            if attention_mask is None:
-                attention_mask = torch.ones_like(total_input_ids)
-            position_ids = torch.ones(
-                3,
-                input_ids.shape[0],
-                input_ids.shape[1],
-                dtype=input_ids.dtype,
-                device=input_ids.device,
+            batch_size, seq_length = input_ids.shape
+            device = input_ids.device
+            valid = None if attention_mask is None else attention_mask == 1
+            if valid is None or bool(valid.all()):
+                # 没有填充
+                order, in_range, tokens = None, None, input_ids
+            elif bool((valid[:, 1:] <= valid[:, :-1]).all()):
+                # 右侧填充，有效token已经在每行前面
+                order, in_range, tokens = None, valid, input_ids
+            else:
+                # 有效token稳定地排到每行前面
+                order = torch.argsort((~valid).to(torch.int8), dim=1, stable=True)
+                tokens = input_ids.gather(1, order)
+                in_range = torch.arange(seq_length, device=device) < valid.sum(1, keepdim=True)
+
+            # 紧跟在vision_start之后的图像/视频token是一段视觉token的开始，
+            # 按行优先的出现顺序依次对应image_grid_thw、video_grid_thw
+            starts = torch.zeros_like(tokens, dtype=torch.bool)
+            starts[:, 1:] = (tokens[:, :-1] == vision_start_token_id) & (
+                (tokens[:, 1:] == image_token_id) | (tokens[:, 1:] == video_token_id)
             )
-            image_index, video_index = 0, 0
-            for i, input_ids in enumerate(total_input_ids):
-                input_ids = input_ids[attention_mask[i] == 1]
-                image_nums, video_nums = 0, 0
-                vision_start_indices = torch.argwhere(
-                    input_ids == vision_start_token_id
-                ).squeeze(1)
-                vision_tokens = input_ids[vision_start_indices + 1]
-                image_nums = (vision_tokens == image_token_id).sum()
-                video_nums = (vision_tokens == video_token_id).sum()
-                input_tokens = input_ids.tolist()
-                llm_pos_ids_list: list = []
-                st = 0
-                remain_images, remain_videos = image_nums, video_nums
-                for _ in range(image_nums + video_nums):
-                    if image_token_id in input_tokens and remain_images > 0:
-                        ed_image = input_tokens.index(image_token_id, st)
-                    else:
-                        ed_image = len(input_tokens) + 1
-                    if video_token_id in input_tokens and remain_videos > 0:
-                        ed_video = input_tokens.index(video_token_id, st)
-                    else:
-                        ed_video = len(input_tokens) + 1
-                    if ed_image < ed_video:
-                        t, h, w = (
-                            image_grid_thw[image_index][0],
-                            image_grid_thw[image_index][1],
-                            image_grid_thw[image_index][2],
-                        )
-                        image_index += 1
-                        remain_images -= 1
-                        ed = ed_image
-                    else:
-                        t, h, w = (
-                            video_grid_thw[video_index][0],
-                            video_grid_thw[video_index][1],
-                            video_grid_thw[video_index][2],
-                        )
-                        video_index += 1
-                        remain_videos -= 1
-                        ed = ed_video
-                    llm_grid_t, llm_grid_h, llm_grid_w = (
-                        t.item(),
-                        h.item() // spatial_merge_size,
-                        w.item() // spatial_merge_size,
-                    )
-                    text_len = ed - st
-
-                    st_idx = (
-                        llm_pos_ids_list[-1].max() + 1
-                        if len(llm_pos_ids_list) > 0
-                        else 0
-                    )
-                    llm_pos_ids_list.append(
-                        torch.arange(text_len).view(1, -1).expand(3, -1) + st_idx
-                    )
-
-                    t_index = (
-                        torch.arange(llm_grid_t)
-                        .view(-1, 1)
-                        .expand(-1, llm_grid_h * llm_grid_w)
-                        .flatten()
-                    )
-                    h_index = (
-                        torch.arange(llm_grid_h)
-                        .view(1, -1, 1)
-                        .expand(llm_grid_t, -1, llm_grid_w)
-                        .flatten()
-                    )
-                    w_index = (
-                        torch.arange(llm_grid_w)
-                        .view(1, 1, -1)
-                        .expand(llm_grid_t, llm_grid_h, -1)
-                        .flatten()
-                    )
-                    llm_pos_ids_list.append(
-                        torch.stack([t_index, h_index, w_index]) + text_len + st_idx
-                    )
-                    st = ed + llm_grid_t * llm_grid_h * llm_grid_w
-
-                if st < len(input_tokens):
-                    st_idx = (
-                        llm_pos_ids_list[-1].max() + 1
-                        if len(llm_pos_ids_list) > 0
-                        else 0
-                    )
-                    text_len = len(input_tokens) - st
-                    llm_pos_ids_list.append(
-                        torch.arange(text_len).view(1, -1).expand(3, -1) + st_idx
-                    )
-
-                llm_positions = torch.cat(llm_pos_ids_list, dim=1).reshape(3, -1)
-                position_ids[..., i, attention_mask[i] == 1] = llm_positions.to(
-                    position_ids.device
-                )
-                mrope_position_deltas.append(
-                    llm_positions.max() + 1 - len(total_input_ids[i])
-                )
-            mrope_position_deltas = torch.tensor(
-                mrope_position_deltas, device=input_ids.device
-            ).unsqueeze(1)
+            if in_range is not None:
+                starts &= in_range
+            rows, cols = starts.nonzero(as_tuple=True)
+            is_image = tokens[rows, cols] == image_token_id
+            image_count = int(is_image.sum())
+            if image_count == len(rows) and image_grid_thw is not None:
+                grids = image_grid_thw[:image_count]
+            elif image_count == 0 and video_grid_thw is not None:
+                grids = video_grid_thw[: len(rows)]
+            else:
+                grids = torch.empty(len(rows), 3, dtype=torch.long, device=device)
+                grids[is_image] = image_grid_thw[:image_count].to(device, torch.long)
+                grids[~is_image] = video_grid_thw[: len(rows) - image_count].to(device, torch.long)
+            grids = grids.to(device, torch.long)
+            llm_grid_t = grids[:, 0]
+            llm_grid_h = grids[:, 1] // spatial_merge_size
+            llm_grid_w = grids[:, 2] // spatial_merge_size
+            length = llm_grid_t * llm_grid_h * llm_grid_w
+            ends = (cols + length).clamp(max=seq_length)
+
+            # 每段视觉token只占用max(t, h, w)个位置，之后的文本位置依次前移
+            saving = length - torch.maximum(llm_grid_t, torch.maximum(llm_grid_h, llm_grid_w))
+            shift = torch.zeros(batch_size, seq_length + 1, dtype=torch.long, device=device)
+            shift.index_put_((rows, ends), saving, accumulate=True)
+            shift = shift.cumsum(1)[:, :-1]
+            llm_positions = (torch.arange(seq_length, device=device) - shift).repeat(3, 1, 1)
+
+            # 视觉token：段起点的文本位置加上(t, h, w)下标
+            lengths = ends - cols
+            block = torch.repeat_interleave(lengths)
+            offset = torch.arange(len(block), device=device) - (lengths.cumsum(0) - lengths)[block]
+            base, hw, w, h = torch.stack([
+                cols - shift[rows, cols],
+                llm_grid_h * llm_grid_w,
+                llm_grid_w,
+                llm_grid_h,
+            ])[:, block]
+            llm_positions[:, rows[block], cols[block] + offset] = base + torch.stack(
+                [offset // hw, offset // w % h, offset % w]
+            )
+
+            if in_range is not None:
+                llm_positions = llm_positions.masked_fill(~in_range, 1)
+                mrope_position_deltas = llm_positions.masked_fill(~in_range, 0).amax(dim=(0, 2))
+            else:
+                mrope_position_deltas = llm_positions.amax(dim=(0, 2))
+            mrope_position_deltas = (mrope_position_deltas + 1 - seq_length).unsqueeze(1)
+            if order is None:
+                position_ids = llm_positions.to(input_ids.dtype)
+            else:
+                position_ids = torch.ones(
+                    3, batch_size, seq_length, dtype=input_ids.dtype, device=device
+                ).scatter_(2, order.expand(3, -1, -1), llm_positions.to(input_ids.dtype))
             return position_ids, mrope_position_deltas
         else:
             if attention_mask is not None:
@@ -374,4 +358,187 @@ class QwenVLCollator:
         
 
 
-vision_data_collator_map = {"Qwen2_5VLCollator": QwenVLCollator,}
\ No newline at end of file
+class PretokenizedDataset(torch.utils.data.Dataset):
+    # 读取pretokenize.py写出的分片，数组全部内存映射，取样本只做切片
+    def __init__(self, path):
+        self.shards = []
+        for name in sorted(os.listdir(path)):
+            shard_path = os.path.join(path, name)
+            meta_path = os.path.join(shard_path, "meta.json")
+            if not os.path.exists(meta_path):
+                continue
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            shard = {
+                key: np.load(os.path.join(shard_path, f"{key}.npy"), mmap_mode="r")
+                for key in ("input_ids", "attention_mask", "labels", "position_ids",
+                            "image_grid_thw", "pixel_offsets")
+            }
+            shard["pixel_values"] = np.memmap(
+                os.path.join(shard_path, "pixel_values.bin"),
+                dtype=meta["pixel_dtype"],
+                mode="r",
+                shape=tuple(meta["pixel_shape"]),
+            )
+            self.shards.append(shard)
+            self.max_seq_length = meta["max_seq_length"]
+        if not self.shards:
+            raise ValueError(f"No pretokenized shards found in {path}")
+        # 每个分片的起始下标
+        self.offsets = np.cumsum([0] + [len(shard["input_ids"]) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        shard_index = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        shard = self.shards[shard_index]
+        i = index - self.offsets[shard_index]
+        start, end = shard["pixel_offsets"][i], shard["pixel_offsets"][i + 1]
+        return {
+            "input_ids": shard["input_ids"][i],
+            "attention_mask": shard["attention_mask"][i],
+            "labels": shard["labels"][i],
+            "position_ids": shard["position_ids"][i],
+            "pixel_values": shard["pixel_values"][start:end],
+            "image_grid_thw": shard["image_grid_thw"][i],
+        }
+
+
+class PretokenizedCollator:
+    # 与QwenVLCollator输出相同的batch，只做拼接
+    def __init__(self, **kwargs):
+        pass
+
+    def __call__(self, examples):
+        return {
+            "input_ids": torch.from_numpy(
+                np.stack([example["input_ids"] for example in examples])
+            ).long(),
+            "attention_mask": torch.from_numpy(
+                np.stack([example["attention_mask"] for example in examples])
+            ),
+            "labels": torch.from_numpy(
+                np.stack([example["labels"] for example in examples])
+            ).long(),
+            # 半精度保存时转回float32，模型内部再转换为自己的精度
+            "pixel_values": torch.from_numpy(
+                np.concatenate([example["pixel_values"] for example in examples])
+            ).float(),
+            "image_grid_thw": torch.from_numpy(
+                np.stack([example["image_grid_thw"] for example in examples])
+            ).long(),
+            "position_ids": torch.from_numpy(
+                np.stack([example["position_ids"] for example in examples], axis=1)
+            ).long(),
+        }
+
+
+class PackingCollator(QwenVLCollator):
+    # 把batch内的多个样本拼接到同一行，行长不超过max_seq_length，减少填充的计算
+    # position_ids多出第0行：每个样本从0开始的文本位置。不传attention_mask时，模型据此构造块对角的因果掩码
+    # （flash attention据此得到cu_seqlens），样本之间互不可见；后三行是每个样本各自的3D位置编码
+    def __init__(
+        self, processor, max_seq_length=1024, max_img_side_length=1024, **kwargs
+    ):
+        super().__init__(processor, max_seq_length, max_img_side_length, **kwargs)
+        # 累计的有效token数、不打包时的总token数、打包后的总token数
+        self.stats = {"tokens": 0, "unpacked": 0, "packed": 0}
+
+    def __call__(self, examples):
+        samples = [self.pack_example(example) for example in examples]
+        lengths = [len(sample["input_ids"]) for sample in samples]
+        rows = self.pack(lengths)
+        width = max(sum(lengths[i] for i in row) for row in rows)
+        pad_token_id = self.processor.tokenizer.pad_token_id
+
+        input_ids, labels, position_ids, pixel_values, image_grid_thw = [], [], [], [], []
+        for row in rows:
+            parts = [samples[i] for i in row]
+            pad_length = width - sum(lengths[i] for i in row)
+            input_ids.append(torch.cat(
+                [part["input_ids"] for part in parts]
+                + [torch.full((pad_length,), pad_token_id, dtype=torch.long)]
+            ))
+            labels.append(torch.cat(
+                [part["labels"] for part in parts]
+                + [torch.full((pad_length,), IGNORE_INDEX, dtype=torch.long)]
+            ))
+            # 行尾的填充也单独从0开始，自成一段
+            text_position_ids = torch.cat(
+                [torch.arange(len(part["input_ids"])) for part in parts]
+                + [torch.arange(pad_length)]
+            )
+            rope_position_ids = torch.cat(
+                [part["position_ids"] for part in parts]
+                + [torch.arange(pad_length).expand(3, -1)],
+                dim=1,
+            )
+            position_ids.append(torch.cat([text_position_ids[None], rope_position_ids]))
+            # 图像特征按图像token出现的顺序填入，pixel_values与之保持一致
+            pixel_values.extend(part["pixel_values"] for part in parts)
+            image_grid_thw.extend(part["image_grid_thw"] for part in parts)
+
+        self.stats["tokens"] += sum(lengths)
+        self.stats["unpacked"] += len(samples) * self.max_seq_length
+        self.stats["packed"] += len(rows) * width
+        return {
+            "input_ids": torch.stack(input_ids),
+            "labels": torch.stack(labels),
+            "pixel_values": torch.cat(pixel_values),
+            "image_grid_thw": torch.cat(image_grid_thw),
+            "position_ids": torch.stack(position_ids, dim=1),
+            # 有KV缓存时模型不按position_ids区分样本，训练中不开梯度检查点时默认会创建缓存
+            "use_cache": False,
+        }
+
+    def pack_example(self, example):
+        # 截断后、未填充的样本，position_ids为(3, L)
+        if "input_ids" in example:
+            # PretokenizedDataset的样本，去掉填充
+            length = int(np.asarray(example["attention_mask"]).sum())
+            return {
+                "input_ids": torch.from_numpy(np.array(example["input_ids"][:length])).long(),
+                "labels": torch.from_numpy(np.array(example["labels"][:length])).long(),
+                "position_ids": torch.from_numpy(np.array(example["position_ids"][:, :length])).long(),
+                "pixel_values": torch.from_numpy(np.array(example["pixel_values"])).float(),
+                "image_grid_thw": torch.from_numpy(np.array(example["image_grid_thw"])).long().view(1, 3),
+            }
+        inputs = self.tokenize_example(example)
+        return {
+            "input_ids": inputs["input_ids"][0, : self.max_seq_length],
+            "labels": inputs["labels"][0, : self.max_seq_length],
+            "position_ids": inputs["position_ids"][:, 0, : self.max_seq_length],
+            "pixel_values": inputs["pixel_values"],
+            "image_grid_thw": inputs["image_grid_thw"],
+        }
+
+    def pack(self, lengths):
+        # first-fit decreasing，返回每行的样本下标
+        rows, free = [], []
+        for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+            for row, space in enumerate(free):
+                if lengths[i] <= space:
+                    rows[row].append(i)
+                    free[row] -= lengths[i]
+                    break
+            else:
+                rows.append([i])
+                free.append(self.max_seq_length - lengths[i])
+        return [sorted(row) for row in rows]
+
+    def padding_ratio(self):
+        # 不打包和打包后填充token的占比
+        if not self.stats["tokens"]:
+            return None
+        return {
+            "unpacked": 1 - self.stats["tokens"] / self.stats["unpacked"],
+            "packed": 1 - self.stats["tokens"] / self.stats["packed"],
+        }
+
+
+vision_data_collator_map = {"Qwen2_5VLCollator": QwenVLCollator,
+                            "Qwen2_5VLPackingCollator": PackingCollator,
+                            "PretokenizedCollator": PretokenizedCollator}
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+from transformers import AutoProcessor
+
+from collator import QwenVLCollator
+
+# 每个子进程中的collator，由init_worker设置
+_collator = None
+
+
+def init_worker(processor_path, max_seq_length, max_image_side):
+    global _collator
+    processor = AutoProcessor.from_pretrained(processor_path, local_files_only=True)
+    _collator = QwenVLCollator(processor, max_seq_length=max_seq_length, max_img_side_length=max_image_side)
+
+
+def load_examples(data_file):
+    # 与sft.py中preporocess_text相同的字段映射
+    examples = []
+    with open(data_file, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            examples.append({"image": item["image"], "user": item["query"], "assistant": item["response"]})
+    return examples
+
+
+def encode_shard(examples, shard_path, pixel_dtype):
+    # 逐个样本调用collator的encode_example，定长数组保存为npy，变长的pixel_values顺序写入bin文件
+    tmp_path = f"{shard_path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    arrays = {key: [] for key in ("input_ids", "attention_mask", "labels", "position_ids", "image_grid_thw")}
+    pixel_offsets = [0]
+    with open(os.path.join(tmp_path, "pixel_values.bin"), 'wb') as f:
+        for example in examples:
+            inputs = _collator.encode_example(example)
+            arrays["input_ids"].append(inputs["input_ids"][0].numpy().astype(np.int32))
+            arrays["attention_mask"].append(inputs["attention_mask"][0].numpy().astype(bool))
+            arrays["labels"].append(inputs["labels"][0].numpy().astype(np.int32))
+            # (3, 1, L) -> (3, L)
+            arrays["position_ids"].append(inputs["position_ids"][:, 0].numpy().astype(np.int32))
+            # 每个样本只有一张图像
+            arrays["image_grid_thw"].append(inputs["image_grid_thw"][0].numpy())
+            pixel_values = inputs["pixel_values"].numpy().astype(pixel_dtype)
+            f.write(pixel_values.tobytes())
+            pixel_offsets.append(pixel_offsets[-1] + len(pixel_values))
+    for key, values in arrays.items():
+        np.save(os.path.join(tmp_path, f"{key}.npy"), np.stack(values))
+    np.save(os.path.join(tmp_path, "pixel_offsets.npy"), np.array(pixel_offsets, dtype=np.int64))
+    with open(os.path.join(tmp_path, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({"samples": len(examples),
+                   "max_seq_length": _collator.max_seq_length,
+                   "max_image_side": _collator.max_img_side_length,
+                   "pixel_dtype": np.dtype(pixel_dtype).name,
+                   "pixel_shape": [pixel_offsets[-1], pixel_values.shape[1]]}, f)
+    # 写完后整体改名，中断时不会留下不完整的分片
+    os.replace(tmp_path, shard_path)
+    return len(examples)
+
+
+def pretokenize(data_path, save_path, processor_path, splits=('train', 'test'), max_seq_length=256,
+                max_image_side=256, shard_size=500, num_proc=os.cpu_count(), pixel_dtype='float32'):
+    # 每个划分写到save_path/split/下的多个分片，已经写出的分片直接跳过
+    pending = []
+    for split in splits:
+        examples = load_examples(os.path.join(data_path, f"{split}.jsonl"))
+        split_path = os.path.join(save_path, split)
+        os.makedirs(split_path, exist_ok=True)
+        for start in range(0, len(examples), shard_size):
+            end = min(start + shard_size, len(examples))
+            shard_path = os.path.join(split_path, f"{start:06d}-{end:06d}")
+            if not os.path.exists(shard_path):
+                pending.append((examples[start:end], shard_path, pixel_dtype))
+
+    with ProcessPoolExecutor(num_proc, initializer=init_worker,
+                             initargs=(processor_path, max_seq_length, max_image_side)) as pool:
+        futures = [pool.submit(encode_shard, *task) for task in pending]
+        with tqdm(total=sum(len(task[0]) for task in pending)) as progress:
+            for future in as_completed(futures):
+                progress.update(future.result())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="离线完成QwenVLCollator的全部处理，结果保存为内存映射的分片")
+    parser.add_argument('--processor', default='../model/Qwen2.5-VL-3B-Instruct')
+    parser.add_argument('--data-path', default='./data')
+    parser.add_argument('--save-path', default='./data/pretokenized')
+    parser.add_argument('--splits', nargs='+', default=['train', 'test'])
+    # 需要与训练配置中的max_seq_length、max_image_side一致
+    parser.add_argument('--max-seq-length', type=int, default=256)
+    parser.add_argument('--max-image-side', type=int, default=256)
+    parser.add_argument('--shard-size', type=int, default=500)
+    parser.add_argument('--num-proc', type=int, default=os.cpu_count())
+    parser.add_argument('--pixel-dtype', choices=['float32', 'float16'], default='float32',
+                        help="float16占用一半磁盘，训练时转回float32")
+    args = parser.parse_args()
+    pretokenize(args.data_path, args.save_path, args.processor, args.splits, args.max_seq_length,
+                args.max_image_side, args.shard_size, args.num_proc, args.pixel_dtype)
@@ -1,10 +1,26 @@
+import argparse
+import io
 import json
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from datasets import load_dataset
+import numpy as np
+from datasets import load_dataset, Image as ImageFeature
+from PIL import Image, ImageOps
 from qwen_vl_utils import smart_resize
 from tqdm import tqdm
 
+# 与推理服务共用仓库根目录下的图像解码
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imaging import ORIENTATION  # noqa: E402
+
+# 默认划分：前3000条为训练集，3000到3100为测试集
+SPLITS = {'train': (0, 3000), 'test': (3000, 3100)}
+
+# 每个子进程中的数据集，由init_worker设置
+_dataset = None
+
 
 def convert_to_qwen25vl_format(bbox, old_height, old_width, factor=28,
                                min_pixels=56 * 56,
@@ -27,50 +43,118 @@ def convert_to_qwen25vl_format(bbox, old_height, old_width, factor=28,
     return [x1_new, y1_new, x2_new, y2_new]
 
 
-def convert_to_sft_format(data_path, save_path, type='train'):
-    # 加载数据集
+def convert_boxes(bboxes, heights, widths, factor=28, min_pixels=56 * 56, max_pixels=14 * 14 * 4 * 1280):
+    # convert_to_qwen25vl_format的批量版本，输入为(N, 4)的[x, y, w, h]，结果与逐个转换相同
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    # smart_resize只对不同的尺寸计算一次
+    sizes = {size: smart_resize(size[0], size[1], factor, min_pixels, max_pixels)
+             for size in set(zip(heights, widths))}
+    new_sizes = np.array([sizes[size] for size in zip(heights, widths)], dtype=np.float64).reshape(-1, 2)
+    old_sizes = np.stack([heights, widths], axis=1).astype(np.float64)
+    # [h, w] -> [w, h, w, h]
+    scale = np.tile((new_sizes / old_sizes)[:, ::-1], 2)
+    limit = np.tile(new_sizes[:, ::-1] - 1, 2)
+    boxes = np.concatenate([bboxes[:, :2], bboxes[:, :2] + bboxes[:, 2:]], axis=1)
+    # np.round与内置round一样四舍六入五成双
+    return np.clip(np.round(boxes * scale), 0, limit).astype(np.int64)
+
+
+def init_worker(dataset):
+    global _dataset
+    _dataset = dataset
+
+
+def image_bytes(image):
+    # 不需要旋转的JPEG直接复制原始字节；其他图像与datasets解码时一样按EXIF方向旋转，再转为不带EXIF的JPEG
+    data = image['bytes']
+    if data is None:
+        with open(image['path'], 'rb') as f:
+            data = f.read()
+    # 只读取文件头得到格式、尺寸和方向，不解码像素
+    pil_image = Image.open(io.BytesIO(data))
+    if pil_image.format == 'JPEG' and pil_image.getexif().get(ORIENTATION, 1) == 1:
+        return data, pil_image.size
+    pil_image = ImageOps.exif_transpose(pil_image)
+    if pil_image.mode not in ('RGB', 'L'):
+        pil_image = pil_image.convert('RGB')
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format='JPEG')
+    return buffer.getvalue(), pil_image.size
+
+
+def convert_shard(split, start, end, save_path, shard_path):
+    # 转换[start, end)范围内的样本，写完后原子地生成分片文件
+    samples = _dataset.select(range(start, end))
+    image_dir = os.path.join(save_path, split)
+    os.makedirs(image_dir, exist_ok=True)
+    paths, sizes = [], []
+    for idx, image in zip(range(start, end), samples['image']):
+        data, size = image_bytes(image)
+        output_path = os.path.join(image_dir, f"{idx + 1:06d}.jpg")
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        paths.append(output_path)
+        sizes.append(size)
+
+    widths, heights = np.array(sizes).reshape(-1, 2).T
+    boxes = convert_boxes(samples['bbox'], heights, widths)
+    tmp_path = f"{shard_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for path, question, bbox in zip(paths, samples['question'], boxes.tolist()):
+            data = {"image": [path],
+                    "query": question,
+                    "response": json.dumps({"bbox_2d": bbox}, indent=None)}
+            f.write(json.dumps(data, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, shard_path)
+    return end - start
+
+
+def convert_to_sft_format(data_path, save_path, splits=SPLITS, num_proc=os.cpu_count(), shard_size=500):
+    # 一次加载数据集，所有划分的分片一起交给进程池，已经写出的分片直接跳过
     dataset = load_dataset(data_path, split='train')
+    # 不解码图像，拿到原始字节
+    dataset = dataset.cast_column('image', ImageFeature(decode=False))
+    shard_dir = os.path.join(save_path, 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+
+    shards, pending = {}, []
+    for split, (split_start, split_end) in splits.items():
+        split_end = min(split_end, len(dataset))
+        shards[split] = []
+        for start in range(split_start, split_end, shard_size):
+            end = min(start + shard_size, split_end)
+            shard_path = os.path.join(shard_dir, f"{split}-{start:06d}-{end:06d}.jsonl")
+            shards[split].append(shard_path)
+            if not os.path.exists(shard_path):
+                pending.append((split, start, end, save_path, shard_path))
+
+    with ProcessPoolExecutor(num_proc, initializer=init_worker, initargs=(dataset,)) as pool:
+        futures = [pool.submit(convert_shard, *task) for task in pending]
+        with tqdm(total=sum(task[2] - task[1] for task in pending)) as progress:
+            for future in as_completed(futures):
+                progress.update(future.result())
+
+    # 按顺序合并分片
+    for split, shard_paths in shards.items():
+        with open(os.path.join(save_path, f"{split}.jsonl"), 'w', encoding='utf-8') as jsonl_out:
+            for shard_path in shard_paths:
+                with open(shard_path, encoding='utf-8') as f:
+                    jsonl_out.write(f.read())
+
 
-    # 每个数据保存到一个jsonl文件中
-    if not os.path.exists(save_path):
-        os.makedirs(save_path)
-
-    # 创建 JSONL
-    jsonl_file = os.path.join(save_path, f"{type}.jsonl")
-    with open(jsonl_file, 'w', encoding='utf-8') as jsonl_out:
-        for idx, sample in tqdm(enumerate(dataset), total=len(dataset)):
-            if type == 'train':
-                if idx >= 3000:
-                    break
-            elif type == 'test':
-                if idx < 3000 or idx >= 3100:
-                    continue
-            # 保存图片
-            image = sample['image']
-            # 生成文件名
-            filename = f"{idx + 1:06d}.jpg"
-            jpg_path = os.path.join(save_path, type)
-            if not os.path.exists(jpg_path):
-                os.makedirs(jpg_path)
-            output_path = os.path.join(jpg_path, filename)
-            # 保存图片
-            image.save(output_path)
-
-            old_bbox = sample['bbox']
-            image_width, image_height = image.size
-            x1, y1, w, h = old_bbox
-            new_bboxes = [x1, y1, x1 + w, y1 + h]
-            # 转换坐标
-            qwen25_bboxes = convert_to_qwen25vl_format(new_bboxes, image_height, image_width)
-            bbox_dict = {"bbox_2d": qwen25_bboxes}
-            formatted_json = json.dumps(bbox_dict, indent=None)
-            data = {"image": [output_path],
-                    "query": sample['question'],
-                    "response": formatted_json}
-
-            jsonl_out.write(json.dumps(data, ensure_ascii=False) + '\n')
+def parse_split(value):
+    # name:start:end
+    name, start, end = value.split(':')
+    return name, (int(start), int(end))
 
 
 if __name__ == '__main__':
-    convert_to_sft_format(data_path='./textvqa_bbox', save_path='./data', type='train')
-    convert_to_sft_format(data_path='./textvqa_bbox', save_path='./data', type='test')
+    parser = argparse.ArgumentParser(description="将textvqa_bbox转换为微调使用的JSONL格式")
+    parser.add_argument('--data-path', default='./textvqa_bbox')
+    parser.add_argument('--save-path', default='./data')
+    parser.add_argument('--split', type=parse_split, action='append', help="name:start:end，可以指定多次")
+    parser.add_argument('--num-proc', type=int, default=os.cpu_count())
+    parser.add_argument('--shard-size', type=int, default=500)
+    args = parser.parse_args()
+    convert_to_sft_format(args.data_path, args.save_path, dict(args.split) if args.split else SPLITS,
+                          args.num_proc, args.shard_size)
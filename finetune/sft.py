@@ -10,7 +10,7 @@ from transformers import AutoProcessor, TrainingArguments, Trainer
 from transformers.trainer_utils import get_last_checkpoint
 from trl import TrlParser
 
-from collator import vision_data_collator_map
+from collator import vision_data_collator_map, PretokenizedDataset, PretokenizedCollator, PackingCollator
 from seed import set_seeds
 
 
@@ -89,6 +89,15 @@ class DataTrainingArguments:
             "help": "The size of the image to use for the dataset. Default is 224."
         },
     )
+    pretokenized_path: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": (
+                "Directory written by pretokenize.py. If set, train/test samples are read from "
+                "its memory-mapped shards instead of the JSONL datasets."
+            )
+        },
+    )
 
 
 @dataclass
@@ -135,32 +144,53 @@ def main(data_args, training_args, model_args, lora_args):
         )
         model = get_peft_model(model, lora_config)
 
-    train_dataset = datasets.load_dataset("json", data_files=data_args.train_dataset_name)
-    test_dataset = datasets.load_dataset("json", data_files=data_args.test_dataset_name)
-
-    raw_dataset = datasets.DatasetDict({
-        "train": train_dataset["train"],
-        "test": test_dataset["train"]
-    })
-    print(raw_dataset)
-
-    def preporocess_text(example):
-        return {
-            "image": example["image"],
-            "user": example["query"],
-            "assistant": example["response"],
+    if data_args.pretokenized_path:
+        # 离线处理好的样本，collator只做拼接
+        raw_dataset = {
+            split: PretokenizedDataset(os.path.join(data_args.pretokenized_path, split))
+            for split in ("train", "test")
         }
-
-    raw_dataset = raw_dataset.map(
-        preporocess_text,
-        remove_columns=raw_dataset["train"].column_names,
-        desc="Preprocessing textvqa dataset",
-    )
-    data_collator = vision_data_collator_map[data_args.data_collator](
-        processor=processor,
-        max_seq_length=data_args.max_seq_length,
-        max_img_side_length=data_args.max_image_side,
-    )
+        if raw_dataset["train"].max_seq_length != data_args.max_seq_length:
+            raise ValueError(
+                f"Pretokenized max_seq_length ({raw_dataset['train'].max_seq_length}) does not match "
+                f"--max_seq_length ({data_args.max_seq_length})."
+            )
+        print({split: len(dataset) for split, dataset in raw_dataset.items()})
+        if vision_data_collator_map[data_args.data_collator] is PackingCollator:
+            data_collator = PackingCollator(
+                processor=processor,
+                max_seq_length=data_args.max_seq_length,
+                max_img_side_length=data_args.max_image_side,
+            )
+        else:
+            data_collator = PretokenizedCollator()
+    else:
+        train_dataset = datasets.load_dataset("json", data_files=data_args.train_dataset_name)
+        test_dataset = datasets.load_dataset("json", data_files=data_args.test_dataset_name)
+
+        raw_dataset = datasets.DatasetDict({
+            "train": train_dataset["train"],
+            "test": test_dataset["train"]
+        })
+        print(raw_dataset)
+
+        def preporocess_text(example):
+            return {
+                "image": example["image"],
+                "user": example["query"],
+                "assistant": example["response"],
+            }
+
+        raw_dataset = raw_dataset.map(
+            preporocess_text,
+            remove_columns=raw_dataset["train"].column_names,
+            desc="Preprocessing textvqa dataset",
+        )
+        data_collator = vision_data_collator_map[data_args.data_collator](
+            processor=processor,
+            max_seq_length=data_args.max_seq_length,
+            max_img_side_length=data_args.max_image_side,
+        )
 
     last_checkpoint = None  # load last checkpoint if available
     if (
@@ -188,6 +218,9 @@ def main(data_args, training_args, model_args, lora_args):
         data_collator=data_collator,
     )
     trainer.train(resume_from_checkpoint=last_checkpoint)
+    if isinstance(data_collator, PackingCollator):
+        # dataloader_num_workers为0时统计才在主进程中
+        print(f"Padding ratio: {data_collator.padding_ratio()}")
     trainer.save_model(training_args.output_dir)
 
 
@@ -0,0 +1,46 @@
+import math
+
+from PIL import Image, ImageOps
+from qwen_vl_utils import smart_resize
+
+# EXIF方向标签，5到8需要交换宽高
+ORIENTATION = 0x0112
+
+
+def image_size(source):
+    # 只读取文件头，不解码像素
+    with Image.open(source) as image:
+        return image.size
+
+
+def target_size(width, height, min_pixels=None, max_pixels=None, max_side=None):
+    # 后续处理实际需要的尺寸(宽, 高)，None表示需要原图
+    if max_pixels is not None:
+        input_height, input_width = smart_resize(height, width, min_pixels=min_pixels or 0, max_pixels=max_pixels)
+        return input_width, input_height
+    if max_side is not None:
+        scale = min(max_side / width, max_side / height)
+        return math.ceil(width * scale), math.ceil(height * scale)
+    return None
+
+
+def load_image(source, min_pixels=None, max_pixels=None, max_side=None, transpose=False):
+    # 返回(RGB图像, 原图尺寸)。给定像素范围或最长边时，JPEG在DCT域按1/2、1/4、1/8缩小到不小于目标的最小尺寸，
+    # 后续的缩放从这个尺寸开始；transpose为True时按EXIF方向旋转，尺寸均为旋转后的
+    image = Image.open(source)
+    width, height = image.size
+    orientation = image.getexif().get(ORIENTATION, 1) if transpose else 1
+    swap = orientation in (5, 6, 7, 8)
+    if swap:
+        width, height = height, width
+    target = target_size(width, height, min_pixels, max_pixels, max_side)
+    if target is not None and image.format == 'JPEG':
+        image.draft('RGB', target[::-1] if swap else target)
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB' or image.size != (width, height):
+        # 缩小后的图像不再对应原文件，转换后不带文件名，不会被当作原始字节上传
+        image = image.convert('RGB')
+    else:
+        image.load()
+    return image, (width, height)
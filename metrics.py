@@ -0,0 +1,260 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, TRACE_LOG
+
+# 阶段耗时直方图的桶（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+enabled = METRICS_ENABLED
+trace_log = TRACE_LOG
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+# 当前上下文中的请求，批量推理时按行对应批内的每个请求，没有追踪的行为None
+_traces = contextvars.ContextVar('traces', default=())
+_log_file = None
+_log_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if enabled:
+        with _lock:
+            _counters[_key(name, labels)] += value
+
+
+def gauge(name, value, **labels):
+    if enabled:
+        with _lock:
+            _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # 各个桶的计数（最后一个为+Inf）、总和、总数
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect_left(BUCKETS, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def record_span(name, seconds, traces=None, rows=None, **attrs):
+    # 记录一个已知耗时的阶段，rows中的每个值是与traces逐行对应的列表
+    if not enabled:
+        return
+    observe('detect_stage_seconds', seconds, stage=name)
+    for i, trace in enumerate(_traces.get() if traces is None else traces):
+        if trace is not None:
+            span = {"name": name, "ms": round(seconds * 1000, 3), **attrs}
+            if rows:
+                span.update((key, values[i]) for key, values in rows.items())
+            trace.spans.append(span)
+
+
+class _Null:
+    # 关闭时所有埋点都返回这个对象，不计时也不分配内存
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+    def set_rows(self, **rows):
+        return self
+
+    def span(self, name, **attrs):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+
+NULL = _Null()
+
+
+class Span:
+    __slots__ = ('name', 'traces', 'attrs', 'rows', 'start')
+
+    def __init__(self, name, traces, attrs):
+        self.name = name
+        self.traces = traces
+        self.attrs = attrs
+        self.rows = {}
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_span(self.name, time.perf_counter() - self.start, self.traces, self.rows, **self.attrs)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def set_rows(self, **rows):
+        self.rows.update(rows)
+        return self
+
+
+class Trace:
+    # 一次请求的追踪，用作上下文管理器时其中的span自动归属到这个请求
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.token = None
+
+    def __enter__(self):
+        self.token = _traces.set((self,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _traces.reset(self.token)
+        self.finish(repr(exc) if exc is not None else None)
+        return False
+
+    def span(self, name, **attrs):
+        # 生成器中跨yield使用，不依赖上下文
+        return Span(name, (self,), attrs)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def finish(self, error=None):
+        seconds = time.perf_counter() - self.start
+        observe('detect_request_seconds', seconds, source=self.name)
+        inc('detect_requests_total', source=self.name)
+        if error is not None:
+            self.attrs['error'] = error
+            inc('detect_errors_total', source=self.name)
+        if trace_log:
+            write_trace({"trace_id": self.id, "name": self.name, "timestamp": self.timestamp,
+                         "ms": round(seconds * 1000, 3), **self.attrs, "spans": self.spans})
+
+
+def trace(name, **attrs):
+    return Trace(name, **attrs) if enabled else NULL
+
+
+def span(name, **attrs):
+    return Span(name, _traces.get(), attrs) if enabled else NULL
+
+
+def current_trace():
+    traces = _traces.get()
+    return traces[0] if traces else None
+
+
+@contextmanager
+def _attach(traces):
+    token = _traces.set(tuple(traces))
+    try:
+        yield
+    finally:
+        _traces.reset(token)
+
+
+def attach(traces):
+    # 在调度线程中把批内请求的追踪设为当前上下文
+    return _attach(traces) if enabled else NULL
+
+
+def write_trace(record):
+    global _log_file
+    with _log_lock:
+        if _log_file is None:
+            _log_file = open(trace_log, 'a', encoding='utf-8')
+        _log_file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        _log_file.flush()
+
+
+def _labels(labels, extra=()):
+    items = [*labels, *extra]
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+def render():
+    # Prometheus文本格式
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((key, (list(buckets), total, count)) for key, (buckets, total, count) in _histograms.items())
+    lines, declared = [], set()
+    for kind, items in (('counter', counters), ('gauge', gauges)):
+        for (name, labels), value in items:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), (buckets, total, count) in histograms:
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, bucket in zip((*BUCKETS, '+Inf'), buckets):
+            cumulative += bucket
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    # 在后台线程中提供/metrics
+    if not enabled or not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"监控指标服务启动失败：{str(e)}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"监控指标地址：http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -1,5 +1,7 @@
 from string import Template
 
+from config import COMPACT_OUTPUT
+
 
 def format_prompt(template, **kwargs):
     return Template(template).substitute(**kwargs)
@@ -48,4 +50,47 @@ PROMPT = \
 请现在开始分析图像并回答用户问题。
 **用户问题** 
 $query
-'''
\ No newline at end of file
+'''
+
+# 紧凑输出格式的检测提示模板，每个检测结果写成[x1, y1, x2, y2, "label"]，不换行不缩进
+COMPACT_PROMPT = \
+'''
+你是一个视觉分析助手，能够理解图像内容并回答用户问题。请仔细分析提供的图像，并根据用户的查询完成以下任务：
+
+**任务说明**
+1. 根据用户问题，智能地识别和定位图像中的相关物体
+2. 生成针对用户问题的详细回答
+3. 以指定的紧凑JSON格式输出结果
+
+**输出要求**
+请严格按照以下格式输出一行JSON，不要换行和缩进，不要添加任何其他内容。
+每个检测结果写成[左上角x, 左上角y, 右下角x, 右下角y, "物体名称"]，坐标为整数。
+{"answer":"这里是对用户问题的详细回答","detections":[[x1,y1,x2,y2,"物体名称1"],[x3,y3,x4,y4,"物体名称2"]]}
+
+**检测策略**
+- 如果用户询问特定物体（如"人物在哪里？"、"饮料是什么牌子？"），请重点检测相关物体
+- 如果用户询问整体内容（如"图里面有什么？"），请检测所有主要的物体，并标注名称
+- 如果用户要求标注特定物体（如"标注帆船和树"），请只检测指定物体，并在answer中回复"已完成标注。"
+- 如果无法检测到相关物体，detections数组可以为空
+
+**回答要求**
+- answer字段应该直接回应用户的问题，语言自然流畅
+- 如果是标注类请求，answer简洁回复
+- 如果是问答类请求，answer回答问题
+
+请现在开始分析图像并回答用户问题。
+**用户问题** 
+$query
+'''
+
+# 定位任务提示模板，与finetune/collator.py中微调时使用的格式一致
+GROUNDING_PROMPT = \
+'''${query}Please enclose the corresponding positions using coordinate boxes. Examples of coordinate value formats: [x1,y1,x2,y2]'''
+
+# 检测请求使用的模板
+DETECT_PROMPT = COMPACT_PROMPT if COMPACT_OUTPUT else PROMPT
+
+# 模板中$query之前的固定部分，本地模型用它复用前缀的KV缓存，并按它选择约束解码的输出格式
+PROMPT_PREFIX = PROMPT.split('$query')[0]
+COMPACT_PROMPT_PREFIX = COMPACT_PROMPT.split('$query')[0]
+PROMPT_PREFIXES = (PROMPT_PREFIX, COMPACT_PROMPT_PREFIX)
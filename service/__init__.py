@@ -1,2 +1,3 @@
-from .api import api_model
-from .local import LocalModel
\ No newline at end of file
+from .api import api_model, api_model_async, api_model_stream, APIModel
+from .local import LocalModel, GenerationError
+from .registry import registry, ModelRegistry
\ No newline at end of file
@@ -1,14 +1,174 @@
-from openai import OpenAI
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from config import API_KEY, API_BASE_URL, MODEL_NAME, SYSTEM_PROMPT
-from utils import encode_image, create_messages
+import httpx
+import metrics
+from qwen_vl_utils import smart_resize
+from openai import (OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient,
+                    APIConnectionError, APIStatusError)
+
+from config import (API_KEY, API_BASE_URL, MODEL_NAME, SYSTEM_PROMPT, MIN_PIXELS, MAX_PIXELS,
+                    API_CONCURRENCY, API_MAX_RETRIES, API_BACKOFF, API_TIMEOUT)
+from utils import encode_image_url, create_messages
+
+# 长连接客户端，进程内复用；inference_batch的线程池可能同时第一次调用，创建时加锁
+_client = None
+_client_lock = threading.Lock()
+# 异步客户端和并发信号量，按事件循环区分，循环结束时关闭
+_async_clients = {}
+
+
+def _limits():
+    return httpx.Limits(max_connections=API_CONCURRENCY,
+                        max_keepalive_connections=API_CONCURRENCY,
+                        keepalive_expiry=60)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # 重试由should_retry统一处理
+                _client = OpenAI(api_key=API_KEY, base_url=API_BASE_URL, max_retries=0, timeout=API_TIMEOUT,
+                                 http_client=DefaultHttpxClient(limits=_limits()))
+    return _client
+
+
+async def close_at_shutdown(loop):
+    # 事件循环结束前（asyncio.run会关闭循环上所有的异步生成器）关闭客户端和连接池，不随批量运行泄漏
+    try:
+        yield
+    finally:
+        client, _, _ = _async_clients.pop(loop)
+        await client.close()
+
+
+async def get_async_client():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        client = AsyncOpenAI(api_key=API_KEY, base_url=API_BASE_URL, max_retries=0, timeout=API_TIMEOUT,
+                             http_client=DefaultAsyncHttpxClient(limits=_limits()))
+        closer = close_at_shutdown(loop)
+        # 循环只弱引用异步生成器，和客户端存在一起
+        _async_clients[loop] = (client, asyncio.Semaphore(API_CONCURRENCY), closer)
+        await closer.__anext__()
+    client, semaphore, _ = _async_clients[loop]
+    return client, semaphore
+
+
+def should_retry(error):
+    # 429和5xx以及连接错误可以重试
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+def backoff(attempt):
+    # 指数退避加随机抖动
+    return API_BACKOFF * (2 ** attempt) * (1 + random.random())
+
+
+def record_usage(span, completion):
+    # 服务端返回的token用量
+    usage = getattr(completion, 'usage', None)
+    if usage is not None:
+        span.set(prompt_tokens=usage.prompt_tokens, generated_tokens=usage.completion_tokens)
+        metrics.inc('model_prompt_tokens_total', usage.prompt_tokens, model=MODEL_NAME)
+        metrics.inc('model_generated_tokens_total', usage.completion_tokens, model=MODEL_NAME)
 
 
 def api_model(image, prompt, min_pixels, max_pixels):
-    image = encode_image(image)
-    client = OpenAI(api_key=API_KEY, base_url=API_BASE_URL)
+    with metrics.span('encode'):
+        image = encode_image_url(image, min_pixels, max_pixels)
+    client = get_client()
     # 请求消息
     messages = create_messages(image, prompt, SYSTEM_PROMPT, min_pixels, max_pixels)
     # 发送请求并获取响应
-    completion = client.chat.completions.create(model=MODEL_NAME, messages=messages)
-    return completion.choices[0].message.content
+    for attempt in range(API_MAX_RETRIES + 1):
+        try:
+            with metrics.span('request', attempt=attempt) as span:
+                completion = client.chat.completions.create(model=MODEL_NAME, messages=messages)
+                record_usage(span, completion)
+            return completion.choices[0].message.content
+        except Exception as e:
+            if attempt == API_MAX_RETRIES or not should_retry(e):
+                raise
+            time.sleep(backoff(attempt))
+
+
+def api_model_stream(image, prompt, min_pixels, max_pixels):
+    # 逐段返回生成的文本
+    with metrics.span('encode'):
+        image = encode_image_url(image, min_pixels, max_pixels)
+    client = get_client()
+    messages = create_messages(image, prompt, SYSTEM_PROMPT, min_pixels, max_pixels)
+    for attempt in range(API_MAX_RETRIES + 1):
+        try:
+            stream = client.chat.completions.create(model=MODEL_NAME, messages=messages, stream=True)
+            break
+        except Exception as e:
+            if attempt == API_MAX_RETRIES or not should_retry(e):
+                raise
+            time.sleep(backoff(attempt))
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def api_model_async(image, prompt, min_pixels, max_pixels):
+    # 编码图像较耗时，放到线程池中执行
+    with metrics.span('encode'):
+        image = await asyncio.to_thread(encode_image_url, image, min_pixels, max_pixels)
+    client, semaphore = await get_async_client()
+    messages = create_messages(image, prompt, SYSTEM_PROMPT, min_pixels, max_pixels)
+    for attempt in range(API_MAX_RETRIES + 1):
+        try:
+            # 信号量限制同时在途的请求数，超出时排队等待
+            async with semaphore:
+                with metrics.span('request', attempt=attempt) as span:
+                    completion = await client.chat.completions.create(model=MODEL_NAME, messages=messages)
+                    record_usage(span, completion)
+            return completion.choices[0].message.content
+        except Exception as e:
+            if attempt == API_MAX_RETRIES or not should_retry(e):
+                raise
+            await asyncio.sleep(backoff(attempt))
+
+
+class APIModel:
+    # 与LocalModel接口一致的API后端，返回的输入尺寸由smart_resize计算
+    def __init__(self, model_name=MODEL_NAME, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS):
+        self.name = model_name
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+
+    def load(self):
+        get_client()
+        return True
+
+    def warmup(self):
+        pass
+
+    def unload(self):
+        pass
+
+    def input_size(self, image):
+        width, height = image.size
+        return smart_resize(height, width, min_pixels=self.min_pixels, max_pixels=self.max_pixels)
+
+    def inference(self, image, prompt):
+        response = api_model(image, prompt, min_pixels=self.min_pixels, max_pixels=self.max_pixels)
+        return (response, *self.input_size(image))
+
+    def inference_batch(self, images, prompts):
+        # 并发请求，并发数与连接池一致
+        with ThreadPoolExecutor(API_CONCURRENCY) as pool:
+            return list(pool.map(self.inference, images, prompts))
+
+    def inference_stream(self, image, prompt):
+        chunks = api_model_stream(image, prompt, min_pixels=self.min_pixels, max_pixels=self.max_pixels)
+        return (chunks, *self.input_size(image))
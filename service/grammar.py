@@ -0,0 +1,218 @@
+import torch
+from transformers import LogitsProcessor
+from transformers.convert_slow_tokenizer import bytes_to_unicode
+
+from prompt import PROMPT_PREFIX, COMPACT_PROMPT_PREFIX
+
+# 字符串、整数和带引号的整数符号，其余符号为字面量
+STRING = 'string'
+INTEGER = 'integer'
+QUOTED_INTEGER = 'quoted_integer'
+WHITESPACE = b' \t\n\r'
+ESCAPES = b'"\\/bfnrt'
+MAX_WHITESPACE = 16  # 两个符号之间最多的连续空白字节（换行和缩进），避免模型在空白上打转
+MAX_DIGITS = 5  # 坐标的最大位数
+
+
+class DetectionGrammar:
+    # 检测结果的字节级有限状态机。节点之间由字面量、字符串或整数连接，元组表示任选其一的符号，
+    # 状态为(节点, 分支, 进度)：分支为None时位于两个符号之间，进度为已读入的空白字节数
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.whitespace = not compact
+        self.nodes = {'end': []}
+        self.start = ('start', None, 0)
+        self.add_body('start', 'end')
+        if not compact:
+            # PROMPT要求的```json代码块，开始和结束成对出现
+            self.add('start', [b'```json'], 'fenced')
+            self.add_body('fenced', 'fenced.end')
+            self.add('fenced.end', [b'```'], 'end')
+
+    def add_body(self, start, end):
+        # {"answer": "...", "detections": [检测结果, ...]}
+        if self.compact:
+            item = [b'[', INTEGER, b',', INTEGER, b',', INTEGER, b',', INTEGER, b',', STRING, b']']
+        else:
+            # PROMPT示例中的坐标带引号，两种写法都接受
+            coordinate = (INTEGER, QUOTED_INTEGER)
+            item = [b'{', b'"bbox_2d"', b':', b'[', coordinate, b',', coordinate, b',', coordinate, b',', coordinate,
+                    b']', b',', b'"label"', b':', STRING, b'}']
+        self.add(start, [b'{', b'"answer"', b':', STRING, b',', b'"detections"', b':', b'['], f'{start}.list')
+        self.add(f'{start}.list', [b']'], f'{start}.close')
+        self.add(f'{start}.list', item, f'{start}.item')
+        self.add(f'{start}.item', [b','], f'{start}.next')
+        self.add(f'{start}.next', item, f'{start}.item')
+        self.add(f'{start}.item', [b']'], f'{start}.close')
+        self.add(f'{start}.close', [b'}'], end)
+
+    def add(self, node, symbols, end):
+        # 从node经过一串符号到end，中间节点自动命名
+        branch = len(self.nodes.setdefault(node, []))
+        names = [node] + [(node, branch, i) for i in range(1, len(symbols))] + [end]
+        for i, symbol in enumerate(symbols):
+            for alternative in symbol if isinstance(symbol, tuple) else (symbol,):
+                self.nodes.setdefault(names[i], []).append((alternative, names[i + 1]))
+
+    def accepts(self, state):
+        # 可以在这里结束生成
+        return state[0] == 'end' and state[1] is None
+
+    def step(self, state, byte):
+        # 读入一个字节，返回新状态，不合法时返回None
+        node, branch, progress = state
+        if branch is None:
+            if self.whitespace and byte in WHITESPACE:
+                return (node, None, progress + 1) if progress < MAX_WHITESPACE else None
+            for branch, (symbol, end) in enumerate(self.nodes[node]):
+                if symbol is STRING:
+                    if byte == 0x22:
+                        return node, branch, 1
+                elif symbol is QUOTED_INTEGER:
+                    if byte == 0x22:
+                        return node, branch, 0
+                elif symbol is INTEGER:
+                    if 0x30 <= byte <= 0x39:
+                        # 以0开头的整数不能再有其他数字
+                        return node, branch, MAX_DIGITS if byte == 0x30 else 1
+                elif symbol[0] == byte:
+                    return (end, None, 0) if len(symbol) == 1 else (node, branch, 1)
+            return None
+
+        symbol, end = self.nodes[node][branch]
+        if symbol is STRING:
+            if progress == 2:
+                # 转义字符之后
+                return (node, branch, 1) if byte in ESCAPES else None
+            if byte == 0x22:
+                return end, None, 0
+            if byte == 0x5c:
+                return node, branch, 2
+            # JSON字符串中不能直接出现控制字符
+            return (node, branch, 1) if byte >= 0x20 else None
+        if symbol is INTEGER:
+            if 0x30 <= byte <= 0x39:
+                return (node, branch, progress + 1) if progress < MAX_DIGITS else None
+            # 整数在第一个非数字字节处结束，这个字节属于下一个符号
+            return self.step((end, None, 0), byte)
+        if symbol is QUOTED_INTEGER:
+            # 进度为0时刚读入左引号，至少要有一位数字
+            if 0x30 <= byte <= 0x39:
+                if progress == 0:
+                    return node, branch, MAX_DIGITS if byte == 0x30 else 1
+                return (node, branch, progress + 1) if progress < MAX_DIGITS else None
+            return (end, None, 0) if byte == 0x22 and progress > 0 else None
+        if symbol[progress] != byte:
+            return None
+        return (end, None, 0) if progress + 1 == len(symbol) else (node, branch, progress + 1)
+
+    def in_string(self, state):
+        # 字符串内部：读入普通字节后状态不变
+        return state[1] is not None and self.step(state, 0x61) == state
+
+
+def token_bytes(tokenizer):
+    # 字节级BPE的每个token对应的原始字节，特殊token为None
+    decoder = {char: byte for byte, char in bytes_to_unicode().items()}
+    special = set(tokenizer.all_special_ids) | set(tokenizer.added_tokens_decoder)
+    tokens = []
+    for token_id, token in enumerate(tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))):
+        if token_id in special or token is None or any(char not in decoder for char in token):
+            tokens.append(None)
+        else:
+            tokens.append(bytes(decoder[char] for char in token))
+    return tokens
+
+
+class GrammarIndex:
+    # 语法在词表上的约束：每个状态允许的token按需计算后缓存，跨请求复用
+    def __init__(self, grammar, tokenizer):
+        self.grammar = grammar
+        self.tokens = token_bytes(tokenizer)
+        eos = [token for token in (tokenizer.eos_token, tokenizer.pad_token) if token is not None]
+        self.eos = list(set(tokenizer.convert_tokens_to_ids(eos)))
+        # 按首字节分组；字符串内部不改变状态的普通token和含引号、反斜杠、控制字符的token分开
+        self.by_first_byte = [[] for _ in range(256)]
+        self.plain, self.special = [], []
+        for token_id, data in enumerate(self.tokens):
+            if not data:
+                continue
+            self.by_first_byte[data[0]].append(token_id)
+            if b'"' in data or b'\\' in data or min(data) < 0x20:
+                self.special.append(token_id)
+            else:
+                self.plain.append(token_id)
+        self.masks = {}
+
+    def advance(self, state, token_id):
+        # 读入一个token，结束符和不合法的token返回None
+        data = self.tokens[token_id] if token_id < len(self.tokens) else None
+        if data is None:
+            return None
+        for byte in data:
+            state = self.grammar.step(state, byte)
+            if state is None:
+                return None
+        return state
+
+    def mask(self, state, vocab_size, device):
+        # 不允许的token为True
+        key = (state, vocab_size, device)
+        if key not in self.masks:
+            if self.grammar.in_string(state):
+                allowed = self.plain + [token_id for token_id in self.special if self.advance(state, token_id)]
+            else:
+                candidates = (token_id for byte in range(256) if self.grammar.step(state, byte)
+                              for token_id in self.by_first_byte[byte])
+                allowed = [token_id for token_id in candidates if self.advance(state, token_id)]
+            if self.grammar.accepts(state):
+                allowed += self.eos
+            mask = torch.ones(vocab_size, dtype=torch.bool)
+            mask[torch.tensor(allowed, dtype=torch.long)] = False
+            self.masks[key] = mask.to(device)
+        return self.masks[key]
+
+
+def prompt_grammar(prompt):
+    # 按提示词模板选择输出格式，其他提示词返回None，不做约束
+    if prompt.startswith(COMPACT_PROMPT_PREFIX):
+        return 'compact'
+    if prompt.startswith(PROMPT_PREFIX):
+        return 'json'
+    return None
+
+
+class GrammarLogitsProcessor(LogitsProcessor):
+    # 按每一行的语法状态屏蔽不合法的token。每次调用按已生成的token同步状态，
+    # 一步新增多个token或回退（投机解码）时只重新读入与上次不同的部分
+    def __init__(self, indexes, input_length):
+        self.indexes = indexes
+        self.length = input_length
+        self.tokens = [[] for _ in indexes]
+        # 每一行生成第i个token之前的状态
+        self.states = [[index.grammar.start] if index is not None else None for index in indexes]
+
+    def sync(self, row, tokens):
+        known, states = self.tokens[row], self.states[row]
+        common = len(known)
+        if tokens[:common] != known:
+            common = 0
+            while common < min(len(known), len(tokens)) and known[common] == tokens[common]:
+                common += 1
+        del known[common:], states[common + 1:]
+        index = self.indexes[row]
+        for token_id in tokens[common:]:
+            known.append(token_id)
+            states.append(index.advance(states[-1], token_id) if states[-1] is not None else None)
+        return states[-1]
+
+    def __call__(self, input_ids, scores):
+        generated = input_ids[:, self.length:].tolist()
+        for row, index in enumerate(self.indexes):
+            if index is None:
+                continue
+            state = self.sync(row, generated[row])
+            # 已经结束的行不再约束
+            if state is not None:
+                scores[row].masked_fill_(index.mask(state, scores.shape[-1], scores.device), -float('inf'))
+        return scores
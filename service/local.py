@@ -1,42 +1,325 @@
+import contextvars
+import copy
+import gc
+import inspect
+import os
+import queue
+import time
+from threading import Lock, Thread
+
 import torch
 from PIL import Image
-from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor
+from transformers import (Qwen2_5_VLForConditionalGeneration, Qwen2_5_VLModel, AutoConfig, AutoModelForCausalLM,
+                          AutoProcessor, TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList,
+                          LogitsProcessorList)
+from transformers.modeling_outputs import BaseModelOutputWithPooling
 
+import metrics
 from config import *
+from prompt import PROMPT_PREFIXES
+from utils import StreamParser, LRUCache, hash_image
+from .grammar import DetectionGrammar, GrammarIndex, GrammarLogitsProcessor, prompt_grammar
+
+VISION_START = '<|vision_start|>'
+IMAGE_PAD = '<|image_pad|>'
+# 纯文本草稿模型用不到的多模态输入，position_ids为多模态的多行位置
+VISION_KWARGS = ('pixel_values', 'image_grid_thw', 'mm_token_type_ids', 'mm_encoder_outputs', 'position_ids')
+# 草稿模型替换的transformers内部方法GenerationMixin._prefill的参数
+PREFILL_PARAMETERS = ['input_ids', 'generation_config', 'model_kwargs', 'is_first_iteration']
+
+
+class JsonStoppingCriteria(StoppingCriteria):
+    # 逐个token跟踪括号深度和字符串状态，顶层JSON对象闭合后立即停止
+    def __init__(self, tokenizer, input_length, batch_size=1):
+        self.tokenizer = tokenizer
+        self.length = input_length
+        self.parsers = [StreamParser() for _ in range(batch_size)]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        # 每步可能新增多个token（如投机解码），只解码新增的部分
+        texts = self.tokenizer.batch_decode(input_ids[:, self.length:], skip_special_tokens=True)
+        self.length = input_ids.shape[1]
+        for parser, text in zip(self.parsers, texts):
+            parser.feed(text)
+        return torch.tensor([parser.done for parser in self.parsers], dtype=torch.bool, device=input_ids.device)
+
+
+class GenerationTimer(StoppingCriteria):
+    # 第一次被调用时预填充和第一个token已经完成，用来区分预填充和解码耗时；
+    # 每次主模型前向后调用一次，投机解码时一步可能新增多个token
+    def __init__(self):
+        self.first_token = None
+        self.steps = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.steps += 1
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+class Cancelled(StoppingCriteria):
+    # 消费端放弃等待后停止后台生成，释放模型锁
+    def __init__(self):
+        self.cancelled = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancelled, dtype=torch.bool, device=input_ids.device)
+
+
+class GenerationError(RuntimeError):
+    pass
+
+
+class GenerationStream:
+    # 后台线程生成的文本迭代器。生成出错时结束文本流，在消费端抛出GenerationError；
+    # 超时没有新文本时同样抛出，并让后台生成在下一步停止。
+    # 后台线程在创建时的上下文中运行，预填充和解码阶段记录到当前请求的追踪
+    def __init__(self, streamer, target, kwargs):
+        self.streamer = streamer
+        self.cancel = Cancelled()
+        kwargs['stopping_criteria'] = StoppingCriteriaList([*(kwargs.get('stopping_criteria') or []), self.cancel])
+        self.error = None
+        self.thread = Thread(target=contextvars.copy_context().run, args=(self.run, target, kwargs), daemon=True)
+        self.thread.start()
+
+    def run(self, target, kwargs):
+        try:
+            target(**kwargs)
+        except Exception as e:
+            self.error = e
+            self.streamer.end()
+
+    def __iter__(self):
+        try:
+            yield from self.streamer
+        except queue.Empty:
+            self.cancel.cancelled = True
+            raise GenerationError(f"{self.streamer.timeout}秒内没有生成新的文本") from None
+        # 文本流结束后生成随即返回，等它记录完耗时和token数
+        self.thread.join()
+        if self.error is not None:
+            raise GenerationError(f"生成失败：{self.error}") from self.error
+
+
+def supports_vision_cache():
+    # 传入预先计算的视觉特征（mm_encoder_outputs）需要transformers 5
+    return 'mm_encoder_outputs' in inspect.signature(Qwen2_5_VLModel.forward).parameters
+
+
+def resolve_device(device=LOCAL_DEVICE):
+    if device == 'auto':
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    return device
+
+
+def cpu_threads():
+    # 容器或taskset限制时按进程可用的核心数
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+def quantize_int8(module):
+    # 逐层转为float32后量化，不需要先把整个模型转为float32：
+    # 线性层按输出通道做int8动态量化，嵌入层按行量化为8位，查表结果仍为float32
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear):
+            child = child.float()
+            child.qconfig = torch.ao.quantization.per_channel_dynamic_qconfig
+            setattr(module, name, torch.ao.nn.quantized.dynamic.Linear.from_float(child))
+        elif isinstance(child, torch.nn.Embedding):
+            child = child.float()
+            child.qconfig = torch.ao.quantization.float_qparams_weight_only_qconfig
+            setattr(module, name, torch.ao.nn.quantized.Embedding.from_float(child))
+        else:
+            quantize_int8(child)
+    return module
+
+
+def patchable_prefill(model):
+    # _prefill是没有版本保证的内部方法，签名与包装一致时才替换
+    prefill = getattr(model, '_prefill', None)
+    return prefill is not None and list(inspect.signature(prefill).parameters) == PREFILL_PARAMETERS
+
+
+def draft_generate(model, text_only=False):
+    # 辅助生成每轮调用一次草稿模型的generate，这里累计提出的候选token数；
+    # 主模型的多模态输入会原样传给草稿模型，纯文本草稿模型丢弃这些输入，图像占位符按普通token处理
+    generate = model.generate
+    model.proposed_tokens = 0
+    if not text_only and not patchable_prefill(model):
+        # 无法在草稿模型的第一轮带上图像特征时，按纯文本草稿模型处理；输出不变，接受率降低
+        print("当前transformers版本的_prefill与预期不一致，草稿LVLM不使用图像特征。")
+        text_only = True
+
+    def propose(*args, **kwargs):
+        if text_only:
+            for key in VISION_KWARGS:
+                kwargs.pop(key, None)
+        output = generate(*args, **kwargs)
+        model.proposed_tokens += getattr(output, 'sequences', output).shape[1] - kwargs['input_ids'].shape[1]
+        return output
+
+    model.generate = propose
+    if not text_only:
+        # transformers把草稿模型的每一轮都当作续写，prefill时会丢掉图像特征；
+        # 缓存为空的第一轮实际上是完整的prefill，需要带上图像特征
+        prefill = model._prefill
+
+        def prefill_with_vision(input_ids, generation_config, model_kwargs, is_first_iteration=True):
+            cache = model_kwargs.get('past_key_values')
+            first = cache is None or cache.get_seq_length() == 0
+            return prefill(input_ids, generation_config, model_kwargs, is_first_iteration=is_first_iteration or first)
+
+        model._prefill = prefill_with_vision
+    return model
 
 
 class LocalModel:
-    def __init__(self, model_path=MODEL_PATH):
+    def __init__(self, model_path=MODEL_PATH, processor_path=PROCESSOR_PATH, device=LOCAL_DEVICE,
+                 quantize=CPU_QUANTIZE, num_threads=CPU_THREADS, draft_model_path=DRAFT_MODEL_PATH,
+                 draft_tokens=DRAFT_TOKENS, constrained=CONSTRAINED_DECODING):
+        self.name = model_path
         self.model_path = model_path
+        self.processor_path = processor_path
+        self.device = resolve_device(device)
+        self.quantize = quantize
+        self.num_threads = num_threads
+        self.draft_model_path = draft_model_path
+        self.draft_tokens = draft_tokens
+        self.constrained = constrained
         self.model = None
         self.processor = None
+        self.draft_model = None
+        # generate会修改模型上的状态（如rope_deltas），同一时间只允许一个生成任务
+        self.lock = Lock()
+        # 前缀文本 -> (前缀token, KV缓存)
+        self.use_prefix_cache = PREFIX_CACHE
+        self.prefix_cache = {}
+        # (图像哈希, 缩放参数) -> (image_grid_thw, 视觉编码器输出)
+        self.vision_cache = None
+        if VISION_CACHE_MAX_BYTES:
+            if supports_vision_cache():
+                self.vision_cache = LRUCache(VISION_CACHE_MAX_BYTES)
+            else:
+                print("当前transformers版本不支持传入视觉特征，视觉特征缓存已关闭（需要transformers>=5）。")
+        # 输出格式 -> 语法在词表上的索引
+        self.grammars = {}
 
     def load(self):
+        if self.model is not None and self.processor is not None:
+            return True
         try:
             print("正在加载本地模型，这可能需要一些时间")
-            # bfloat16
-            self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(self.model_path,
-                                                                            torch_dtype=torch.bfloat16,
-                                                                            attn_implementation="flash_attention_2",
-                                                                            device_map="auto")
-            self.processor = AutoProcessor.from_pretrained('./model/Qwen2.5-VL-3B-Instruct')
+            self.model = self.load_weights(self.model_path)
+            if self.draft_model_path:
+                self.draft_model = self.load_draft()
+            self.processor = AutoProcessor.from_pretrained(self.processor_path)
+            # 批量推理时需要左侧填充
+            self.processor.tokenizer.padding_side = 'left'
             print("本地模型加载完成")
             return True
         except Exception as e:
             print(f"模型加载失败：{str(e)}")
             return False
 
-    def inference(self, image, prompt, system_prompt=SYSTEM_PROMPT, max_tokens=MAX_TOKENS):
-        print('正在推理')
-        if self.model is None or self.processor is None:
-            success = self.load()
-            if not success:
-                return "模型加载失败，请检查模型路径或环境配置。", None, None
+    @property
+    def min_pixels(self):
+        # 处理器实际使用的像素范围，与APIModel、StubModel的属性一致；处理器未加载时为None
+        return self.processor.image_processor.size['shortest_edge'] if self.processor is not None else None
 
-        # 处理图像输入
-        if isinstance(image, str):
-            image = Image.open(image)
+    @property
+    def max_pixels(self):
+        return self.processor.image_processor.size['longest_edge'] if self.processor is not None else None
 
+    def load_weights(self, path, model_class=Qwen2_5_VLForConditionalGeneration):
+        if self.device == 'cpu':
+            return self.load_cpu(path, model_class)
+        # bfloat16
+        return model_class.from_pretrained(path,
+                                           torch_dtype=torch.bfloat16,
+                                           attn_implementation="flash_attention_2",
+                                           device_map="auto")
+
+    def load_cpu(self, path, model_class=Qwen2_5_VLForConditionalGeneration):
+        # CPU上没有flash attention，不支持AMX或AVX512-BF16的CPU上bfloat16矩阵乘很慢：按bfloat16读入以减少峰值内存，
+        # 线性层和嵌入层量化为int8，其余参数转为float32
+        torch.set_num_threads(self.num_threads or cpu_threads())
+        model = model_class.from_pretrained(path,
+                                            torch_dtype=torch.bfloat16,
+                                            attn_implementation="sdpa")
+        if self.quantize:
+            quantize_int8(model)
+        return model.float().eval()
+
+    def load_draft(self):
+        # 草稿LVLM直接使用主模型算好的图像特征，语言模型的隐藏维度需要一致；纯文本草稿模型需要与主模型共用分词器
+        config = AutoConfig.from_pretrained(self.draft_model_path)
+        if hasattr(config, 'vision_config'):
+            if config.vision_config.out_hidden_size != self.model.config.vision_config.out_hidden_size:
+                raise ValueError("草稿LVLM的图像特征维度与主模型不一致，请使用纯文本草稿模型")
+            draft_model = draft_generate(self.load_weights(self.draft_model_path))
+        else:
+            draft_model = draft_generate(self.load_weights(self.draft_model_path, AutoModelForCausalLM), text_only=True)
+        # 每轮最多提出draft_tokens个token，草稿模型的置信度低于阈值时提前结束这一轮
+        draft_model.generation_config.num_assistant_tokens = self.draft_tokens
+        draft_model.generation_config.num_assistant_tokens_schedule = 'constant'
+        return draft_model
+
+    def speculative(self, batch_size):
+        # 辅助生成只支持batch size为1，批量请求照常生成
+        return self.draft_model is not None and batch_size == 1
+
+    def warmup(self):
+        # 用空白图像和短提示跑一次完整推理，提前完成内核编译和显存分配
+        image = Image.new('RGB', (224, 224), 'white')
+        self.inference_batch([image], ["图里面有什么？"], max_tokens=8, early_stop=False)
+        if self.constrained:
+            # 提前建立检测结果格式在词表上的索引
+            self.grammar_index('compact' if COMPACT_OUTPUT else 'json')
+
+    def unload(self):
+        # 显式释放权重和显存
+        self.model = None
+        self.processor = None
+        self.draft_model = None
+        self.grammars.clear()
+        self.prefix_cache.clear()
+        if self.vision_cache is not None:
+            self.vision_cache.clear()
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def build_text(self, image, prompt, system_prompt=SYSTEM_PROMPT):
+        # 图像在文本之前，与微调数据（finetune/collator.py）的消息顺序一致
+        content = [
+            {
+                "image": image
+            },
+            {
+                "type": "text",
+                "text": prompt
+            }
+        ]
+        template = next((prefix for prefix in PROMPT_PREFIXES if prompt.startswith(prefix)), None)
+        if self.use_prefix_cache and template:
+            # 固定的模板放在图像之前，图像之前的部分对使用同一模板的请求都相同
+            content = [
+                {
+                    "type": "text",
+                    "text": template
+                },
+                {
+                    "image": image
+                },
+                {
+                    "type": "text",
+                    "text": prompt[len(template):]
+                }
+            ]
         # 构建消息
         messages = [
             {
@@ -45,31 +328,205 @@ class LocalModel:
             },
             {
                 "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "image": image
-                    }
-                ]
+                "content": content
             }
         ]
-
         # 应用模板
-        text = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        # 处理输入
-        inputs = self.processor(text=[text], images=[image], padding=True, return_tensors="pt").to(self.model.device)
+        return self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def inference(self, image, prompt, system_prompt=SYSTEM_PROMPT, max_tokens=MAX_TOKENS, early_stop=EARLY_STOP):
+        print('正在推理')
+        output_text, input_height, input_width = self.inference_batch([image], [prompt], system_prompt, max_tokens,
+                                                                      early_stop)[0]
+        print('推理完成')
+        print(output_text)
+        return output_text, input_height, input_width
+
+    def stopping_criteria(self, inputs, early_stop=EARLY_STOP):
+        if not early_stop:
+            return None
+        input_ids = inputs['input_ids']
+        return StoppingCriteriaList([JsonStoppingCriteria(self.processor.tokenizer,
+                                                          input_ids.shape[1], input_ids.shape[0])])
+
+    def logits_processor(self, inputs, prompts):
+        # 检测模板的请求按对应的输出格式约束解码，其他提示词不受影响
+        formats = [prompt_grammar(prompt) for prompt in prompts] if self.constrained else []
+        if not any(formats):
+            return None
+        indexes = [self.grammar_index(name) if name else None for name in formats]
+        return LogitsProcessorList([GrammarLogitsProcessor(indexes, inputs['input_ids'].shape[1])])
+
+    def grammar_index(self, name):
+        # 每个状态允许的token只依赖语法和分词器，跨请求复用
+        if name not in self.grammars:
+            self.grammars[name] = GrammarIndex(DetectionGrammar(compact=name == 'compact'), self.processor.tokenizer)
+        return self.grammars[name]
+
+    def inference_batch(self, images, prompts, system_prompt=SYSTEM_PROMPT, max_tokens=MAX_TOKENS,
+                        early_stop=EARLY_STOP):
+        if self.model is None or self.processor is None:
+            success = self.load()
+            if not success:
+                return [("模型加载失败，请检查模型路径或环境配置。", None, None)] * len(images)
+
+        # 处理图像输入
+        images = [Image.open(image) if isinstance(image, str) else image for image in images]
+        inputs = self.prepare_inputs(images, prompts, system_prompt)
         # 生成输出
-        output_ids = self.model.generate(**inputs, max_new_tokens=max_tokens)
-        generated_ids = [output_ids[len(input_ids):] for input_ids, output_ids in zip(inputs.input_ids, output_ids)]
+        output_ids = self.generate_locked(**inputs, max_new_tokens=max_tokens,
+                                          stopping_criteria=self.stopping_criteria(inputs, early_stop),
+                                          logits_processor=self.logits_processor(inputs, prompts))
+        generated_ids = output_ids[:, inputs.input_ids.shape[1]:]
         output_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True,
                                                   clean_up_tokenization_spaces=True)
 
-        # 获取输入图像尺寸
-        input_height = inputs['image_grid_thw'][0][1] * 14
-        input_width = inputs['image_grid_thw'][0][2] * 14
-        print('推理完成')
-        print(output_text[0])
-        return output_text[0], input_height, input_width
+        # 获取每张输入图像的尺寸
+        input_sizes = (inputs['image_grid_thw'][:, 1:] * 14).tolist()
+        return [(text, input_height, input_width)
+                for text, (input_height, input_width) in zip(output_text, input_sizes)]
+
+    def prepare_inputs(self, images, prompts, system_prompt=SYSTEM_PROMPT):
+        # 缩放、归一化和分词
+        with metrics.span('preprocess') as span:
+            inputs = self.build_inputs(images, prompts, system_prompt)
+            if metrics.enabled:
+                span.set_rows(pixels=[image.width * image.height for image in images],
+                              image_grid_thw=inputs['image_grid_thw'].tolist(),
+                              prompt_tokens=inputs['attention_mask'].sum(dim=1).tolist())
+        return inputs
+
+    def build_inputs(self, images, prompts, system_prompt=SYSTEM_PROMPT):
+        texts = [self.build_text(image, prompt, system_prompt) for image, prompt in zip(images, prompts)]
+        if self.speculative(len(texts)):
+            # 草稿模型需要从头处理完整的输入，不使用前缀KV缓存和视觉特征缓存
+            return self.processor(text=texts, images=images, padding=True, return_tensors="pt").to(self.model.device)
+        prefixes = {text[:text.index(VISION_START)] for text in texts}
+        if not (self.use_prefix_cache and len(prefixes) == 1 and all(p.startswith(PROMPT_PREFIXES) for p in prompts)):
+            # 处理输入，左侧填充后一次生成
+            return self.process(texts, images)
+
+        # 共享前缀放在最前面，只对图像及之后的部分做左侧填充，前缀的KV直接从缓存复制
+        prefix = prefixes.pop()
+        prefix_ids, past_key_values = self.get_prefix_cache(prefix)
+        inputs = self.process([text[len(prefix):] for text in texts], images)
+        batch_size, prefix_length = len(texts), prefix_ids.shape[1]
+        inputs['input_ids'] = torch.cat([prefix_ids.expand(batch_size, -1), inputs['input_ids']], dim=1)
+        for key, fill in (('attention_mask', 1), ('mm_token_type_ids', 0)):
+            if key in inputs:
+                front = torch.full((batch_size, prefix_length), fill, dtype=inputs[key].dtype, device=inputs[key].device)
+                inputs[key] = torch.cat([front, inputs[key]], dim=1)
+        past_key_values = copy.deepcopy(past_key_values)
+        past_key_values.batch_repeat_interleave(batch_size)
+        inputs['past_key_values'] = past_key_values
+        return inputs
+
+    def process(self, texts, images):
+        if self.vision_cache is None:
+            return self.processor(text=texts, images=images, padding=True, return_tensors="pt").to(self.model.device)
+        # 视觉特征来自缓存，手动展开图像占位符，只对文本分词
+        image_grid_thw, image_embeds = self.encode_images(images)
+        merge_length = self.processor.image_processor.merge_size ** 2
+        texts = [text.replace(IMAGE_PAD, IMAGE_PAD * (grid_thw.prod().item() // merge_length), 1)
+                 for text, grid_thw in zip(texts, image_grid_thw)]
+        inputs = self.processor(text=texts, padding=True, return_tensors="pt").to(self.model.device)
+        inputs['image_grid_thw'] = image_grid_thw.to(self.model.device)
+        inputs['mm_encoder_outputs'] = {"image": BaseModelOutputWithPooling(pooler_output=image_embeds)}
+        return inputs
+
+    def encode_images(self, images):
+        # 按图像内容和缩放参数查缓存，未命中的图像一起做预处理和视觉编码
+        resize = str(self.processor.image_processor.size)
+        keys = [(hash_image(image), resize) for image in images]
+        entries = [self.vision_cache.get(key) for key in keys]
+        missed = [i for i, entry in enumerate(entries) if entry is None]
+        if missed:
+            vision_inputs = self.processor.image_processor(images=[images[i] for i in missed], return_tensors="pt")
+            pixel_values = vision_inputs['pixel_values'].to(self.model.device)
+            grid_thw = vision_inputs['image_grid_thw'].to(self.model.device)
+            with metrics.span('vision_encode', images=len(missed)), self.lock, torch.no_grad():
+                embeds = self.model.model.get_image_features(pixel_values, grid_thw).pooler_output
+            for i, thw, embed in zip(missed, grid_thw.cpu(), embeds):
+                entries[i] = (thw, embed)
+                self.vision_cache.put(keys[i], entries[i], embed.numel() * embed.element_size())
+        return torch.stack([thw for thw, _ in entries]), tuple(embed for _, embed in entries)
+
+    def get_prefix_cache(self, prefix):
+        # 每个加载的模型对同一前缀只预填充一次
+        if prefix not in self.prefix_cache:
+            prefix_ids = self.processor.tokenizer(prefix, return_tensors="pt").input_ids.to(self.model.device)
+            with self.lock, torch.no_grad():
+                outputs = self.model(input_ids=prefix_ids, use_cache=True)
+            self.prefix_cache[prefix] = (prefix_ids, outputs.past_key_values)
+        return self.prefix_cache[prefix]
+
+    def generate_locked(self, **kwargs):
+        timer = None
+        if metrics.enabled:
+            timer = GenerationTimer()
+            kwargs['stopping_criteria'] = StoppingCriteriaList([*(kwargs.get('stopping_criteria') or []), timer])
+        speculative = self.speculative(kwargs['input_ids'].shape[0])
+        if speculative:
+            kwargs['assistant_model'] = self.draft_model
+            self.draft_model.proposed_tokens = 0
+        with self.lock:
+            if 'past_key_values' in kwargs:
+                # 从前缀缓存继续生成时按完整输入重新计算多模态位置
+                for module in (self.model, self.model.model):
+                    if hasattr(module, 'rope_deltas'):
+                        module.rope_deltas = None
+            start = time.perf_counter()
+            output_ids = self.model.generate(**kwargs)
+        if timer is not None and timer.first_token is not None:
+            self.record_generation(kwargs, output_ids, start, timer.first_token, time.perf_counter(),
+                                   (timer.steps, self.draft_model.proposed_tokens) if speculative else None)
+        return output_ids
+
+    def record_generation(self, inputs, output_ids, start, first_token, end, draft_stats=None):
+        # 生成部分中填充token之外的都算作生成的token
+        generated = (output_ids[:, inputs['input_ids'].shape[1]:] != self.processor.tokenizer.pad_token_id).sum(dim=1).tolist()
+        decode_seconds = end - first_token
+        tokens_per_second = [(tokens - 1) / decode_seconds if decode_seconds > 0 else 0.0 for tokens in generated]
+        speculation = {}
+        if draft_stats:
+            # (主模型前向次数, 草稿模型提出的token数)，每次前向验证一轮候选，接受的候选之外还会新增一个token
+            steps, proposed = draft_stats
+            accepted = sum(generated) - steps
+            speculation = {"acceptance_rate": accepted / proposed if proposed else 0.0,
+                           "tokens_per_step": sum(generated) / steps}
+        metrics.record_span('prefill', first_token - start)
+        metrics.record_span('decode', decode_seconds, rows={"generated_tokens": generated,
+                                                            "tokens_per_second": tokens_per_second},
+                            **speculation)
+        metrics.inc('model_prompt_tokens_total', inputs['attention_mask'].sum().item(), model=self.name)
+        metrics.inc('model_generated_tokens_total', sum(generated), model=self.name)
+        if speculation:
+            metrics.inc('speculative_proposed_tokens_total', proposed, model=self.name)
+            metrics.inc('speculative_accepted_tokens_total', accepted, model=self.name)
+            metrics.gauge('speculative_acceptance_rate', speculation['acceptance_rate'], model=self.name)
+            # 相对逐token解码，主模型前向次数减少的倍数
+            metrics.gauge('speculative_tokens_per_step', speculation['tokens_per_step'], model=self.name)
+        if decode_seconds > 0:
+            metrics.gauge('model_tokens_per_second', (sum(generated) - len(generated)) / decode_seconds,
+                          model=self.name)
+
+    def inference_stream(self, image, prompt, system_prompt=SYSTEM_PROMPT, max_tokens=MAX_TOKENS,
+                         early_stop=EARLY_STOP, timeout=STREAM_TIMEOUT):
+        # 返回(文本片段迭代器, 输入高度, 输入宽度)，生成在后台线程中进行
+        if self.model is None or self.processor is None:
+            success = self.load()
+            if not success:
+                return iter(["模型加载失败，请检查模型路径或环境配置。"]), None, None
+
+        if isinstance(image, str):
+            image = Image.open(image)
+        inputs = self.prepare_inputs([image], [prompt], system_prompt)
+        streamer = TextIteratorStreamer(self.processor.tokenizer, skip_prompt=True, skip_special_tokens=True,
+                                        timeout=timeout)
+        chunks = GenerationStream(streamer, self.generate_locked,
+                                  dict(**inputs, max_new_tokens=max_tokens, streamer=streamer,
+                                       stopping_criteria=self.stopping_criteria(inputs, early_stop),
+                                       logits_processor=self.logits_processor(inputs, [prompt])))
+
+        input_height, input_width = (inputs['image_grid_thw'][0, 1:] * 14).tolist()
+        return iter(chunks), input_height, input_width
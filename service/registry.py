@@ -0,0 +1,55 @@
+import threading
+import time
+
+from .api import APIModel
+from .local import LocalModel
+from .stub import StubModel
+
+
+class ModelRegistry:
+    # 进程内的模型注册表：按键加载、预热并常驻，切换后端不需要重新加载模块
+    def __init__(self):
+        self.factories = {}
+        self.models = {}
+        self.load_times = {}
+        self.lock = threading.Lock()
+
+    def register(self, key, factory):
+        self.factories[key] = factory
+
+    def load(self, key, warmup=True):
+        with self.lock:
+            if key in self.models:
+                return self.models[key]
+            if key not in self.factories:
+                raise KeyError(f"未注册的后端: {key}")
+            start = time.perf_counter()
+            model = self.factories[key]()
+            if not model.load():
+                raise RuntimeError(f"后端{key}加载失败")
+            if warmup:
+                model.warmup()
+            self.load_times[key] = time.perf_counter() - start
+            print(f"后端{key}已就绪，耗时{self.load_times[key]:.1f}秒")
+            self.models[key] = model
+            return model
+
+    def get(self, key):
+        model = self.models.get(key)
+        # 未预加载的后端在第一次使用时加载
+        return model if model is not None else self.load(key)
+
+    def unload(self, key):
+        with self.lock:
+            model = self.models.pop(key, None)
+        if model is not None:
+            model.unload()
+
+    def loaded(self):
+        return list(self.models)
+
+
+registry = ModelRegistry()
+registry.register('local', LocalModel)
+registry.register('api', APIModel)
+registry.register('stub', StubModel)
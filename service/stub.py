@@ -0,0 +1,54 @@
+import json
+import time
+
+from qwen_vl_utils import smart_resize
+
+from config import MIN_PIXELS, MAX_PIXELS
+
+
+class StubModel:
+    # 确定性的桩后端，不加载模型，用于基准测试和冒烟测试
+    def __init__(self, detections=3, latency=0.0, item_latency=0.0, min_pixels=MIN_PIXELS, max_pixels=MAX_PIXELS):
+        self.name = "stub"
+        self.detections = detections
+        self.latency = latency
+        self.item_latency = item_latency
+        self.min_pixels = min_pixels
+        self.max_pixels = max_pixels
+
+    def load(self):
+        return True
+
+    def warmup(self):
+        pass
+
+    def unload(self):
+        pass
+
+    def input_size(self, image):
+        width, height = image.size
+        return smart_resize(height, width, min_pixels=self.min_pixels, max_pixels=self.max_pixels)
+
+    def response(self, image):
+        # 在模型输入空间中均匀排布检测框
+        input_height, input_width = self.input_size(image)
+        detections = []
+        for i in range(self.detections):
+            x1 = input_width * (i % 4) // 4
+            y1 = input_height * (i // 4 % 4) // 4
+            detections.append({"bbox_2d": [x1, y1, x1 + input_width // 5, y1 + input_height // 5],
+                               "label": f"物体{i + 1}"})
+        result = {"answer": f"检测到{self.detections}个物体。", "detections": detections}
+        return f"```json\n{json.dumps(result, ensure_ascii=False, indent=2)}\n```"
+
+    def inference(self, image, prompt):
+        return self.inference_batch([image], [prompt])[0]
+
+    def inference_batch(self, images, prompts):
+        # 模拟批量推理：固定开销加上每项开销
+        time.sleep(self.latency + self.item_latency * len(images))
+        return [(self.response(image), *self.input_size(image)) for image in images]
+
+    def inference_stream(self, image, prompt):
+        response, input_height, input_width = self.inference(image, prompt)
+        return iter(response.splitlines(keepends=True)), input_height, input_width
@@ -0,0 +1,29 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import service.api
+
+
+def test_concurrent_first_calls_share_one_client(monkeypatch):
+    created = []
+
+    def client(**kwargs):
+        # 创建较慢时，没有锁的话同时到达的线程都会各自创建
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    monkeypatch.setattr(service.api, 'OpenAI', client)
+    monkeypatch.setattr(service.api, 'DefaultHttpxClient', lambda **kwargs: None)
+    monkeypatch.setattr(service.api, '_client', None)
+    barrier = threading.Barrier(8)
+
+    def first_call(_):
+        barrier.wait()
+        return service.api.get_client()
+
+    with ThreadPoolExecutor(8) as pool:
+        clients = list(pool.map(first_call, range(8)))
+    assert len(created) == 1
+    assert all(client is created[0] for client in clients)
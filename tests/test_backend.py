@@ -0,0 +1,15 @@
+from PIL import Image
+
+from core.detect import detect, detect_stream, get_model, resolve_backend
+
+
+def test_unknown_backend_returns_load_failure_message():
+    assert get_model('missing') is None
+    image = Image.new('RGB', (64, 64))
+    assert detect(image, "找树", backend='missing') == ("模型加载失败，请检查模型路径或环境配置。", None)
+    assert list(detect_stream(image, "找树", backend='missing')) == [("模型加载失败，请检查模型路径或环境配置。", None)]
+
+
+def test_backend_choice_names_map_to_keys():
+    assert resolve_backend("API模式") == 'api'
+    assert resolve_backend('stub') == 'stub'
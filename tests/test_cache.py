@@ -0,0 +1,45 @@
+from PIL import Image
+
+from core.cache import ResultCache, normalize_query
+
+RESULT = {"answer": "图中有一棵树。", "detections": [{"bbox_2d": [1, 2, 30, 40], "label": "树"}]}
+
+
+def image(color=(255, 0, 0)):
+    return Image.new('RGB', (32, 32), color)
+
+
+def test_key_normalizes_query_and_separates_parameters():
+    key = ResultCache.make_key(image(), "  找 一棵  树 ", "local", "m", 1, 2)
+    assert key == ResultCache.make_key(image(), "找 一棵 树", "local", "m", 1, 2)
+    assert normalize_query(" A  b ") == "a b"
+    assert key != ResultCache.make_key(image((0, 255, 0)), "找 一棵 树", "local", "m", 1, 2)
+    assert key != ResultCache.make_key(image(), "找 一棵 树", "api", "m", 1, 2)
+    assert key != ResultCache.make_key(image(), "找 一棵 树", "local", "m", 1, 2, 1280)
+
+
+def test_memory_hit_and_miss():
+    cache = ResultCache(1024 * 1024)
+    assert cache.get("a") is None
+    cache.put("a", RESULT)
+    assert cache.get("a") == RESULT
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_disk_hits_count_towards_hit_rate(tmp_path):
+    ResultCache(1024 * 1024, str(tmp_path)).put("a", RESULT)
+    cache = ResultCache(1024 * 1024, str(tmp_path))
+    # 第一次从磁盘读入，第二次命中内存
+    assert cache.get("a") == RESULT
+    assert cache.get("a") == RESULT
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["disk_hits"]) == (2, 1, 1)
+    assert stats["hit_rate"] == 2 / 3
+
+
+def test_corrupt_disk_entry_is_a_miss(tmp_path):
+    cache = ResultCache(1024 * 1024, str(tmp_path))
+    (tmp_path / "a.json").write_text("{", encoding='utf-8')
+    assert cache.get("a") is None
@@ -0,0 +1,59 @@
+import json
+import sys
+
+from PIL import Image
+
+import cli
+import metrics
+from imaging import ORIENTATION
+
+
+def save_jpeg(path, size, orientation=None):
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ORIENTATION] = orientation
+    Image.new('RGB', size, (200, 30, 30)).save(path, exif=exif)
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    monkeypatch.setattr(sys, 'argv', ['cli.py', *args, '-b', 'stub', '-w', '1'])
+    cli.main()
+
+
+def test_decode_applies_exif_orientation(tmp_path):
+    path = str(tmp_path / 'rotated.jpg')
+    save_jpeg(path, (320, 240), orientation=6)
+    image, width, height, _ = cli.decode(path)
+    assert (width, height) == image.size == (240, 320)
+    image, width, height, _ = cli.decode(path, 64 * 28 * 28, 256 * 28 * 28)
+    assert (width, height) == (240, 320)
+    assert image.height > image.width
+
+
+def test_records_report_upright_sizes(tmp_path, monkeypatch):
+    save_jpeg(tmp_path / 'upright.jpg', (320, 240))
+    save_jpeg(tmp_path / 'rotated.jpg', (320, 240), orientation=6)
+    output = tmp_path / 'results.jsonl'
+    run(monkeypatch, str(tmp_path), '-q', '找树', '-o', str(output))
+    records = {json.loads(line)['image'].rsplit('/', 1)[1]: json.loads(line) for line in output.open(encoding='utf-8')}
+    assert (records['upright.jpg']['width'], records['upright.jpg']['height']) == (320, 240)
+    assert (records['rotated.jpg']['width'], records['rotated.jpg']['height']) == (240, 320)
+    for record in records.values():
+        for detection in record['detections']:
+            x1, y1, x2, y2 = detection['bbox_2d']
+            assert 0 <= x1 <= x2 <= record['width'] and 0 <= y1 <= y2 <= record['height']
+
+
+def test_manifest_lines_without_query_are_errors(tmp_path, monkeypatch):
+    save_jpeg(tmp_path / 'a.jpg', (64, 48))
+    manifest = tmp_path / 'train.jsonl'
+    manifest.write_text(json.dumps({"image": ["a.jpg"], "query": "找树"}) + '\n'
+                        + json.dumps({"image": "a.jpg"}) + '\n', encoding='utf-8')
+    output = tmp_path / 'results.jsonl'
+    run(monkeypatch, str(manifest), '-o', str(output))
+    first, second = [json.loads(line) for line in output.open(encoding='utf-8')]
+    if first['query'] is None:
+        first, second = second, first
+    assert first['query'] == "找树" and not first.get('error')
+    assert second['query'] is None and "缺少查询" in second['error']
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+import torch
+from transformers import TextIteratorStreamer
+
+from service.local import GenerationStream, GenerationError
+
+
+def collect(stream):
+    return list(stream)
+
+
+def test_text_is_streamed_until_generation_ends():
+    streamer = TextIteratorStreamer(None, timeout=5)
+
+    def generate(streamer, stopping_criteria):
+        streamer.on_finalized_text("{\"answer\"")
+        streamer.on_finalized_text(": \"\"}", stream_end=True)
+
+    assert "".join(collect(GenerationStream(streamer, generate, {"streamer": streamer}))) == "{\"answer\": \"\"}"
+
+
+def test_generation_error_is_raised_in_the_consumer():
+    streamer = TextIteratorStreamer(None, timeout=5)
+
+    def generate(streamer, stopping_criteria):
+        streamer.on_finalized_text("{")
+        raise RuntimeError("CUDA out of memory")
+
+    start = time.perf_counter()
+    with pytest.raises(GenerationError, match="out of memory"):
+        collect(GenerationStream(streamer, generate, {"streamer": streamer}))
+    assert time.perf_counter() - start < 5
+
+
+def test_timeout_fails_the_request_and_stops_generation():
+    streamer = TextIteratorStreamer(None, timeout=0.2)
+    steps = []
+
+    def generate(streamer, stopping_criteria):
+        # 模拟一直不输出文本的生成，每步检查停止条件
+        input_ids = torch.zeros((1, 1), dtype=torch.long)
+        while not stopping_criteria(input_ids, None).all():
+            steps.append(1)
+            time.sleep(0.05)
+
+    stream = GenerationStream(streamer, generate, {"streamer": streamer})
+    with pytest.raises(GenerationError):
+        collect(stream)
+    stream.thread.join(1)
+    assert not stream.thread.is_alive()
+
+
+def test_streamed_request_traces_the_same_stages_as_detect(monkeypatch, processor_path):
+    import importlib
+
+    import numpy as np
+    from PIL import Image
+
+    import metrics
+    from benchmark.common import tiny_local_model
+    from service.registry import registry
+
+    detect_module = importlib.import_module('core.detect')
+    local_model = tiny_local_model(processor_path, min_pixels=16 * 28 * 28, max_pixels=64 * 28 * 28)
+    # 第二个请求不应命中视觉特征缓存，两次都完整地经过各个阶段
+    local_model.constrained = False
+    local_model.vision_cache = None
+    generate_locked = local_model.generate_locked
+    # 随机初始化的模型不会自己结束，只生成几个token
+    monkeypatch.setattr(local_model, 'generate_locked',
+                        lambda **kwargs: generate_locked(**{**kwargs, 'max_new_tokens': 4}))
+    monkeypatch.setitem(registry.models, 'local', local_model)
+    monkeypatch.setattr(detect_module, 'schedulers', {})
+    monkeypatch.setattr(detect_module, 'result_cache', None)
+    monkeypatch.setattr(detect_module, 'output_sink', None)
+    monkeypatch.setattr(metrics, 'enabled', True)
+    traces = []
+    monkeypatch.setattr(metrics, 'trace',
+                        lambda name, **attrs: traces.append(metrics.Trace(name, **attrs)) or traces[-1])
+
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (112, 140, 3), dtype=np.uint8))
+    detect_module.detect(image, "找树", backend='local')
+    list(detect_module.detect_stream(image, "找树", backend='local'))
+    batched, streamed = ({span['name']: span for span in trace.spans} for trace in traces)
+    # 流式请求不经过调度器，没有排队和整体推理阶段
+    assert set(streamed) == set(batched) - {'queue', 'inference'}
+    assert {'preprocess', 'prefill', 'decode'} <= set(streamed)
+    assert streamed['decode']['generated_tokens'] == batched['decode']['generated_tokens'] == 4
+    assert streamed['preprocess']['prompt_tokens'] == batched['preprocess']['prompt_tokens']
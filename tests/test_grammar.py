@@ -0,0 +1,85 @@
+import random
+
+import pytest
+from transformers import AutoProcessor
+
+from benchmark.grammar import fuzz, serialize
+from core.annotate import parse_boxes
+from core.detect import parse_response
+from prompt import format_prompt, PROMPT, COMPACT_PROMPT
+from service.grammar import DetectionGrammar, GrammarIndex, prompt_grammar
+
+DETECTIONS = [{"bbox_2d": [12, 0, 340, 56], "label": "帆船"}, {"bbox_2d": [7, 8, 9, 10], "label": "树\"1\""}]
+
+
+def walk(grammar, text):
+    state = grammar.start
+    for byte in text.encode():
+        state = grammar.step(state, byte)
+        if state is None:
+            return None
+    return state
+
+
+def accepts(grammar, text):
+    state = walk(grammar, text)
+    return state is not None and grammar.accepts(state)
+
+
+@pytest.mark.parametrize('name', ['json', 'compact'])
+def test_serialized_outputs_are_accepted(name):
+    grammar = DetectionGrammar(compact=name == 'compact')
+    for detections in ([], DETECTIONS):
+        assert accepts(grammar, serialize("图中有帆船和树。", detections, name))
+
+
+def test_json_coordinates_may_be_quoted_or_not():
+    grammar = DetectionGrammar()
+    # PROMPT示例的带引号坐标和不带引号的坐标，也可以混用
+    assert accepts(grammar, '{"answer": "a", "detections": [{"bbox_2d": ["1", "20", "300", "4000"], "label": "x"}]}')
+    assert accepts(grammar, '{"answer": "a", "detections": [{"bbox_2d": [1, 20, 300, 4000], "label": "x"}]}')
+    assert accepts(grammar, '{"answer": "a", "detections": [{"bbox_2d": ["1", 20, "0", 4], "label": "x"}]}')
+    prefix = '{"answer": "a", "detections": [{"bbox_2d": ['
+    for coordinate in ['""', '"1', '"1a"', '"01"', '"123456"', '1"', "'1'"]:
+        assert walk(grammar, prefix + coordinate + ', 2, 3, 4], "label": "x"}]}') is None, coordinate
+
+
+def test_compact_coordinates_are_unquoted_integers():
+    grammar = DetectionGrammar(compact=True)
+    assert accepts(grammar, '{"answer":"a","detections":[[1,2,3,4,"x"]]}')
+    assert walk(grammar, '{"answer":"a","detections":[["1",2,3,4,"x"]]}') is None
+    assert walk(grammar, '{"answer": "a"') is None
+
+
+def test_fenced_json_must_close():
+    grammar = DetectionGrammar()
+    body = '{"answer": "a", "detections": []}'
+    assert accepts(grammar, f"```json\n{body}\n```")
+    assert not accepts(grammar, f"```json\n{body}")
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_random_walks_parse(compact):
+    assert fuzz(DetectionGrammar(compact=compact), random.Random(0), 200) == 200
+
+
+def test_prompt_selects_format():
+    assert prompt_grammar(format_prompt(PROMPT, query="找树")) == 'json'
+    assert prompt_grammar(format_prompt(COMPACT_PROMPT, query="找树")) == 'compact'
+    assert prompt_grammar("找树") is None
+
+
+def test_index_follows_grammar_over_tokens(processor_path):
+    tokenizer = AutoProcessor.from_pretrained(processor_path).tokenizer
+    index = GrammarIndex(DetectionGrammar(), tokenizer)
+    text = serialize("图中有帆船和树。", DETECTIONS, 'json')
+    state = index.grammar.start
+    for token_id in tokenizer(text).input_ids:
+        # 输出的每个token都不被屏蔽
+        assert not index.mask(state, len(tokenizer), 'cpu')[token_id]
+        state = index.advance(state, token_id)
+    assert index.grammar.accepts(state)
+    assert not index.mask(state, len(tokenizer), 'cpu')[index.eos].any()
+    boxes, labels = parse_boxes(parse_response(text)[1])
+    assert boxes.tolist() == [detection['bbox_2d'] for detection in DETECTIONS]
+    assert labels == [detection['label'] for detection in DETECTIONS]
@@ -0,0 +1,52 @@
+import importlib
+
+from PIL import Image
+from transformers import AutoProcessor
+
+import metrics
+from imaging import load_image
+from service.local import LocalModel
+from service.stub import StubModel
+
+# core包导出的detect函数与子模块同名
+detect_module = importlib.import_module('core.detect')
+
+
+def save_jpeg(path, size, orientation=None):
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    Image.new('RGB', size, (200, 30, 30)).save(path, quality=90, exif=exif)
+    return str(path)
+
+
+def test_local_model_exposes_processor_pixel_range(processor_path):
+    model = LocalModel(processor_path=processor_path)
+    assert (model.min_pixels, model.max_pixels) == (None, None)
+    model.processor = AutoProcessor.from_pretrained(processor_path)
+    assert (model.min_pixels, model.max_pixels) == (32 * 28 * 28, 128 * 28 * 28)
+
+
+def test_load_input_draft_decodes_to_the_local_pixel_range(tmp_path, processor_path, monkeypatch):
+    monkeypatch.setattr(detect_module, 'TILING', False)
+    model = LocalModel(processor_path=processor_path)
+    model.processor = AutoProcessor.from_pretrained(processor_path)
+    path = save_jpeg(tmp_path / 'large.jpg', (4000, 3000))
+    image, size = detect_module.load_input(path, model, metrics.span)
+    assert size == (4000, 3000)
+    # 128*28*28像素的目标约为363x272，JPEG按1/8缩小到500x375
+    assert image.size == (500, 375)
+
+
+def test_load_input_keeps_full_resolution_for_tiling(tmp_path, monkeypatch):
+    monkeypatch.setattr(detect_module, 'TILING', True)
+    path = save_jpeg(tmp_path / 'large.jpg', (4000, 3000))
+    image, size = detect_module.load_input(path, StubModel(), metrics.span)
+    assert image.size == size == (4000, 3000)
+
+
+def test_exif_orientation_swaps_size(tmp_path):
+    path = save_jpeg(tmp_path / 'rotated.jpg', (800, 600), orientation=6)
+    image, size = load_image(path, max_side=200, transpose=True)
+    assert size == (600, 800)
+    assert image.width < image.height
@@ -0,0 +1,37 @@
+import math
+import os
+
+import pytest
+import torch
+from transformers import AutoProcessor, Qwen2_5_VLForConditionalGeneration
+
+from benchmark.collate import make_manifest, load_examples
+from benchmark.common import tiny_config
+from collator import QwenVLCollator, PackingCollator
+
+# 测试用分词器下每个样本约300个token，600时两个样本打包到一行且都不截断
+MAX_SEQ_LENGTH = 600
+MAX_IMAGE_SIDE = 256
+
+
+@pytest.mark.parametrize('attn', ['sdpa', 'eager'])
+def test_packed_loss_matches_padded_loss(tmp_path, processor_path, attn):
+    make_manifest(str(tmp_path), 4)
+    examples = load_examples(os.path.join(tmp_path, 'train.jsonl'))
+    processor = AutoProcessor.from_pretrained(processor_path)
+    padded = QwenVLCollator(processor, max_seq_length=MAX_SEQ_LENGTH, max_img_side_length=MAX_IMAGE_SIDE)
+    packed = PackingCollator(processor, max_seq_length=MAX_SEQ_LENGTH, max_img_side_length=MAX_IMAGE_SIDE)
+    padded_batch, packed_batch = padded(examples), packed(examples)
+    assert len(packed_batch['input_ids']) < len(examples)
+    # 回答没有被截断，两边计算损失的token相同
+    assert (padded_batch['labels'] != -100).sum() == (packed_batch['labels'] != -100).sum() > 0
+
+    torch.manual_seed(2025)
+    config = tiny_config()
+    config._attn_implementation = attn
+    model = Qwen2_5_VLForConditionalGeneration(config).float().eval()
+    with torch.no_grad():
+        padded_loss = model(**padded_batch).loss.item()
+        packed_loss = model(**packed_batch).loss.item()
+    assert math.isfinite(padded_loss)
+    assert packed_loss == pytest.approx(padded_loss, abs=1e-4)
@@ -0,0 +1,31 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from finetune.process import image_bytes
+from imaging import ORIENTATION
+
+
+def jpeg(orientation=None, size=(64, 48)):
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ORIENTATION] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+def test_upright_jpeg_is_copied():
+    for orientation in (None, 1):
+        data = jpeg(orientation)
+        assert image_bytes({"bytes": data, "path": None}) == (data, (64, 48))
+
+
+def test_rotated_jpeg_is_transposed_like_datasets():
+    data, size = image_bytes({"bytes": jpeg(6), "path": None})
+    assert size == (48, 64)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.size == (48, 64)
+        assert image.getexif().get(ORIENTATION, 1) == 1
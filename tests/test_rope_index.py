@@ -0,0 +1,261 @@
+import random
+from functools import partial
+
+import pytest
+import torch
+
+from finetune.collator import QwenVLCollator
+
+IMAGE_TOKEN_ID = 151655
+VIDEO_TOKEN_ID = 151656
+VISION_START_TOKEN_ID = 151652
+VISION_END_TOKEN_ID = 151653
+PAD_TOKEN_ID = 151643
+
+
+def legacy_get_rope_index(
+    spatial_merge_size=2,
+    input_ids=None,
+    image_grid_thw=None,
+    video_grid_thw=None,
+    second_per_grid_ts=None,
+    attention_mask=None,
+):
+    # 原实现：逐行转换为列表，逐段查找视觉token并拼接位置
+    image_token_id = 151655
+    video_token_id = 151656
+    vision_start_token_id = 151652
+    mrope_position_deltas = []
+    if input_ids is not None and (
+        image_grid_thw is not None or video_grid_thw is not None
+    ):
+        total_input_ids = input_ids
+        if attention_mask is None:
+            attention_mask = torch.ones_like(total_input_ids)
+        position_ids = torch.ones(
+            3,
+            input_ids.shape[0],
+            input_ids.shape[1],
+            dtype=input_ids.dtype,
+            device=input_ids.device,
+        )
+        image_index, video_index = 0, 0
+        for i, input_ids in enumerate(total_input_ids):
+            input_ids = input_ids[attention_mask[i] == 1]
+            image_nums, video_nums = 0, 0
+            vision_start_indices = torch.argwhere(
+                input_ids == vision_start_token_id
+            ).squeeze(1)
+            vision_tokens = input_ids[vision_start_indices + 1]
+            image_nums = (vision_tokens == image_token_id).sum()
+            video_nums = (vision_tokens == video_token_id).sum()
+            input_tokens = input_ids.tolist()
+            llm_pos_ids_list: list = []
+            st = 0
+            remain_images, remain_videos = image_nums, video_nums
+            for _ in range(image_nums + video_nums):
+                if image_token_id in input_tokens and remain_images > 0:
+                    ed_image = input_tokens.index(image_token_id, st)
+                else:
+                    ed_image = len(input_tokens) + 1
+                if video_token_id in input_tokens and remain_videos > 0:
+                    ed_video = input_tokens.index(video_token_id, st)
+                else:
+                    ed_video = len(input_tokens) + 1
+                if ed_image < ed_video:
+                    t, h, w = (
+                        image_grid_thw[image_index][0],
+                        image_grid_thw[image_index][1],
+                        image_grid_thw[image_index][2],
+                    )
+                    image_index += 1
+                    remain_images -= 1
+                    ed = ed_image
+                else:
+                    t, h, w = (
+                        video_grid_thw[video_index][0],
+                        video_grid_thw[video_index][1],
+                        video_grid_thw[video_index][2],
+                    )
+                    video_index += 1
+                    remain_videos -= 1
+                    ed = ed_video
+                llm_grid_t, llm_grid_h, llm_grid_w = (
+                    t.item(),
+                    h.item() // spatial_merge_size,
+                    w.item() // spatial_merge_size,
+                )
+                text_len = ed - st
+
+                st_idx = (
+                    llm_pos_ids_list[-1].max() + 1
+                    if len(llm_pos_ids_list) > 0
+                    else 0
+                )
+                llm_pos_ids_list.append(
+                    torch.arange(text_len).view(1, -1).expand(3, -1) + st_idx
+                )
+
+                t_index = (
+                    torch.arange(llm_grid_t)
+                    .view(-1, 1)
+                    .expand(-1, llm_grid_h * llm_grid_w)
+                    .flatten()
+                )
+                h_index = (
+                    torch.arange(llm_grid_h)
+                    .view(1, -1, 1)
+                    .expand(llm_grid_t, -1, llm_grid_w)
+                    .flatten()
+                )
+                w_index = (
+                    torch.arange(llm_grid_w)
+                    .view(1, 1, -1)
+                    .expand(llm_grid_t, llm_grid_h, -1)
+                    .flatten()
+                )
+                llm_pos_ids_list.append(
+                    torch.stack([t_index, h_index, w_index]) + text_len + st_idx
+                )
+                st = ed + llm_grid_t * llm_grid_h * llm_grid_w
+
+            if st < len(input_tokens):
+                st_idx = (
+                    llm_pos_ids_list[-1].max() + 1
+                    if len(llm_pos_ids_list) > 0
+                    else 0
+                )
+                text_len = len(input_tokens) - st
+                llm_pos_ids_list.append(
+                    torch.arange(text_len).view(1, -1).expand(3, -1) + st_idx
+                )
+
+            llm_positions = torch.cat(llm_pos_ids_list, dim=1).reshape(3, -1)
+            position_ids[..., i, attention_mask[i] == 1] = llm_positions.to(
+                position_ids.device
+            )
+            mrope_position_deltas.append(
+                llm_positions.max() + 1 - len(total_input_ids[i])
+            )
+        mrope_position_deltas = torch.tensor(
+            mrope_position_deltas, device=input_ids.device
+        ).unsqueeze(1)
+        return position_ids, mrope_position_deltas
+    else:
+        if attention_mask is not None:
+            position_ids = attention_mask.long().cumsum(-1) - 1
+            position_ids.masked_fill_(attention_mask == 0, 1)
+            position_ids = (
+                position_ids.unsqueeze(0)
+                .expand(3, -1, -1)
+                .to(attention_mask.device)
+            )
+            max_position_ids = position_ids.max(0, keepdim=False)[0].max(
+                -1, keepdim=True
+            )[0]
+            mrope_position_deltas = max_position_ids + 1 - attention_mask.shape[-1]
+        else:
+            position_ids = (
+                torch.arange(input_ids.shape[1], device=input_ids.device)
+                .view(1, 1, -1)
+                .expand(3, input_ids.shape[0], -1)
+            )
+            mrope_position_deltas = torch.zeros(
+                [input_ids.shape[0], 1],
+                device=input_ids.device,
+                dtype=input_ids.dtype,
+            )
+
+        return position_ids, mrope_position_deltas
+
+
+# get_rope_index_2不使用self
+rope_index = partial(QwenVLCollator.get_rope_index_2, None)
+
+
+def random_batch(rng, batch_size, merge_size=2, padding='right'):
+    # 随机数量、尺寸、顺序的图像和视频，中间夹随机长度的文本
+    rows, image_grids, video_grids = [], [], []
+    for _ in range(batch_size):
+        row = []
+        for _ in range(rng.randint(0, 3)):
+            row += [rng.randrange(PAD_TOKEN_ID) for _ in range(rng.randint(0, 5))]
+            video = rng.random() < 0.4
+            grid = [rng.randint(1, 3) if video else 1, rng.randint(1, 4) * merge_size, rng.randint(1, 4) * merge_size]
+            (video_grids if video else image_grids).append(grid)
+            count = grid[0] * grid[1] * grid[2] // merge_size ** 2
+            row += [VISION_START_TOKEN_ID] + [VIDEO_TOKEN_ID if video else IMAGE_TOKEN_ID] * count + [VISION_END_TOKEN_ID]
+        row += [rng.randrange(PAD_TOKEN_ID) for _ in range(rng.randint(1, 6))]
+        rows.append(row)
+
+    length = max(len(row) for row in rows) + (rng.randint(0, 3) if padding == 'random' else 0)
+    input_ids = torch.full((batch_size, length), PAD_TOKEN_ID, dtype=torch.long)
+    attention_mask = torch.zeros(batch_size, length, dtype=torch.long)
+    for i, row in enumerate(rows):
+        if padding == 'left':
+            positions = torch.arange(length - len(row), length)
+        elif padding == 'random':
+            # 填充散布在任意位置，包括视觉token之间
+            positions = torch.tensor(sorted(rng.sample(range(length), len(row))))
+        else:
+            positions = torch.arange(len(row))
+        input_ids[i, positions] = torch.tensor(row)
+        attention_mask[i, positions] = 1
+    image_grid_thw = torch.tensor(image_grids, dtype=torch.long) if image_grids else None
+    video_grid_thw = torch.tensor(video_grids, dtype=torch.long) if video_grids else None
+    return input_ids, image_grid_thw, video_grid_thw, attention_mask
+
+
+def check(trials, seed, paddings=('right', 'left', 'random')):
+    # 随机输入上与原实现逐位一致，包括dtype
+    rng = random.Random(seed)
+    for _ in range(trials):
+        merge_size = rng.choice([1, 2])
+        padding = rng.choice(paddings)
+        input_ids, image_grid_thw, video_grid_thw, attention_mask = random_batch(
+            rng, rng.randint(1, 8), merge_size, padding)
+        if padding == 'right' and rng.random() < 0.3 and bool(attention_mask.all()):
+            attention_mask = None
+        expected = legacy_get_rope_index(merge_size, input_ids, image_grid_thw, video_grid_thw,
+                                         attention_mask=attention_mask)
+        actual = rope_index(merge_size, input_ids, image_grid_thw, video_grid_thw, attention_mask=attention_mask)
+        for e, a in zip(expected, actual):
+            assert e.dtype == a.dtype and e.shape == a.shape and torch.equal(e, a), \
+                (input_ids, image_grid_thw, video_grid_thw, attention_mask, e, a)
+
+
+@pytest.mark.parametrize('padding', ['right', 'left', 'random'])
+def test_matches_legacy_on_random_batches(padding):
+    # 图像和视频的数量、尺寸、顺序随机，填充在右侧、左侧或散布在视觉token之间
+    check(300, 2025, (padding,))
+
+
+@pytest.mark.parametrize('padding', ['right', 'left', 'random'])
+def test_truncated_vision_blocks_keep_their_positions(padding):
+    # 按max_seq_length截断时最后一段视觉token可能只剩一部分，保留的位置与不截断时相同
+    rng = random.Random(2026)
+    truncated = 0
+    for _ in range(300):
+        merge_size = rng.choice([1, 2])
+        input_ids, image_grid_thw, video_grid_thw, attention_mask = random_batch(
+            rng, rng.randint(1, 8), merge_size, padding)
+        if image_grid_thw is None and video_grid_thw is None:
+            continue
+        # 每段视觉token的第一个token都要保留，否则后面的网格对应不上
+        first = 0
+        for row, mask in zip(input_ids, attention_mask):
+            columns = mask.nonzero().squeeze(1)
+            starts = (row[columns[:-1]] == VISION_START_TOKEN_ID).nonzero().squeeze(1)
+            if len(starts):
+                first = max(first, int(columns[starts[-1] + 1]))
+        length = rng.randint(first + 1, input_ids.shape[1])
+        expected, _ = legacy_get_rope_index(merge_size, input_ids, image_grid_thw, video_grid_thw,
+                                            attention_mask=attention_mask)
+        expected = expected[..., :length]
+        mask = attention_mask[:, :length]
+        position_ids, deltas = rope_index(merge_size, input_ids[:, :length], image_grid_thw, video_grid_thw,
+                                          attention_mask=mask)
+        assert torch.equal(position_ids, expected)
+        assert torch.equal(deltas, (expected.masked_fill(mask == 0, 0).amax(dim=(0, 2)) + 1 - length).unsqueeze(1))
+        truncated += bool(((input_ids[:, length:] == IMAGE_TOKEN_ID) | (input_ids[:, length:] == VIDEO_TOKEN_ID)).any())
+    assert truncated > 0
@@ -0,0 +1,96 @@
+import importlib
+import threading
+
+import pytest
+from PIL import Image
+
+from core.detect import acquire_stream_slot, get_runner
+from core.scheduler import BatchScheduler, SchedulerOverloaded
+from service.stub import StubModel
+
+# core包导出的detect函数与子模块同名
+detect_module = importlib.import_module('core.detect')
+
+
+class BlockingModel(StubModel):
+    # 推理在release之前一直阻塞，用来占住调度器的工作线程
+    def __init__(self):
+        super().__init__(detections=1)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def inference_batch(self, images, prompts):
+        self.started.set()
+        self.release.wait(5)
+        return super().inference_batch(images, prompts)
+
+
+IMAGE = Image.new('RGB', (64, 64))
+
+
+def test_queue_limit_holds_under_concurrent_submitters():
+    model = BlockingModel()
+    scheduler = BatchScheduler(model, max_batch_size=1, max_wait_ms=0, max_queue=5)
+    first = scheduler.submit(IMAGE, "")
+    assert model.started.wait(5)
+    accepted, rejected = [], []
+    barrier = threading.Barrier(20)
+
+    def submit():
+        barrier.wait()
+        try:
+            accepted.append(scheduler.submit(IMAGE, ""))
+        except SchedulerOverloaded:
+            rejected.append(1)
+
+    threads = [threading.Thread(target=submit) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (len(accepted), len(rejected)) == (5, 15)
+    assert scheduler.stats()["rejected"] == 15
+    model.release.set()
+    for future in [first] + accepted:
+        assert future.result(5)[0].startswith("```json")
+    scheduler.close()
+    scheduler.thread.join(5)
+
+
+def test_close_drains_queue_and_stops_worker():
+    model = BlockingModel()
+    scheduler = BatchScheduler(model, max_batch_size=2, max_wait_ms=0, max_queue=4)
+    futures = [scheduler.submit(IMAGE, "") for _ in range(3)]
+    closer = threading.Thread(target=scheduler.close)
+    closer.start()
+    model.release.set()
+    closer.join(5)
+    scheduler.thread.join(5)
+    assert not scheduler.thread.is_alive()
+    assert all(future.done() for future in futures)
+    with pytest.raises(SchedulerOverloaded):
+        scheduler.submit(IMAGE, "")
+
+
+def test_replacing_the_model_stops_the_old_scheduler(monkeypatch):
+    monkeypatch.setattr(detect_module, 'schedulers', {})
+    old = get_runner('local', StubModel())
+    old.inference(IMAGE, "")
+    assert get_runner('local', old.model) is old
+    new = get_runner('local', StubModel())
+    assert new is not old
+    old.thread.join(5)
+    assert not old.thread.is_alive()
+    new.close()
+
+
+def test_stream_slots_reject_beyond_the_limit(monkeypatch):
+    monkeypatch.setattr(detect_module, 'stream_slots', {})
+    monkeypatch.setattr(detect_module, 'STREAM_CONCURRENCY', 2)
+    assert acquire_stream_slot('api') is None
+    slots = [acquire_stream_slot('local'), acquire_stream_slot('local')]
+    with pytest.raises(SchedulerOverloaded):
+        acquire_stream_slot('local')
+    slots[0].release()
+    acquire_stream_slot('local').release()
+    slots[1].release()
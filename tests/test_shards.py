@@ -0,0 +1,69 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from transformers import AutoProcessor
+
+from collator import QwenVLCollator, PretokenizedDataset, PretokenizedCollator
+from pretokenize import load_examples, pretokenize
+
+MAX_SEQ_LENGTH = 256
+MAX_IMAGE_SIDE = 256
+
+
+def make_manifest(path, samples):
+    # 合成的JPEG和标注，格式同process.py的输出；尺寸不同，覆盖横竖图和需要缩小的图
+    rng = np.random.default_rng(2025)
+    sizes = [(640, 480), (300, 200), (500, 375), (240, 360)]
+    os.makedirs(os.path.join(path, 'train'))
+    with open(os.path.join(path, 'train.jsonl'), 'w', encoding='utf-8') as f:
+        for i in range(samples):
+            width, height = sizes[i % len(sizes)]
+            image_path = os.path.join(path, 'train', f"{i + 1:06d}.jpg")
+            pixels = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+            Image.fromarray(pixels).resize((width, height)).save(image_path, quality=90)
+            x, y = int(rng.integers(0, width // 2)), int(rng.integers(0, height // 2))
+            bbox = [x, y, x + int(rng.integers(1, width // 2)), y + int(rng.integers(1, height // 2))]
+            f.write(json.dumps({"image": [image_path], "query": f"what is written on sign {i}?",
+                                "response": json.dumps({"bbox_2d": bbox})}) + '\n')
+
+
+@pytest.fixture(scope='module')
+def shards(tmp_path_factory, processor_path):
+    root = str(tmp_path_factory.mktemp('data'))
+    make_manifest(root, 7)
+    save_path = os.path.join(root, 'pretokenized')
+    # 7条样本分成3个分片，最后一个分片不满
+    pretokenize(root, save_path, processor_path, ['train'], MAX_SEQ_LENGTH, MAX_IMAGE_SIDE, shard_size=3,
+                num_proc=1)
+    return load_examples(os.path.join(root, 'train.jsonl')), os.path.join(save_path, 'train')
+
+
+@pytest.mark.parametrize('batch', [[0], [2, 3, 4], [6, 1], list(range(7))])
+def test_memmap_batches_match_online_collation(shards, processor_path, batch):
+    examples, path = shards
+    online = QwenVLCollator(AutoProcessor.from_pretrained(processor_path), max_seq_length=MAX_SEQ_LENGTH,
+                            max_img_side_length=MAX_IMAGE_SIDE)
+    dataset = PretokenizedDataset(path)
+    assert len(dataset) == len(examples)
+    expected = online([examples[i] for i in batch])
+    actual = PretokenizedCollator()([dataset[i] for i in batch])
+    assert set(actual) == set(expected)
+    for key, value in expected.items():
+        assert actual[key].shape == value.shape, key
+        if key == 'attention_mask':
+            assert torch.equal(actual[key].long(), value.long())
+        else:
+            assert actual[key].dtype == value.dtype, key
+            assert torch.equal(actual[key], value), key
+
+
+def test_existing_shards_are_skipped(shards, processor_path):
+    _, path = shards
+    before = {name: os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)}
+    pretokenize(os.path.dirname(os.path.dirname(path)), os.path.dirname(path), processor_path, ['train'],
+                MAX_SEQ_LENGTH, MAX_IMAGE_SIDE, shard_size=3, num_proc=1)
+    assert {name: os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)} == before
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from transformers import Qwen2Config, Qwen2ForCausalLM, Qwen2_5_VLForConditionalGeneration
+
+from benchmark.common import tiny_config, tiny_local_model
+from service.local import draft_generate, patchable_prefill
+
+MAX_TOKENS = 24
+PROMPTS = ["图里面有什么？", "标注帆船和树"]
+
+
+@pytest.fixture(scope='module')
+def local_model(processor_path):
+    local_model = tiny_local_model(processor_path, min_pixels=16 * 28 * 28, max_pixels=64 * 28 * 28,
+                                   num_hidden_layers=4)
+    # 草稿模型以float32加载，投机解码不经过前缀缓存和视觉特征缓存，基线同样关闭
+    local_model.quantize = False
+    local_model.use_prefix_cache = False
+    local_model.vision_cache = None
+    local_model.constrained = False
+    rng = np.random.default_rng(2025)
+    local_model.images = [Image.fromarray(rng.integers(0, 256, (112, 140, 3), dtype=np.uint8)) for _ in PROMPTS]
+    return local_model
+
+
+def greedy(local_model):
+    return [local_model.inference_batch([image], [prompt], max_tokens=MAX_TOKENS, early_stop=False)[0][0]
+            for image, prompt in zip(local_model.images, PROMPTS)]
+
+
+def save_draft(path, local_model, kind):
+    # self：与主模型相同的权重；shallow：只保留主模型的前两层；text：共用词表的纯文本小模型
+    if kind == 'text':
+        torch.manual_seed(2026)
+        model = Qwen2ForCausalLM(Qwen2Config(vocab_size=151936, hidden_size=32, intermediate_size=64,
+                                             num_hidden_layers=1, num_attention_heads=2, num_key_value_heads=1))
+    else:
+        layers = 2 if kind == 'shallow' else 4
+        model = Qwen2_5_VLForConditionalGeneration(tiny_config(num_hidden_layers=layers))
+        model.load_state_dict(local_model.model.state_dict(), strict=False)
+    model.save_pretrained(str(path))
+    return str(path)
+
+
+@pytest.mark.parametrize('kind', ['self', 'shallow', 'text'])
+def test_greedy_output_is_identical_with_a_draft_model(local_model, tmp_path, kind):
+    local_model.draft_model = None
+    baseline = greedy(local_model)
+    assert all(baseline)
+    local_model.draft_model_path = save_draft(tmp_path / kind, local_model, kind)
+    local_model.draft_model = local_model.load_draft()
+    # 随机权重达不到默认的置信度阈值，每轮只会提出一个token
+    local_model.draft_model.generation_config.assistant_confidence_threshold = 0
+    try:
+        assert greedy(local_model) == baseline
+        assert local_model.draft_model.proposed_tokens > 0
+    finally:
+        local_model.draft_model = None
+
+
+def test_unexpected_prefill_signature_falls_back_to_text_drafting(local_model, tmp_path):
+    local_model.draft_model = None
+    baseline = greedy(local_model)
+    model = Qwen2_5_VLForConditionalGeneration.from_pretrained(save_draft(tmp_path / 'self', local_model, 'self'))
+    assert patchable_prefill(model)
+    prefill = model._prefill
+
+    def changed(input_ids, generation_config, model_kwargs, is_first_iteration=True, extra=None):
+        return prefill(input_ids, generation_config, model_kwargs, is_first_iteration)
+
+    model._prefill = changed
+    assert not patchable_prefill(model)
+    draft = draft_generate(model)
+    # 没有替换_prefill，多模态输入在草稿模型的generate中被丢弃
+    assert model._prefill is changed
+    draft.generation_config.num_assistant_tokens = local_model.draft_tokens
+    draft.generation_config.assistant_confidence_threshold = 0
+    local_model.draft_model = draft
+    try:
+        assert greedy(local_model) == baseline
+        assert draft.proposed_tokens > 0
+    finally:
+        local_model.draft_model = None
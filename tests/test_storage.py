@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from core.storage import OutputSink
+
+USER_FILES = ['notes.txt', 'photo.jpg', '0123456789abcdef.txt', '0123456789ABCDEF.jpg', 'fedcba9876543210.jpg.tmp']
+
+
+def noise(seed):
+    return Image.fromarray(np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8))
+
+
+def test_sink_only_counts_and_evicts_its_own_files(tmp_path):
+    for name in USER_FILES:
+        (tmp_path / name).write_bytes(b'x' * 100000)
+    old = OutputSink(str(tmp_path), 'PNG', max_bytes=None)
+    first = old.submit(noise(0)).result()
+    old.close()
+
+    sink = OutputSink(str(tmp_path), 'PNG', max_bytes=os.path.getsize(first) * 2)
+    sink._start()
+    # 目录中其他文件不计入预算
+    assert list(sink.files) == [first]
+    paths = [sink.submit(noise(seed)).result() for seed in range(1, 4)]
+    sink.close()
+    assert not os.path.exists(first)
+    assert sorted(os.listdir(tmp_path)) == sorted(USER_FILES + [os.path.basename(path) for path in paths[1:]])
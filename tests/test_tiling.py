@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+from PIL import Image
+
+from core.detect import parse_response
+from core.tiling import nms, pairwise_iou, tile_grid, tile_starts, truncated_boxes, TiledRunner
+
+
+class BrightModel:
+    # 返回图块中亮像素的外接框，坐标为图块像素
+    name = "bright"
+
+    def inference_batch(self, images, prompts):
+        results = []
+        for image in images:
+            ys, xs = np.nonzero(np.asarray(image.convert('L')) > 128)
+            detections = [{"bbox_2d": [int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1],
+                           "label": "物体"}] if len(xs) else []
+            results.append((json.dumps({"answer": "有物体", "detections": detections}), None, None))
+        return results
+
+
+def bright_image(width, height, box):
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    x1, y1, x2, y2 = box
+    pixels[y1:y2, x1:x2] = 255
+    return Image.fromarray(pixels)
+
+
+def naive_nms(boxes, labels, scores, iou_threshold):
+    keep = []
+    for i in sorted(range(len(boxes)), key=lambda i: -scores[i]):
+        if all(labels[i] != labels[j] or pairwise_iou(boxes[[i, j]])[0, 1] <= iou_threshold for j in keep):
+            keep.append(i)
+    return keep
+
+
+def test_tiles_cover_image_with_overlap():
+    assert tile_starts(80, 100, 0.25) == [0]
+    assert tile_starts(200, 100, 0.25) == [0, 50, 100]
+    for width, height in [(100, 100), (1000, 300), (3000, 2000)]:
+        tiles = tile_grid(width, height, tile_size=448, overlap=0.2, max_tiles=12)
+        assert len(tiles) <= 12
+        covered = np.zeros((height, width), dtype=bool)
+        for left, top, right, bottom in tiles:
+            covered[top:bottom, left:right] = True
+        assert covered.all()
+
+
+def test_nms_matches_naive_greedy():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        xy = rng.uniform(0, 100, (30, 2))
+        boxes = np.hstack([xy, xy + rng.uniform(5, 40, (30, 2))])
+        labels = rng.choice(["树", "Tree ", "人"], 30).tolist()
+        scores = rng.uniform(size=30)
+        # 类别比较忽略大小写和首尾空白
+        normalized = [label.strip().lower() for label in labels]
+        assert nms(boxes, labels, scores, 0.3).tolist() == naive_nms(boxes, normalized, scores, 0.3)
+    assert nms([], [], []).tolist() == []
+
+
+def test_truncated_boxes_ignore_image_border():
+    boxes = np.array([[0, 10, 20, 30], [30, 10, 50, 30], [80, 10, 99, 30]], dtype=np.float64)
+    # 左边是原图边界，右边是图块内部边界
+    assert truncated_boxes(boxes, (0, 0, 100, 100), 200, 100, 2).tolist() == [False, False, True]
+    assert truncated_boxes(boxes, (100, 0, 200, 100), 200, 100, 2).tolist() == [True, False, False]
+
+
+def test_tiled_runner_merges_overlapping_tiles():
+    image = bright_image(200, 100, (60, 10, 90, 40))
+    runner = TiledRunner(BrightModel(), parse_response, tile_size=100, overlap=0.25, include_global=False)
+    answer, detections = parse_response(runner.inference(image, "找物体")[0])
+    assert answer == "有物体"
+    assert detections == [{"bbox_2d": [60.0, 10.0, 90.0, 40.0], "label": "物体"}]
+
+
+def test_tiled_runner_drops_boxes_cut_by_tiles():
+    # 物体跨越第二个图块的左边界，截断的部分交给完整看到它的图块和整图
+    image = bright_image(200, 100, (40, 10, 70, 40))
+    runner = TiledRunner(BrightModel(), parse_response, tile_size=100, overlap=0.25, include_global=True)
+    _, detections = parse_response(runner.inference(image, "找物体")[0])
+    assert detections == [{"bbox_2d": [40.0, 10.0, 70.0, 40.0], "label": "物体"}]
+
+
+def test_tiled_runner_returns_raw_response_when_nothing_parses():
+    class BrokenModel:
+        name = "broken"
+
+        def inference_batch(self, images, prompts):
+            return [("无法识别", None, None)] * len(images)
+
+    runner = TiledRunner(BrokenModel(), parse_response, tile_size=100, overlap=0.25)
+    assert runner.inference(Image.new('RGB', (200, 100)), "找物体") == ("无法识别", None, None)
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from core.detect import parse_response
+from utils import normalize_detection, parse_json, recover_json, StreamParser
+
+RESPONSE = ('```json\n{"answer": "图中有\\"帆船\\"和树。", "detections": [\n'
+            '  {"bbox_2d": ["1", "2", "30", "40"], "label": "帆船"},\n'
+            '  {"bbox_2d": [5, 6, 70, 80], "label": "树{]"}\n]}\n```')
+DETECTIONS = [{"bbox_2d": ["1", "2", "30", "40"], "label": "帆船"}, {"bbox_2d": [5, 6, 70, 80], "label": "树{]"}]
+
+
+def test_parse_json_strips_code_fence():
+    assert json.loads(parse_json(RESPONSE))["detections"] == DETECTIONS
+    assert parse_json('{"answer": ""}') == '{"answer": ""}'
+
+
+def test_normalize_compact_detection():
+    assert normalize_detection([1, 2, 3, 4, "树"]) == {"bbox_2d": [1, 2, 3, 4], "label": "树"}
+    assert normalize_detection(DETECTIONS[0]) is DETECTIONS[0]
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, len(RESPONSE)])
+def test_stream_parser_is_chunk_independent(size):
+    parser = StreamParser()
+    detections = []
+    for start in range(0, len(RESPONSE), size):
+        detections += parser.feed(RESPONSE[start:start + size])
+        # 回答随生成逐步变长，不会出现不完整的转义
+        assert '图中有"帆船"和树。'.startswith(parser.answer)
+    assert detections == DETECTIONS == parser.detections
+    assert parser.answer == '图中有"帆船"和树。'
+    assert parser.done
+
+
+def test_stream_parser_reads_compact_format():
+    parser = StreamParser()
+    assert parser.feed('{"answer":"a","detections":[[1,2,3,4,"x"],[5,6') == [
+        {"bbox_2d": [1, 2, 3, 4], "label": "x"}]
+    assert parser.feed(',7,8,"y"]]}') == [{"bbox_2d": [5, 6, 7, 8], "label": "y"}]
+
+
+def test_recover_truncated_output():
+    truncated = RESPONSE[:RESPONSE.index('{"bbox_2d": [5')] + '{"bbox_2d": [5, 6'
+    assert recover_json(truncated) == {"answer": '图中有"帆船"和树。', "detections": DETECTIONS[:1]}
+    assert recover_json('{"answer": "图中有') == {"answer": "图中有", "detections": []}
+    assert recover_json("无法识别") is None
+
+
+def test_parse_response_falls_back_to_recovery():
+    assert parse_response(RESPONSE) == ('图中有"帆船"和树。', DETECTIONS)
+    assert parse_response('{"answer":"a","detections":[[1,2,3,4,"x"],[5') == (
+        "a", [{"bbox_2d": [1, 2, 3, 4], "label": "x"}])
+    with pytest.raises(json.JSONDecodeError):
+        parse_response("无法识别")
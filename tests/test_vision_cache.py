@@ -0,0 +1,17 @@
+import inspect
+
+import service.local
+from service.local import LocalModel, supports_vision_cache
+
+
+def test_vision_cache_follows_transformers_support(monkeypatch):
+    assert LocalModel().vision_cache is not None or not supports_vision_cache()
+
+    # transformers 4.x的forward没有mm_encoder_outputs参数
+    def forward(self, input_ids=None, pixel_values=None, image_grid_thw=None):
+        pass
+
+    monkeypatch.setattr(service.local.Qwen2_5_VLModel, 'forward', forward)
+    assert 'mm_encoder_outputs' not in inspect.signature(service.local.Qwen2_5_VLModel.forward).parameters
+    assert not supports_vision_cache()
+    assert LocalModel().vision_cache is None
@@ -1,19 +1,57 @@
 import base64
+import hashlib
 import io
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
 
 from PIL import Image
+from qwen_vl_utils import smart_resize
 
+import metrics
+from config import ENCODE_FORMAT, ENCODE_QUALITY
 
-def encode_image(image):
-    if isinstance(image, Image.Image):
-        buffer = io.BytesIO()
-        # 保存为JPEG格式到缓冲区
-        image.save(buffer, format='JPEG')
-        buffer.seek(0)
-        return base64.b64encode(buffer.read()).decode('utf-8')
-    else:
+
+def encode_image(image, min_pixels=None, max_pixels=None, image_format=ENCODE_FORMAT, quality=ENCODE_QUALITY):
+    return encode_image_bytes(image, min_pixels, max_pixels, image_format, quality)[0]
+
+
+def encode_image_url(image, min_pixels=None, max_pixels=None, image_format=ENCODE_FORMAT, quality=ENCODE_QUALITY):
+    data, image_format = encode_image_bytes(image, min_pixels, max_pixels, image_format, quality)
+    return f"data:image/{image_format.lower()};base64,{data}"
+
+
+def encode_image_bytes(image, min_pixels=None, max_pixels=None, image_format=ENCODE_FORMAT, quality=ENCODE_QUALITY):
+    # 返回(base64数据, 实际格式)
+    if not isinstance(image, Image.Image):
         raise TypeError(f"不支持的图像类型: {type(image)}")
 
+    width, height = image.size
+    if max_pixels is not None:
+        # 服务端会缩放到smart_resize的尺寸，提前缩放以减少上传的数据量
+        # 缩放后的尺寸再次经过smart_resize不会改变，坐标映射保持一致
+        min_pixels = min_pixels or 0
+        if min_pixels <= width * height <= max_pixels:
+            # 尺寸合适的JPEG文件直接上传原始字节
+            filename = getattr(image, 'filename', None)
+            if image.format == 'JPEG' and filename and os.path.isfile(filename):
+                with open(filename, 'rb') as f:
+                    return base64.b64encode(f.read()).decode('utf-8'), 'JPEG'
+        else:
+            with metrics.span('resize', pixels=width * height):
+                input_height, input_width = smart_resize(height, width, min_pixels=min_pixels, max_pixels=max_pixels)
+                # reducing_gap先按整数倍快速缩小，再做插值
+                image = image.resize((input_width, input_height), Image.Resampling.BICUBIC, reducing_gap=2.0)
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    # 保存到缓冲区
+    image.save(buffer, format=image_format, quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8'), image_format
+
 
 def parse_json(text):
     lines = text.splitlines()
@@ -25,6 +63,113 @@ def parse_json(text):
     return text
 
 
+def normalize_detection(detection):
+    # 紧凑格式的[x1, y1, x2, y2, "label"]转换为{"bbox_2d": [x1, y1, x2, y2], "label": "label"}
+    if isinstance(detection, list) and len(detection) == 5:
+        return {"bbox_2d": detection[:4], "label": detection[4]}
+    return detection
+
+
+class StreamParser:
+    # 增量解析流式输出的JSON，提取回答和已经完整的检测结果
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.done = False
+        self.key = None
+        self.expect_value = False
+        self.string_start = 0
+        self.object_start = 0
+        self.answer_start = None
+        self.answer_end = None
+        self.detections = []
+
+    def feed(self, chunk):
+        # 返回本次新解析出的检测结果
+        self.text += chunk
+        new_detections = []
+        text = self.text
+        while self.pos < len(text) and not self.done:
+            ch = text[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self._end_string()
+            elif not self.started:
+                # 跳过```json等前缀
+                if ch == '{':
+                    self.started = True
+                    self.depth = 1
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = self.pos + 1
+                if self.depth == 1 and self.expect_value and self.key == "answer":
+                    self.answer_start = self.pos + 1
+            elif ch in '{[':
+                self.depth += 1
+                # 检测结果是对象，紧凑格式下是数组
+                if self.depth == 3 and self.key == "detections":
+                    self.object_start = self.pos
+            elif ch in '}]':
+                self.depth -= 1
+                if self.depth == 2 and self.key == "detections":
+                    try:
+                        detection = normalize_detection(json.loads(text[self.object_start:self.pos + 1]))
+                        self.detections.append(detection)
+                        new_detections.append(detection)
+                    except json.JSONDecodeError:
+                        pass
+                elif self.depth == 0:
+                    self.done = True
+            elif self.depth == 1:
+                if ch == ':':
+                    self.expect_value = True
+                elif ch == ',':
+                    self.expect_value = False
+            self.pos += 1
+        return new_detections
+
+    def _end_string(self):
+        if self.depth != 1:
+            return
+        if self.expect_value:
+            if self.key == "answer":
+                self.answer_end = self.pos
+        else:
+            self.key = self.text[self.string_start:self.pos]
+
+    @property
+    def answer(self):
+        # 返回目前为止的回答，未结束的字符串也会返回已生成的部分
+        if self.answer_start is None:
+            return ""
+        raw = self.text[self.answer_start:self.answer_end if self.answer_end is not None else len(self.text)]
+        # 去掉末尾不完整的转义序列
+        for end in range(len(raw), max(len(raw) - 6, 0) - 1, -1):
+            try:
+                return json.loads(f'"{raw[:end]}"', strict=False)
+            except json.JSONDecodeError:
+                continue
+        return raw
+
+
+def recover_json(text):
+    # 从截断或格式有误的输出中恢复已经完整的回答和检测结果
+    parser = StreamParser()
+    parser.feed(text)
+    if parser.answer_start is None and not parser.detections:
+        return None
+    return {"answer": parser.answer, "detections": parser.detections}
+
+
 def create_messages(image, prompt, system_prompt=None, min_pixels=256 * 28 * 28, max_pixels=1280 * 28 * 28):
     messages = []
 
@@ -33,12 +178,87 @@ def create_messages(image, prompt, system_prompt=None, min_pixels=256 * 28 * 28,
         messages.append({"role": "system",
                          "content": [{"type": "text", "text": system_prompt}]})
     # 添加用户消息
+    # 支持base64数据或完整的data URL
+    url = image if image.startswith("data:") else f"data:image/jpeg;base64,{image}"
     user_content = [{"type": "image_url",
                      "min_pixels": min_pixels, "max_pixels": max_pixels,
-                     "image_url": {"url": f"data:image/jpeg;base64,{image}"}},
+                     "image_url": {"url": url}},
                     {"type": "text",
                      "text": prompt}, ]
 
     messages.append({"role": "user",
                      "content": user_content})
     return messages
+
+
+def resolve_path(path, manifest):
+    # 清单中的相对路径相对于当前目录、清单所在目录或其上级目录
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    base = os.path.dirname(os.path.abspath(manifest))
+    for root in (base, os.path.dirname(base)):
+        if os.path.exists(os.path.join(root, path)):
+            return os.path.join(root, path)
+    return path
+
+
+def percentile(values, p):
+    # 最近秩法计算百分位数，空序列返回0
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def hash_image(image):
+    # 按像素内容计算图像哈希
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class LRUCache:
+    # 按字节预算淘汰的LRU缓存，线程安全
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.data:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key][0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+            # 超出预算的单项不缓存
+            if size > self.max_bytes:
+                return
+            self.data[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.data.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "evictions": self.evictions, "entries": len(self.data), "bytes": self.size}